@@ -238,3 +238,49 @@ SESSION_SAVE_EVERY_REQUEST = True
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Z-Score: batas waktu (detik) menunggu single-flight lock perhitungan per tahun.
+# Jika lewat, request memakai snapshot Z-Score lama.
+ZSCORE_LOCK_TIMEOUT = int(os.getenv('ZSCORE_LOCK_TIMEOUT', 30))
+
+# Log waktu tunggu single-flight lock (coreapp.utils_lock) ke console,
+# supaya terlihat di log gunicorn / worker antrian Z-Score
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'coreapp.utils_lock': {
+            'handlers': ['console'],
+            'level': os.getenv('LOCK_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
+# Cache: 'peta' menyimpan dokumen GeoJSON peta yang sudah diserialisasi
+# (kunci = versi data, lihat coreapp/utils_peta.py), dibagi antar worker lewat file.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'peta': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('PETA_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'peta')),
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 500,
+        },
+    },
+    'tiles': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('TILES_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'tiles')),
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
+}
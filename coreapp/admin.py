@@ -85,7 +85,7 @@ class RekapSegmenAdmin(admin.ModelAdmin):
 
 @admin.register(AnalisisZScore)
 class AnalisisZScoreAdmin(admin.ModelAdmin):
-    list_display = ['segmen_jalan', 'tahun', 'nilai_zscore', 'kategori']
+    list_display = ['segmen_jalan', 'tahun', 'nilai_zscore', 'kategori', 'versi']
     list_filter = ['tahun', 'kategori', 'segmen_jalan__ruas_jalan']
     search_fields = ['segmen_jalan__ruas_jalan__nama_ruas']
     readonly_fields = ['created_at', 'updated_at']
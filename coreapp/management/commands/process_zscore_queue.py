@@ -0,0 +1,89 @@
+"""
+Management command worker untuk memproses antrian perhitungan ulang Z-Score
+(AntrianZScore) yang ditandai oleh signal kecelakaan.
+
+Setiap scope (tahun, ruas) dihitung sekali saja walaupun ditandai berkali-kali
+(misalnya upload 500 baris), setelah tidak ada penandaan baru selama jendela
+debounce.
+
+Usage: python manage.py process_zscore_queue
+       python manage.py process_zscore_queue --loop --interval 5
+       python manage.py process_zscore_queue --debounce 0   (proses semua sekarang)
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from coreapp.models import AntrianZScore
+from coreapp.utils_lock import get_statistik_kunci
+
+
+class Command(BaseCommand):
+    help = 'Proses antrian perhitungan ulang Z-Score (dirty tahun/ruas) dengan debounce'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Jalankan terus-menerus sebagai worker (default: proses sekali lalu selesai)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Jeda antar pengecekan antrian dalam detik saat --loop (default: 5)'
+        )
+        parser.add_argument(
+            '--debounce',
+            type=float,
+            default=10,
+            help='Scope diproses jika tidak ditandai lagi selama N detik (default: 10)'
+        )
+        parser.add_argument(
+            '--max-wait',
+            type=float,
+            default=60,
+            help='Scope tetap diproses jika sudah menunggu lebih dari N detik (default: 60)'
+        )
+
+    def handle(self, *args, **options):
+        loop = options.get('loop', False)
+        interval = max(options.get('interval') or 5, 0.5)
+        debounce = max(options.get('debounce') or 0, 0)
+        max_wait = max(options.get('max_wait') or 0, debounce)
+
+        self.stdout.write(self.style.HTTP_INFO(
+            f'🔄 Z-Score queue worker (debounce {debounce}s, max wait {max_wait}s)'
+        ))
+
+        statistik_terakhir = {}
+        while True:
+            try:
+                hasil = AntrianZScore.proses(debounce_detik=debounce, maks_tunggu_detik=max_wait)
+                for tahun, ruas_ids in hasil.items():
+                    scope = 'semua ruas' if ruas_ids == [None] else f'ruas {ruas_ids}'
+                    self.stdout.write(self.style.SUCCESS(f'   ✅ Z-Score tahun {tahun} dihitung ulang ({scope})'))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'   ❌ Error memproses antrian: {str(e)}'))
+
+            statistik_terakhir = self._tulis_statistik_kunci(statistik_terakhir)
+
+            if not loop:
+                break
+            time.sleep(interval)
+
+        pending = AntrianZScore.objects.count()
+        if pending:
+            self.stdout.write(self.style.WARNING(f'⚠️ {pending} scope masih menunggu debounce'))
+
+    def _tulis_statistik_kunci(self, statistik_terakhir):
+        """Tulis statistik lock yang pernah menunggu/timeout jika berubah sejak iterasi sebelumnya"""
+        statistik = get_statistik_kunci()
+        for nama, stat in sorted(statistik.items()):
+            if stat == statistik_terakhir.get(nama) or not (stat['menunggu'] or stat['timeout']):
+                continue
+            rata = stat['total_tunggu'] / stat['jumlah']
+            self.stdout.write(self.style.WARNING(
+                f"   🔒 Lock {nama}: {stat['jumlah']}x, menunggu {stat['menunggu']}x, timeout {stat['timeout']}x, "
+                f"tunggu rata-rata {rata:.2f}s, maks {stat['maks_tunggu']:.2f}s"
+            ))
+        return statistik
@@ -1,15 +1,27 @@
 """
 Management command untuk re-assign kecelakaan ke segmen jalan berdasarkan proximity ke GARIS segmen,
-bukan hanya ke titik awal/akhir. Menggunakan perpendicular distance (jarak garis lurus).
+bukan hanya ke titik awal/akhir. Menggunakan perpendicular distance ke polyline geometry segmen
+(matcher yang sama dengan find_closest_segment).
 
 Fitur:
-- Assign berdasarkan garis segmen, bukan titik endpoint
+- Assign berdasarkan geometry segmen, bukan titik endpoint
 - Tolerance adjustable (default: 50 meter)
 - Support untuk Kecelakaan, KecelakaanPreprosesing, dan KecelakaanRaw
 - Force re-assign untuk data yang sudah assigned sebelumnya
+- Simpan jarak perpendicular, posisi km sepanjang ruas, versi matcher, dan versi segmen per data
+- Perhitungan jarak vectorized (NumPy) per sel grid dan batch, hasil ditulis dengan bulk_update
+- Karena bulk_update tidak memicu signal, perubahan KecelakaanPreprosesing diteruskan
+  manual: delta RekapSegmen, versi data peta, dan antrian Z-Score tahun terdampak
 """
 from django.core.management.base import BaseCommand, CommandError
-from coreapp.models import Kecelakaan, KecelakaanPreprosesing, KecelakaanRaw, SegmenJalan, AnalisisZScore
+from django.utils import timezone
+from django.db.models import Q
+from coreapp.models import (
+    Kecelakaan, KecelakaanPreprosesing, KecelakaanRaw, SegmenJalan, AnalisisZScore, AntrianZScore, RekapSegmen, VersiData
+)
+from coreapp.utils_segmen import get_segmen_snapshot, VERSI_MATCHER
+from coreapp.utils_peta import VERSI_KECELAKAAN
+import numpy as np
 import sys
 
 
@@ -44,7 +56,18 @@ class Command(BaseCommand):
         parser.add_argument(
             '--recalc-zscore',
             action='store_true',
-            help='Recalculate Z-Score after assignment.'
+            help='Recalculate Z-Score right after assignment (otherwise left to the process_zscore_queue worker).'
+        )
+        parser.add_argument(
+            '--skip-valid',
+            action='store_true',
+            help='Lewati data yang hasil match-nya masih valid (versi matcher dan versi segmen saat match sama dengan yang sekarang).'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Jumlah kecelakaan yang dihitung sekaligus per batch NumPy (default: 1000).'
         )
 
     def handle(self, *args, **options):
@@ -53,6 +76,8 @@ class Command(BaseCommand):
         tolerance_meters = options.get('tolerance', 50)
         force_reassign = options.get('force', False)
         recalc_zscore = options.get('recalc_zscore', False)
+        skip_valid = options.get('skip_valid', False)
+        batch_size = max(options.get('batch_size') or 1000, 1)
 
         # Convert tolerance to km
         tolerance_km = tolerance_meters / 1000.0
@@ -80,16 +105,26 @@ class Command(BaseCommand):
         self.stdout.write(f"Models to process: {', '.join([m[0] for m in models_to_process])}")
         self.stdout.write(f"Tolerance: {tolerance_meters} meters ({tolerance_km} km)")
         self.stdout.write(f"Force re-assign: {force_reassign}")
+        self.stdout.write(f"Skip valid match: {skip_valid}")
         if tahun:
             self.stdout.write(f"Filter tahun: {tahun}")
         self.stdout.write("")
 
-        # Get all segmen once
-        all_segmen = list(SegmenJalan.objects.select_related('ruas_jalan').all())
-        if not all_segmen:
+        # Get all segmen once (snapshot bersama, koordinat sudah berupa array float64)
+        snapshot = get_segmen_snapshot()
+        if not len(snapshot):
             raise CommandError("❌ Tidak ada segment ditemukan di database!")
 
-        self.stdout.write(f"✓ Loaded {len(all_segmen)} segments from database\n")
+        km_awal_segmen = dict(zip(snapshot.ids.tolist(), snapshot.km_awal.tolist()))
+        ruas_segmen = dict(zip(snapshot.ids.tolist(), snapshot.ruas_ids.tolist()))
+        nama_segmen = dict(SegmenJalan.objects.values_list('id', 'nama_segmen'))
+
+        self.stdout.write(f"✓ Loaded {len(snapshot)} segments from snapshot (versi {snapshot.versi})")
+        self.stdout.write(f"Batch size: {batch_size}\n")
+
+        # Hasil match dianggap masih valid jika dibuat matcher polyline versi saat ini
+        # terhadap versi data segmen yang sama dengan snapshot ini
+        masih_valid = Q(versi_matcher=VERSI_MATCHER, versi_segmen=snapshot.versi)
 
         # Process each model
         total_processed = 0
@@ -110,7 +145,15 @@ class Command(BaseCommand):
             if not force_reassign:
                 qs = qs.filter(segmen_jalan__isnull=True)
 
-            total_count = qs.count()
+            if skip_valid:
+                # Lewati data yang sudah dicek engine ini terhadap versi segmen saat ini
+                qs = qs.exclude(masih_valid)
+
+            rows = list(qs.values_list(
+                'id', 'latitude', 'longitude', 'segmen_jalan_id', 'tanggal', 'jarak_segmen_km', 'versi_matcher',
+                'versi_segmen', 'korban_meninggal', 'korban_luka_berat', 'korban_luka_ringan', 'kerugian_materi'
+            ))
+            total_count = len(rows)
             
             if total_count == 0:
                 self.stdout.write(f"ℹ No records to process")
@@ -118,77 +161,82 @@ class Command(BaseCommand):
 
             self.stdout.write(f"Total records to process: {total_count}\n")
 
+            # Hitung match untuk semua data sekaligus (per batch)
+            lats = np.array([float(r[1]) for r in rows], dtype=np.float64)
+            lons = np.array([float(r[2]) for r in rows], dtype=np.float64)
+            best_id, best_dist, best_posisi = snapshot.matcher.match_batch(
+                lats, lons, tolerance_km, batch_size=batch_size
+            )
+
             assigned = 0
             unassigned = 0
+            changed = []
+            # (segmen, tahun) -> [jumlah, meninggal, luka_berat, luka_ringan, kerugian]
+            delta_rekap = {}
+            now = timezone.now()
 
-            for idx, kecelakaan in enumerate(qs, 1):
+            for idx, (row, match_id, distance, posisi) in enumerate(zip(rows, best_id, best_dist, best_posisi), 1):
                 # Show progress
                 progress = f"[{idx:4d}/{total_count:4d}]"
-                
-                # Store old assignment
-                old_segmen = kecelakaan.segmen_jalan
-
-                # Find closest segment using perpendicular distance
-                best_match = None
-                smallest_distance = float('inf')
-
-                accident_lat = float(kecelakaan.latitude)
-                accident_lon = float(kecelakaan.longitude)
-
-                for segmen in all_segmen:
-                    if not (segmen.lat_awal and segmen.lon_awal and segmen.lat_akhir and segmen.lon_akhir):
-                        continue
-
-                    s_lat_awal = float(segmen.lat_awal)
-                    s_lon_awal = float(segmen.lon_awal)
-                    s_lat_akhir = float(segmen.lat_akhir)
-                    s_lon_akhir = float(segmen.lon_akhir)
-
-                    # Quick bounding box check
-                    buffer = 0.001  # ~111 meter
-                    min_lat = min(s_lat_awal, s_lat_akhir) - buffer
-                    max_lat = max(s_lat_awal, s_lat_akhir) + buffer
-                    min_lon = min(s_lon_awal, s_lon_akhir) - buffer
-                    max_lon = max(s_lon_awal, s_lon_akhir) + buffer
-
-                    if not (min_lat <= accident_lat <= max_lat and min_lon <= accident_lon <= max_lon):
-                        continue
-
-                    # Calculate perpendicular distance
-                    perp_distance = self._calculate_perpendicular_distance(
-                        accident_lat, accident_lon,
-                        s_lat_awal, s_lon_awal,
-                        s_lat_akhir, s_lon_akhir
-                    )
-
-                    # Check if within tolerance
-                    if perp_distance is not None and perp_distance <= tolerance_km:
-                        if perp_distance < smallest_distance:
-                            smallest_distance = perp_distance
-                            best_match = segmen
+                pk, _, _, old_segmen_id, tanggal, old_jarak, old_versi, old_versi_segmen = row[:8]
 
                 # Assign atau update
-                if best_match:
-                    kecelakaan.segmen_jalan = best_match
-                    kecelakaan.save()
-                    
-                    if old_segmen != best_match:
-                        status = "→" if old_segmen is None else "✓"
+                if match_id >= 0:
+                    new_segmen_id = int(match_id)
+                    new_jarak = float(distance)
+                    new_posisi = km_awal_segmen[new_segmen_id] + float(posisi)
+                    if old_segmen_id != new_segmen_id:
+                        status = "→" if old_segmen_id is None else "✓"
                         self.stdout.write(
-                            f"{progress} {status} {best_match.nama_segmen} "
-                            f"(dist: {smallest_distance*1000:.1f}m)"
+                            f"{progress} {status} {nama_segmen.get(new_segmen_id)} "
+                            f"(dist: {distance*1000:.1f}m)"
                         )
                     assigned += 1
-                    affected_years.add(kecelakaan.tanggal.year)
                 else:
-                    kecelakaan.segmen_jalan = None
-                    kecelakaan.save()
-                    
+                    new_segmen_id = None
+                    new_jarak = None
+                    new_posisi = None
                     self.stdout.write(f"{progress} ✗ Tidak ada segmen (luar tolerance)")
                     unassigned += 1
 
+                # Versi segmen ikut ditulis agar --skip-valid berikutnya melewati data ini
+                hasil_lama = (old_segmen_id, old_jarak, old_versi, old_versi_segmen)
+                if hasil_lama != (new_segmen_id, new_jarak, VERSI_MATCHER, snapshot.versi):
+                    changed.append(model_class(
+                        id=pk,
+                        segmen_jalan_id=new_segmen_id,
+                        jarak_segmen_km=new_jarak,
+                        posisi_km=new_posisi,
+                        versi_matcher=VERSI_MATCHER,
+                        versi_segmen=snapshot.versi,
+                        updated_at=now,
+                    ))
+
+                # Kontribusi rekap pindah dari segmen lama ke segmen baru
+                if old_segmen_id != new_segmen_id and tanggal is not None:
+                    kontribusi = [1] + [v or 0 for v in row[8:]]
+                    for segmen_id, tanda in ((old_segmen_id, -1), (new_segmen_id, 1)):
+                        if segmen_id is None:
+                            continue
+                        total = delta_rekap.setdefault((segmen_id, tanggal.year), [0, 0, 0, 0, 0])
+                        for i, v in enumerate(kontribusi):
+                            total[i] += tanda * v
+
+            # Tulis semua perubahan sekaligus (termasuk jarak & posisi km hasil match)
+            if changed:
+                model_class.objects.bulk_update(
+                    changed,
+                    ['segmen_jalan', 'jarak_segmen_km', 'posisi_km', 'versi_matcher', 'versi_segmen', 'updated_at'],
+                    batch_size=batch_size,
+                )
+                if model_class is KecelakaanPreprosesing:
+                    # bulk_update tidak memicu signal: jalankan manual apa yang
+                    # dilakukan signal save KecelakaanPreprosesing
+                    affected_years.update(self._teruskan_perubahan(delta_rekap, ruas_segmen))
+
             self.stdout.write(f"\n✓ Assigned: {assigned}")
             self.stdout.write(f"✗ Unassigned: {unassigned}")
+            self.stdout.write(f"✎ Updated rows: {len(changed)}")
 
             total_processed += total_count
             total_assigned += assigned
@@ -205,77 +253,37 @@ class Command(BaseCommand):
 
         # Recalculate Z-Score if requested
         if recalc_zscore and affected_years:
-            self.stdout.write(f"\n🔄 Recalculating Z-Score for years: {sorted(affected_years)}")
-            for tahun_iter in sorted(affected_years):
+            self.stdout.write(f"\n🔄 Recalculating Z-Score for years: {sorted(affected_years) + [0]}")
+            for tahun_iter in sorted(affected_years) + [0]:
                 try:
-                    AnalisisZScore.recalculate_zscore(tahun_iter)
+                    AnalisisZScore.calculate_zscore(tahun_iter)
                     self.stdout.write(f"   ✓ Z-Score recalculated for {tahun_iter}")
                 except Exception as e:
                     self.stdout.write(self.style.ERROR(f"   ✗ Error for {tahun_iter}: {str(e)}"))
 
         self.stdout.write(self.style.SUCCESS("\n✓ Done!\n"))
 
-    def _calculate_perpendicular_distance(self, lat, lon, lat1, lon1, lat2, lon2):
+    def _teruskan_perubahan(self, delta_rekap, ruas_segmen):
         """
-        Hitung jarak PERPENDICULAR dari titik (lat, lon) ke garis segmen
-        antara titik (lat1, lon1) dan (lat2, lon2).
-        
-        Mengembalikan:
-        - Jarak dalam km jika titik proyeksi ada dalam segmen
-        - None jika titik proyeksi diluar rentang segmen
+        Terapkan delta RekapSegmen, naikkan versi data kecelakaan sekali, dan
+        tandai Z-Score (tahun, ruas) yang distribusinya berubah di AntrianZScore.
+        Periode yang baris rekapnya belum ada ditandai untuk dibangun ulang penuh.
+        Mengembalikan set tahun yang terdampak.
         """
-        import math
-
-        # Convert ke radians
-        lat = math.radians(lat)
-        lon = math.radians(lon)
-        lat1 = math.radians(lat1)
-        lon1 = math.radians(lon1)
-        lat2 = math.radians(lat2)
-        lon2 = math.radians(lon2)
-
-        R = 6371  # Earth radius in km
-
-        # Angular distance dari start ke accident
-        dLat = lat - lat1
-        dLon = lon - lon1
-        a = math.sin(dLat / 2) ** 2 + math.cos(lat1) * math.cos(lat) * math.sin(dLon / 2) ** 2
-        c = 2 * math.asin(math.sqrt(a))
-        d13 = R * c
-
-        # Bearing dari start ke end
-        dLon12 = lon2 - lon1
-        y = math.sin(dLon12) * math.cos(lat2)
-        x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dLon12)
-        theta12 = math.atan2(y, x)
-
-        # Bearing dari start ke accident
-        dLon13 = lon - lon1
-        y13 = math.sin(dLon13) * math.cos(lat)
-        x13 = math.cos(lat1) * math.sin(lat) - math.sin(lat1) * math.cos(lat) * math.cos(dLon13)
-        theta13 = math.atan2(y13, x13)
-
-        # Cross-track distance (perpendicular distance)
-        dXt = math.asin(math.sin(d13 / R) * math.sin(theta13 - theta12))
-        cross_track_distance_km = abs(dXt * R)
-
-        # Along-track distance (untuk cek apakah dalam rentang)
-        try:
-            dAt = math.acos(max(-1, min(1, math.cos(d13 / R) / abs(math.cos(dXt)))))
-        except:
-            dAt = 0
-
-        # Jarak dari start ke end
-        dLat12 = lat2 - lat1
-        dLon12_calc = lon2 - lon1
-        a12 = math.sin(dLat12 / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dLon12_calc / 2) ** 2
-        c12 = 2 * math.asin(math.sqrt(a12))
-        d12 = R * c12
-
-        # Cek apakah proyeksi ada dalam rentang segmen
-        # Dengan toleransi kecil di ujung-ujung segmen
-        if -0.05 <= dAt <= (d12 + 0.05):
-            return cross_track_distance_km
-        else:
-            # Proyeksi di luar segmen, jadi tidak cocok
-            return None
+        VersiData.naikkan(VERSI_KECELAKAAN)
+        if not delta_rekap:
+            return set()
+
+        periode_rebuild = RekapSegmen.terapkan_delta_batch(delta_rekap)
+        ruas_per_periode = {}
+        for segmen_id, tahun_data in delta_rekap:
+            for periode in (tahun_data, 0):
+                ruas_per_periode.setdefault(periode, set()).add(ruas_segmen.get(segmen_id))
+
+        for periode, ruas_ids in sorted(ruas_per_periode.items()):
+            if periode in periode_rebuild or None in ruas_ids:
+                AntrianZScore.tandai(periode)
+            else:
+                AntrianZScore.tandai(periode, ruas_ids)
+        self.stdout.write(f"🕒 RekapSegmen diperbarui, Z-Score ditandai untuk tahun: {sorted(ruas_per_periode)}")
+        return {tahun_data for _, tahun_data in delta_rekap}
@@ -3,10 +3,43 @@ Management command untuk manual trigger recalculation Z-Score dan Rekap
 Usage: python manage.py recalculate_zscore
        python manage.py recalculate_zscore --tahun 2024
        python manage.py recalculate_zscore --all
+       python manage.py recalculate_zscore --all --workers 4
+       python manage.py recalculate_zscore --all --verify-rekap
 """
-from django.core.management.base import BaseCommand
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
-from coreapp.models import RekapSegmen, AnalisisZScore
+
+
+# Model hanya diimpor di dalam fungsi: proses worker dengan start method
+# spawn/forkserver mengimpor modul ini sebelum django.setup() di _init_worker
+def _init_worker():
+    """Inisialisasi proses worker: setup Django dan buang koneksi DB warisan parent"""
+    import django
+    from django.db import connections
+
+    django.setup()
+    for conn in connections.all(initialized_only=True):
+        conn.close()
+
+
+def proses_tahun(tahun):
+    """
+    Update rekap dan hitung Z-Score satu tahun (calculate_zscore sudah
+    menjalankan update_rekap dan rollup tahun 0 sekali).
+    Mengembalikan (tahun, sukses, durasi_detik, pesan_error).
+    """
+    from coreapp.models import AnalisisZScore
+
+    mulai = time.perf_counter()
+    try:
+        if not AnalisisZScore.calculate_zscore(tahun):
+            return tahun, False, time.perf_counter() - mulai, 'lock Z-Score tidak didapat (sedang dihitung proses lain)'
+        return tahun, True, time.perf_counter() - mulai, None
+    except Exception as e:
+        return tahun, False, time.perf_counter() - mulai, str(e)
 
 
 class Command(BaseCommand):
@@ -23,55 +56,89 @@ class Command(BaseCommand):
             action='store_true',
             help='Recalculate untuk ALL tahun (tidak recommended untuk large dataset)'
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Jumlah proses paralel (satu tahun per proses, masing-masing dengan koneksi DB sendiri). Default: 1 (berurutan)'
+        )
+        parser.add_argument(
+            '--verify-rekap',
+            action='store_true',
+            help='Cocokkan rekap semua tahun dengan seluruh data kecelakaan (scan penuh) dan rekap ulang tahun yang tidak cocok, termasuk rollup tahun 0'
+        )
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.HTTP_INFO('🔄 Starting Z-Score recalculation...'))
-        
+
         tahun_list = []
-        
+
         if options.get('all'):
             # Get semua tahun yang ada di database
             from coreapp.models import KecelakaanPreprosesing
-            from django.db.models import ExtensionAgg
-            from django.db.models.functions import ExtractYear
-            from django.db.models import Value
-            from django.db.models import F
-            
-            tahun_list = KecelakaanPreprosesing.objects.dates('tanggal', 'year').values_list('tanggal__year', flat=True).distinct()
+
+            tahun_list = [d.year for d in KecelakaanPreprosesing.objects.dates('tanggal', 'year')]
             self.stdout.write(self.style.SUCCESS(f'ℹ️ Found {len(tahun_list)} tahun dengan data'))
         elif options.get('tahun'):
             tahun_list = [options['tahun']]
         else:
             tahun_list = [timezone.now().year]
-        
-        success_count = 0
-        error_count = 0
-        
-        for tahun in tahun_list:
+
+        if options.get('verify_rekap'):
+            from coreapp.models import RekapSegmen, AntrianZScore
+
+            self.stdout.write('🔍 Mencocokkan rekap semua tahun dengan data kecelakaan...')
             try:
+                if RekapSegmen.rollup_tahun_nol(periksa_penuh=True):
+                    AntrianZScore.tandai(0)
+            except TimeoutError as e:
+                raise CommandError(str(e))
+
+        workers = max(1, min(options.get('workers') or 1, len(tahun_list) or 1))
+        hasil = []
+        mulai = time.perf_counter()
+
+        if workers == 1:
+            for tahun in tahun_list:
                 self.stdout.write(f'\n📅 Processing tahun {tahun}...')
-                
-                # Update Rekap
-                self.stdout.write('   📊 Updating RekapSegmen...')
-                RekapSegmen.update_rekap(tahun)
-                self.stdout.write(self.style.SUCCESS('   ✅ RekapSegmen updated'))
-                
-                # Calculate Z-Score
-                self.stdout.write('   📈 Calculating Z-Score...')
-                AnalisisZScore.calculate_zscore(tahun)
-                self.stdout.write(self.style.SUCCESS('   ✅ Z-Score calculated'))
-                
-                success_count += 1
-                
-            except Exception as e:
-                error_count += 1
-                self.stdout.write(
-                    self.style.ERROR(f'   ❌ Error processing tahun {tahun}: {str(e)}')
-                )
-        
+                self.stdout.write('   📊 Updating RekapSegmen & 📈 Calculating Z-Score...')
+                hasil.append(self._laporkan(proses_tahun(tahun)))
+        else:
+            self.stdout.write(f'⚙️ Menjalankan {len(tahun_list)} tahun dengan {workers} worker paralel')
+            # Koneksi parent ditutup agar tidak diwariskan ke proses worker
+            from django.db import connections
+            connections.close_all()
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                futures = {executor.submit(proses_tahun, tahun): tahun for tahun in tahun_list}
+                for future in as_completed(futures):
+                    try:
+                        hasil.append(self._laporkan(future.result()))
+                    except Exception as e:
+                        hasil.append(self._laporkan((futures[future], False, 0.0, str(e))))
+
+        success_count = sum(1 for _, sukses, _, _ in hasil if sukses)
+        error_count = len(hasil) - success_count
+
         # Summary
         self.stdout.write('\n' + '='*80)
+        for tahun, sukses, durasi, _ in sorted(hasil):
+            status = '✅' if sukses else '❌'
+            self.stdout.write(f'   {status} {tahun}: {durasi:.2f}s')
         self.stdout.write(self.style.SUCCESS(f'✅ Success: {success_count} tahun'))
         if error_count > 0:
             self.stdout.write(self.style.WARNING(f'⚠️ Errors: {error_count} tahun'))
+        self.stdout.write(f'⏱️ Total waktu: {time.perf_counter() - mulai:.2f}s ({workers} worker)')
         self.stdout.write('='*80)
+
+        # Exit code non-zero agar job batch tahu ada tahun yang gagal/basi
+        if error_count > 0:
+            raise CommandError(f'{error_count} tahun gagal dihitung ulang')
+
+    def _laporkan(self, hasil):
+        tahun, sukses, durasi, error = hasil
+        if sukses:
+            self.stdout.write(self.style.SUCCESS(f'   ✅ Tahun {tahun} selesai ({durasi:.2f}s)'))
+        else:
+            self.stdout.write(self.style.ERROR(f'   ❌ Error processing tahun {tahun}: {error}'))
+        return hasil
@@ -0,0 +1,47 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0013_versidata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kecelakaan',
+            name='jarak_segmen_km',
+            field=models.FloatField(blank=True, help_text='Jarak perpendicular titik ke segmen saat di-match (km)', null=True),
+        ),
+        migrations.AddField(
+            model_name='kecelakaan',
+            name='posisi_km',
+            field=models.FloatField(blank=True, help_text='Posisi titik sepanjang ruas jalan (km dari awal ruas) hasil match', null=True),
+        ),
+        migrations.AddField(
+            model_name='kecelakaan',
+            name='versi_matcher',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Versi algoritma matcher yang menghasilkan segmen_jalan', null=True),
+        ),
+        migrations.AddField(
+            model_name='kecelakaanpreprosesing',
+            name='jarak_segmen_km',
+            field=models.FloatField(blank=True, help_text='Jarak perpendicular titik ke segmen saat di-match (km)', null=True),
+        ),
+        migrations.AddField(
+            model_name='kecelakaanpreprosesing',
+            name='posisi_km',
+            field=models.FloatField(blank=True, help_text='Posisi titik sepanjang ruas jalan (km dari awal ruas) hasil match', null=True),
+        ),
+        migrations.AddField(
+            model_name='kecelakaanpreprosesing',
+            name='versi_matcher',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Versi algoritma matcher yang menghasilkan segmen_jalan', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='kecelakaanpreprosesing',
+            index=models.Index(fields=['segmen_jalan', 'posisi_km'], name='coreapp_kec_segmen__b0eafa_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0014_kecelakaan_hasil_match'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AntrianZScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tahun', models.IntegerField()),
+                ('dibuat_at', models.DateTimeField(auto_now_add=True)),
+                ('ditandai_at', models.DateTimeField(auto_now=True)),
+                ('ruas_jalan', models.ForeignKey(blank=True, help_text='Kosong = hitung ulang rekap & Z-Score semua ruas', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='antrian_zscore', to='coreapp.ruasjalan')),
+            ],
+            options={
+                'verbose_name_plural': 'Antrian Z-Score',
+                'ordering': ['dibuat_at'],
+                'unique_together': {('tahun', 'ruas_jalan')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0015_antrianzscore'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='analisiszscore',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='analisiszscore',
+            name='versi',
+            field=models.PositiveIntegerField(default=0, help_text='Versi snapshot hasil perhitungan'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='analisiszscore',
+            unique_together={('segmen_jalan', 'tahun', 'versi')},
+        ),
+        migrations.AddIndex(
+            model_name='analisiszscore',
+            index=models.Index(fields=['tahun', 'versi'], name='coreapp_ana_tahun_68e178_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0016_analisiszscore_versi'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KunciProses',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nama', models.CharField(max_length=64, unique=True)),
+                ('token', models.CharField(max_length=32)),
+                ('kedaluwarsa_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Kunci Proses',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0017_kunciproses'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='versidata',
+            name='sidik',
+            field=models.CharField(blank=True, default='', help_text='Fingerprint data sumber saat versi ini dibuat', max_length=100),
+        ),
+    ]
@@ -0,0 +1,146 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:28
+
+import json
+
+import numpy as np
+from django.db import migrations, models
+
+
+# Salinan beku perhitungan geometry peta saat migration ini dibuat
+# (coreapp.utils_peta / utils_segmen), agar backfill tidak ikut berubah
+# jika kode aplikasi berubah di kemudian hari.
+ZOOM_BAND = (8, 11, 14)
+
+
+def _vertex_segmen(lat1, lon1, lat2, lon2, geometry):
+    """Vertex [(lat, lon), ...] dari GeoJSON segmen; fallback garis titik awal -> akhir"""
+    vertices = []
+    if geometry:
+        try:
+            geom = json.loads(geometry) if isinstance(geometry, str) else geometry
+            if geom.get('type') == 'Feature':
+                geom = geom.get('geometry') or {}
+            coords = geom.get('coordinates') or []
+            if geom.get('type') == 'MultiLineString':
+                coords = [pt for line in coords for pt in line]
+            vertices = [
+                (float(pt[1]), float(pt[0])) for pt in coords
+                if isinstance(pt, (list, tuple)) and len(pt) >= 2
+            ]
+        except (ValueError, TypeError, AttributeError):
+            vertices = []
+    if len(vertices) < 2:
+        if not (lat1 and lon1 and lat2 and lon2):
+            return []
+        vertices = [(float(lat1), float(lon1)), (float(lat2), float(lon2))]
+    return vertices
+
+
+def _sederhanakan_garis(coords, toleransi):
+    """Douglas-Peucker iteratif atas [[lon, lat], ...] (jarak planar dalam derajat)"""
+    if len(coords) <= 2:
+        return [list(pt) for pt in coords]
+
+    titik = np.asarray(coords, dtype=np.float64)
+    simpan = np.zeros(len(titik), dtype=bool)
+    simpan[0] = simpan[-1] = True
+    tumpukan = [(0, len(titik) - 1)]
+
+    while tumpukan:
+        awal, akhir = tumpukan.pop()
+        if akhir - awal < 2:
+            continue
+        a, b = titik[awal], titik[akhir]
+        tengah = titik[awal + 1:akhir]
+        ab = b - a
+        panjang = np.hypot(ab[0], ab[1])
+        if panjang == 0:
+            jarak = np.hypot(tengah[:, 0] - a[0], tengah[:, 1] - a[1])
+        else:
+            jarak = np.abs(ab[0] * (tengah[:, 1] - a[1]) - ab[1] * (tengah[:, 0] - a[0])) / panjang
+        i = int(np.argmax(jarak))
+        if jarak[i] > toleransi:
+            indeks = awal + 1 + i
+            simpan[indeks] = True
+            tumpukan.append((awal, indeks))
+            tumpukan.append((indeks, akhir))
+
+    return titik[simpan].tolist()
+
+
+def hitung_geometry_peta(lat_awal, lon_awal, lat_akhir, lon_akhir, geometry):
+    """(bbox (min_lat, max_lat, min_lon, max_lon), band_json) atau (None, None)"""
+    vertices = _vertex_segmen(lat_awal, lon_awal, lat_akhir, lon_akhir, geometry)
+    if not vertices:
+        return None, None
+
+    coords = [[lon, lat] for lat, lon in vertices]
+    lats = [lat for lat, _ in vertices]
+    lons = [lon for _, lon in vertices]
+    bbox = (min(lats), max(lats), min(lons), max(lons))
+    band = {
+        str(zoom): _sederhanakan_garis(coords, 360.0 / (256 * 2 ** zoom))
+        for zoom in ZOOM_BAND
+    }
+    return bbox, json.dumps(band, separators=(',', ':'))
+
+
+def isi_geometry_peta(apps, schema_editor):
+    """Backfill bbox dan geometry sederhana untuk segmen yang sudah ada"""
+    SegmenJalan = apps.get_model('coreapp', 'SegmenJalan')
+    batch = []
+    for segmen in SegmenJalan.objects.only('id', 'lat_awal', 'lon_awal', 'lat_akhir', 'lon_akhir', 'geometry').iterator(chunk_size=500):
+        bbox, segmen.geometry_peta = hitung_geometry_peta(
+            segmen.lat_awal, segmen.lon_awal, segmen.lat_akhir, segmen.lon_akhir, segmen.geometry
+        )
+        segmen.bbox_min_lat, segmen.bbox_max_lat, segmen.bbox_min_lon, segmen.bbox_max_lon = bbox or (None, None, None, None)
+        batch.append(segmen)
+        if len(batch) >= 500:
+            SegmenJalan.objects.bulk_update(batch, ['bbox_min_lat', 'bbox_max_lat', 'bbox_min_lon', 'bbox_max_lon', 'geometry_peta'])
+            batch = []
+    if batch:
+        SegmenJalan.objects.bulk_update(batch, ['bbox_min_lat', 'bbox_max_lat', 'bbox_min_lon', 'bbox_max_lon', 'geometry_peta'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0018_versidata_sidik'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='segmenjalan',
+            name='bbox_max_lat',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='segmenjalan',
+            name='bbox_max_lon',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='segmenjalan',
+            name='bbox_min_lat',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='segmenjalan',
+            name='bbox_min_lon',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='segmenjalan',
+            name='geometry_peta',
+            field=models.TextField(blank=True, editable=False, help_text='Geometry sederhana per zoom band (JSON), dihitung otomatis saat disimpan', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='segmenjalan',
+            index=models.Index(fields=['bbox_min_lon', 'bbox_max_lon'], name='coreapp_seg_bbox_mi_8e2da1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='segmenjalan',
+            index=models.Index(fields=['bbox_min_lat', 'bbox_max_lat'], name='coreapp_seg_bbox_mi_c02372_idx'),
+        ),
+        migrations.RunPython(isi_geometry_peta, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+def isi_kunci_ruas(apps, schema_editor):
+    """Isi kunci_ruas dari ruas_jalan dan buang entri ganda (tahun, semua ruas)"""
+    AntrianZScore = apps.get_model('coreapp', 'AntrianZScore')
+    sudah_ada = set()
+    for entri in AntrianZScore.objects.order_by('dibuat_at', 'id'):
+        kunci = (entri.tahun, entri.ruas_jalan_id or 0)
+        if kunci in sudah_ada:
+            entri.delete()
+            continue
+        sudah_ada.add(kunci)
+        entri.kunci_ruas = kunci[1]
+        entri.save(update_fields=['kunci_ruas'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0019_segmenjalan_geometry_peta'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='antrianzscore',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='antrianzscore',
+            name='kunci_ruas',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Id ruas untuk keunikan antrian, 0 = semua ruas'),
+        ),
+        migrations.RunPython(isi_kunci_ruas, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='antrianzscore',
+            unique_together={('tahun', 'kunci_ruas')},
+        ),
+    ]
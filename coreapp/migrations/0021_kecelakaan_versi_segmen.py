@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0020_antrianzscore_kunci_ruas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='kecelakaan',
+            name='versi_segmen',
+            field=models.PositiveBigIntegerField(blank=True, help_text="Versi data segmen (VersiData 'segmen') yang dipakai saat match", null=True),
+        ),
+        migrations.AddField(
+            model_name='kecelakaanpreprosesing',
+            name='versi_segmen',
+            field=models.PositiveBigIntegerField(blank=True, help_text="Versi data segmen (VersiData 'segmen') yang dipakai saat match", null=True),
+        ),
+    ]
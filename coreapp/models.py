@@ -8,7 +8,6 @@ from django.contrib.auth.models import (
     AbstractBaseUser, BaseUserManager, PermissionsMixin
 )
 from geopy.distance import geodesic
-import math
 import requests
 import json
 import decimal
@@ -393,6 +392,13 @@ class RuasJalan(models.Model):
     def __str__(self):
         return f"{self.nama_ruas} ({self.jenis_jalan})"
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'geometry' in update_fields:
+            from .utils_geometri import simpan_geometri
+            simpan_geometri('ruas', self)
+    
     def generate_segmen(self):
         """Generate segmen jalan otomatis berdasarkan titik klik manual atau simpang jalan dari Overpass API"""
         # 1. Hapus segmen lama
@@ -675,18 +681,78 @@ class SegmenJalan(models.Model):
     nama_segmen = models.CharField(max_length=20, null=True, blank=True, help_text="Nama segmen, bisa diubah dinamis")
     keterangan = models.TextField(null=True, blank=True, help_text="Penjelasan/keterangan segmen")
     geometry = models.TextField(null=True, blank=True, help_text="GeoJSON LineString untuk segmen ini")
+    bbox_min_lat = models.FloatField(null=True, blank=True, editable=False)
+    bbox_max_lat = models.FloatField(null=True, blank=True, editable=False)
+    bbox_min_lon = models.FloatField(null=True, blank=True, editable=False)
+    bbox_max_lon = models.FloatField(null=True, blank=True, editable=False)
+    geometry_peta = models.TextField(null=True, blank=True, editable=False, help_text="Geometry sederhana per zoom band (JSON), dihitung otomatis saat disimpan")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Field sumber geometry peta; jika ikut disimpan, bbox & geometry_peta dihitung ulang
+    FIELD_SUMBER_PETA = {'lat_awal', 'lon_awal', 'lat_akhir', 'lon_akhir', 'geometry'}
+    FIELD_PETA = ['bbox_min_lat', 'bbox_max_lat', 'bbox_min_lon', 'bbox_max_lon', 'geometry_peta']
+    
     class Meta:
         verbose_name_plural = 'Segmen Jalan'
         ordering = ['ruas_jalan', 'km_awal']
         unique_together = ('ruas_jalan', 'km_awal', 'km_akhir')
+        indexes = [
+            models.Index(fields=['bbox_min_lon', 'bbox_max_lon']),
+            models.Index(fields=['bbox_min_lat', 'bbox_max_lat']),
+        ]
     
     def __str__(self):
         nama = self.nama_segmen if self.nama_segmen else f"Segmen {self.km_awal}-{self.km_akhir} km"
         return f"{self.ruas_jalan.nama_ruas} - {nama}"
     
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        geometry_berubah = update_fields is None or self.FIELD_SUMBER_PETA.intersection(update_fields)
+        if geometry_berubah:
+            self.hitung_geometry_peta()
+            if update_fields is not None:
+                kwargs['update_fields'] = list(update_fields) + self.FIELD_PETA
+        super().save(*args, **kwargs)
+        if geometry_berubah:
+            from .utils_geometri import simpan_geometri
+            simpan_geometri('segmen', self, self.geometry_peta)
+    
+    def hitung_geometry_peta(self):
+        """Precompute bounding box dan geometry sederhana per zoom band untuk endpoint peta viewport"""
+        from .utils_peta import hitung_geometry_peta
+        
+        bbox, self.geometry_peta = hitung_geometry_peta(
+            self.lat_awal, self.lon_awal, self.lat_akhir, self.lon_akhir, self.geometry
+        )
+        self.bbox_min_lat, self.bbox_max_lat, self.bbox_min_lon, self.bbox_max_lon = bbox or (None, None, None, None)
+    
+    @staticmethod
+    def di_viewport(min_lon, min_lat, max_lon, max_lat):
+        """Filter segmen yang bounding box-nya beririsan dengan viewport"""
+        return models.Q(
+            bbox_min_lon__lte=max_lon, bbox_max_lon__gte=min_lon,
+            bbox_min_lat__lte=max_lat, bbox_max_lat__gte=min_lat,
+        )
+    
+    @staticmethod
+    def untuk_peta(tahun=0):
+        """
+        Queryset segmen untuk peta dalam satu query: ruas (select_related),
+        jumlah kecelakaan preprocessing tahun tersebut (accident_count) dan
+        Z-Score snapshot aktif tahun tersebut (zscore_nilai, zscore_kategori,
+        NULL jika belum ada).
+        """
+        from django.db.models import Count, OuterRef, Q, Subquery
+        
+        filter_tahun = Q(kecelakaan_preprosesing__tanggal__year=tahun) if tahun else None
+        analisis = AnalisisZScore.objects.aktif().filter(segmen_jalan=OuterRef('pk'), tahun=tahun)
+        return SegmenJalan.objects.select_related('ruas_jalan').annotate(
+            accident_count=Count('kecelakaan_preprosesing', filter=filter_tahun),
+            zscore_nilai=Subquery(analisis.values('nilai_zscore')[:1]),
+            zscore_kategori=Subquery(analisis.values('kategori')[:1]),
+        )
+    
     def get_accident_count(self, tahun=None):
         """Hitung jumlah kecelakaan di segmen ini"""
         from django.utils import timezone
@@ -708,6 +774,10 @@ class Kecelakaan(models.Model):
     latitude = models.DecimalField(max_digits=30, decimal_places=20, help_text="Latitude koordinat kecelakaan")
     longitude = models.DecimalField(max_digits=30, decimal_places=20, help_text="Longitude koordinat kecelakaan")
     segmen_jalan = models.ForeignKey(SegmenJalan, on_delete=models.SET_NULL, null=True, blank=True, related_name='kecelakaan', help_text="Otomatis diassign ke segmen terdekat (threshold 5km) saat disimpan. Bisa diubah manual jika perlu.")
+    jarak_segmen_km = models.FloatField(null=True, blank=True, help_text="Jarak perpendicular titik ke segmen saat di-match (km)")
+    posisi_km = models.FloatField(null=True, blank=True, help_text="Posisi titik sepanjang ruas jalan (km dari awal ruas) hasil match")
+    versi_matcher = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Versi algoritma matcher yang menghasilkan segmen_jalan")
+    versi_segmen = models.PositiveBigIntegerField(null=True, blank=True, help_text="Versi data segmen (VersiData 'segmen') yang dipakai saat match")
     korban_meninggal = models.IntegerField(default=0, validators=[MinValueValidator(0)])
     korban_luka_berat = models.IntegerField(default=0, validators=[MinValueValidator(0)])
     korban_luka_ringan = models.IntegerField(default=0, validators=[MinValueValidator(0)])
@@ -739,135 +809,49 @@ class Kecelakaan(models.Model):
             self.find_closest_segment()
             # Jika find_closest_segment berhasil assign, simpan perubahan
             if self.segmen_jalan:
-                super().save(update_fields=['segmen_jalan'])
+                super().save(update_fields=['segmen_jalan', 'jarak_segmen_km', 'posisi_km', 'versi_matcher', 'versi_segmen'])
     
     def find_closest_segment(self):
         """
-        Temukan segmen jalan di mana titik kecelakaan berada TEPAT DI ANTARA
-        titik awal dan titik akhir segmen. Menggunakan proyeksi perpendicular
-        dari titik ke garis segmen untuk presisi maksimal.
+        Temukan segmen jalan di mana titik kecelakaan berada DI SEPANJANG
+        geometry segmen (polyline LineString, bukan hanya garis lurus titik
+        awal -> titik akhir). Menggunakan proyeksi perpendicular dari titik ke
+        sub-segmen polyline terdekat untuk presisi maksimal.
         
         Algoritma:
-        1. Cek apakah titik ada dalam bounding box segmen
-        2. Hitung jarak perpendicular dari titik ke garis segmen
-        3. Jika jarak <= tolerance, assign ke segmen tersebut
+        1. Ambil kandidat segmen dari spatial index (bounding box geometry memuat titik)
+        2. Proyeksikan titik ke setiap sub-segmen polyline kandidat
+        3. Jika jarak terkecil <= tolerance, assign ke segmen tersebut
         """
-        import math
+        from .utils_segmen import get_segmen_snapshot, TOLERANCE_KM, VERSI_MATCHER
         
         accident_lat = float(self.latitude)
         accident_lon = float(self.longitude)
         
         # Tolerance untuk jarak perpendicular: ~50 meter
-        tolerance_km = 0.050
+        tolerance_km = TOLERANCE_KM
         
         best_match = None
         smallest_distance = float('inf')
         
-        # Iterasi semua segmen untuk cek titik
-        for segmen in SegmenJalan.objects.select_related('ruas_jalan').all():
-            if not (segmen.lat_awal and segmen.lon_awal and segmen.lat_akhir and segmen.lon_akhir):
-                continue
-            
-            s_lat_awal = float(segmen.lat_awal)
-            s_lon_awal = float(segmen.lon_awal)
-            s_lat_akhir = float(segmen.lat_akhir)
-            s_lon_akhir = float(segmen.lon_akhir)
-            
-            # 1. Cek bounding box dulu (quick check)
-            buffer = 0.001  # ~111 meter
-            min_lat = min(s_lat_awal, s_lat_akhir) - buffer
-            max_lat = max(s_lat_awal, s_lat_akhir) + buffer
-            min_lon = min(s_lon_awal, s_lon_akhir) - buffer
-            max_lon = max(s_lon_awal, s_lon_akhir) + buffer
-            
-            if not (min_lat <= accident_lat <= max_lat and min_lon <= accident_lon <= max_lon):
-                continue
-            
-            # 2. Hitung jarak perpendicular dari titik ke garis segmen
-            perp_distance = self._calculate_perpendicular_distance(
-                accident_lat, accident_lon,
-                s_lat_awal, s_lon_awal,
-                s_lat_akhir, s_lon_akhir
-            )
-            
-            # 3. Jika jarak perpendicular <= tolerance, ini adalah match
-            if perp_distance is not None and perp_distance <= tolerance_km:
-                if perp_distance < smallest_distance:
-                    smallest_distance = perp_distance
-                    best_match = segmen
+        snapshot = get_segmen_snapshot()
+        match = snapshot.matcher.match(accident_lat, accident_lon, tolerance_km)
+        if match:
+            best_match_id, smallest_distance, posisi_dalam_segmen = match
+            best_match = SegmenJalan.objects.select_related('ruas_jalan').filter(pk=best_match_id).first()
         
         # Assign ke segmen terbaik jika ada match (tanpa save, dibiarkan parent save handle)
+        # Jarak dan posisi km ikut disimpan agar tidak perlu dihitung ulang saat analisis
         if best_match:
             self.segmen_jalan = best_match
+            self.jarak_segmen_km = smallest_distance
+            self.posisi_km = float(best_match.km_awal) + posisi_dalam_segmen
+            self.versi_matcher = VERSI_MATCHER
+            self.versi_segmen = snapshot.versi
             print(f"✓ Kecelakaan {self.id} → Segmen '{best_match.nama_segmen}' (jarak perp: {smallest_distance*1000:.1f}m)")
         else:
             print(f"⚠ Kecelakaan {self.id}: Tidak ada segmen yang sesuai (tolerance: {tolerance_km*1000:.0f}m)")
     
-    def _calculate_perpendicular_distance(self, lat, lon, lat1, lon1, lat2, lon2):
-        """
-        Hitung jarak PERPENDICULAR dari titik (lat, lon) ke garis segmen
-        antara titik (lat1, lon1) dan (lat2, lon2).
-        
-        Mengembalikan:
-        - Jarak dalam km jika titik proyeksi ada dalam segmen
-        - None jika titik proyeksi diluar rentang segmen
-        """
-        import math
-        
-        # Convert ke radians
-        lat = math.radians(lat)
-        lon = math.radians(lon)
-        lat1 = math.radians(lat1)
-        lon1 = math.radians(lon1)
-        lat2 = math.radians(lat2)
-        lon2 = math.radians(lon2)
-        
-        R = 6371  # Earth radius in km
-        
-        # Angular distance dari start ke accident
-        dLat = lat - lat1
-        dLon = lon - lon1
-        a = math.sin(dLat/2)**2 + math.cos(lat1) * math.cos(lat) * math.sin(dLon/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        d13 = R * c
-        
-        # Bearing dari start ke end
-        dLon12 = lon2 - lon1
-        y = math.sin(dLon12) * math.cos(lat2)
-        x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dLon12)
-        theta12 = math.atan2(y, x)
-        
-        # Bearing dari start ke accident
-        dLon13 = lon - lon1
-        y13 = math.sin(dLon13) * math.cos(lat)
-        x13 = math.cos(lat1) * math.sin(lat) - math.sin(lat1) * math.cos(lat) * math.cos(dLon13)
-        theta13 = math.atan2(y13, x13)
-        
-        # Cross-track distance (perpendicular distance)
-        dXt = math.asin(math.sin(d13/R) * math.sin(theta13 - theta12))
-        cross_track_distance_km = abs(dXt * R)
-        
-        # Along-track distance (untuk cek apakah dalam rentang)
-        try:
-            dAt = math.acos(max(-1, min(1, math.cos(d13/R) / abs(math.cos(dXt)))))
-        except:
-            dAt = 0
-        
-        # Jarak dari start ke end
-        dLat12 = lat2 - lat1
-        dLon12_calc = lon2 - lon1
-        a12 = math.sin(dLat12/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dLon12_calc/2)**2
-        c12 = 2 * math.asin(math.sqrt(a12))
-        d12 = R * c12
-        
-        # Cek apakah proyeksi ada dalam rentang segmen
-        # Dengan toleransi kecil di ujung-ujung segmen
-        if -0.05 <= dAt <= (d12 + 0.05):
-            return cross_track_distance_km
-        else:
-            # Proyeksi di luar segmen, jadi tidak cocok
-            return None
-    
     @property
     def total_korban(self):
         """Total semua korban"""
@@ -902,10 +886,24 @@ class RekapSegmen(models.Model):
         return f"{self.segmen_jalan} - {self.periode_tahun}"
     
     @staticmethod
-    def update_rekap(tahun=None):
-        """Update rekapitulasi untuk tahun tertentu atau semua tahun"""
-        from django.db.models import Sum, Count, Q
-        
+    def update_rekap(tahun=None, perbarui_tahun_nol=True):
+        """
+        Update rekapitulasi untuk tahun tertentu atau semua tahun.
+
+        Agregasi per tahun dihitung sekali dengan GROUP BY segmen_jalan_id, digabung
+        dengan daftar segmen di memory, lalu ditulis dalam satu transaksi di bawah
+        lock baris rekap (lihat _tulis_rekap) agar delta signal yang berjalan
+        bersamaan tidak tertimpa. Segmen tanpa kecelakaan tetap mendapat baris
+        rekap bernilai 0.
+
+        Tahun 0 (semua tahun) tidak memindai ulang data kecelakaan, melainkan
+        dijumlahkan dari rekap per tahun (lihat rollup_tahun_nol); tahun yang
+        antri rebuild penuh direkap dulu. Setelah rekap satu tahun diperbarui,
+        rekap tahun 0 ikut diturunkan ulang jika sudah ada; jika isinya
+        berubah, Z-Score tahun 0 ditandai di AntrianZScore.
+        """
+        from django.db.models import Sum, Count
+
         if tahun is None or tahun == 0 or tahun == '0':
             tahun = 0
         else:
@@ -913,55 +911,282 @@ class RekapSegmen(models.Model):
                 tahun = int(tahun)
             except (ValueError, TypeError):
                 tahun = 0
-        
-        # Hapus rekap lama
-        RekapSegmen.objects.filter(periode_tahun=tahun).delete()
-        
-        # Hitung ulang dari data kecelakaan preprocessing
-        segmen_list = SegmenJalan.objects.all()
-        
-        for segmen in segmen_list:
-            if tahun == 0:
-                kecelakaan_data = KecelakaanPreprosesing.objects.filter(
-                    segmen_jalan=segmen
-                ).aggregate(
-                    jumlah=Count('id'),
-                    meninggal=Sum('korban_meninggal'),
-                    luka_berat=Sum('korban_luka_berat'),
-                    luka_ringan=Sum('korban_luka_ringan'),
-                    kerugian=Sum('kerugian_materi')
-                )
-            else:
-                kecelakaan_data = KecelakaanPreprosesing.objects.filter(
-                    segmen_jalan=segmen,
+
+        if tahun == 0:
+            RekapSegmen.rollup_tahun_nol()
+            return
+
+        def agregat():
+            # Satu query agregat untuk semua segmen (dijalankan _tulis_rekap di dalam transaksi)
+            return {
+                row['segmen_jalan_id']: row
+                for row in KecelakaanPreprosesing.objects.filter(
+                    segmen_jalan__isnull=False,
                     tanggal__year=tahun
-                ).aggregate(
+                ).order_by().values('segmen_jalan_id').annotate(
                     jumlah=Count('id'),
                     meninggal=Sum('korban_meninggal'),
                     luka_berat=Sum('korban_luka_berat'),
                     luka_ringan=Sum('korban_luka_ringan'),
                     kerugian=Sum('kerugian_materi')
                 )
-            
-            # Hitung total korban dari penjumlahan meninggal + luka_berat + luka_ringan
-            total_korban = (kecelakaan_data['meninggal'] or 0) + \
-                          (kecelakaan_data['luka_berat'] or 0) + \
-                          (kecelakaan_data['luka_ringan'] or 0)
-            
-            RekapSegmen.objects.create(
-                segmen_jalan=segmen,
-                jumlah_kecelakaan=kecelakaan_data['jumlah'] or 0,
-                total_korban=total_korban,
-                total_meninggal=kecelakaan_data['meninggal'] or 0,
-                total_luka_berat=kecelakaan_data['luka_berat'] or 0,
-                total_luka_ringan=kecelakaan_data['luka_ringan'] or 0,
-                total_kerugian=kecelakaan_data['kerugian'] or 0,
-                periode_tahun=tahun
+            }
+
+        RekapSegmen._tulis_rekap(tahun, agregat)
+
+        if perbarui_tahun_nol and RekapSegmen.objects.filter(periode_tahun=0).exists():
+            try:
+                berubah = RekapSegmen.rollup_tahun_nol(lengkapi=False)
+            except TimeoutError as e:
+                # Rollup diulang oleh worker antrian (calculate_zscore tahun 0)
+                print(f"⚠ {e}, rekap tahun 0 ditandai untuk dibangun ulang")
+                berubah = True
+            if berubah:
+                AntrianZScore.tandai(0)
+
+    @staticmethod
+    def rollup_tahun_nol(lengkapi=True, periksa_penuh=False):
+        """
+        Bangun rekap tahun 0 sebagai jumlah rekap per tahun (maksimal
+        segmen x tahun baris), bukan agregasi ulang seluruh data kecelakaan.
+
+        Dengan lengkapi=True, tahun yang rekapnya ditandai basi di
+        AntrianZScore (rebuild penuh: periode belum punya baris rekap, atau
+        kecelakaan di-assign tanpa signal) direkap ulang dulu sebelum
+        di-rollup. Pengecekan ini hanya membaca antrian, tanpa memindai data
+        kecelakaan.
+
+        periksa_penuh=True (rebuild penuh eksplisit, lihat command
+        recalculate_zscore --verify-rekap) mencocokkan rekap semua tahun dengan
+        data kecelakaan per (segmen, tahun), untuk perubahan yang tidak lewat
+        signal maupun antrian (misalnya QuerySet.update manual).
+
+        Mengembalikan True jika isi rekap tahun 0 berubah. Raise TimeoutError
+        jika lock rollup tidak didapat, agar rekap tahun 0 yang basi tidak
+        dianggap berhasil diperbarui.
+        """
+        from django.db.models import Sum
+        from .utils_lock import single_flight
+
+        if periksa_penuh:
+            for th in RekapSegmen._tahun_rekap_basi():
+                print(f"🔄 Rekap tahun {th} tidak cocok dengan data kecelakaan, direkap ulang sebelum rollup")
+                RekapSegmen.update_rekap(th, perbarui_tahun_nol=False)
+        elif lengkapi:
+            for th in RekapSegmen._tahun_rekap_antri():
+                print(f"🔄 Rekap tahun {th} ditandai basi di antrian, direkap ulang sebelum rollup")
+                RekapSegmen.update_rekap(th, perbarui_tahun_nol=False)
+
+        # Rollup tahun 0 bisa dipicu beberapa proses sekaligus (satu per tahun
+        # yang diperbarui); dijalankan bergantian agar tidak saling menimpa
+        timeout = getattr(settings, 'ZSCORE_LOCK_TIMEOUT', 30)
+        with single_flight("rekap_0", timeout=timeout) as kunci:
+            if not kunci.dapat:
+                raise TimeoutError(f"Rollup rekap tahun 0 sedang dijalankan proses lain (timeout {timeout}s)")
+            return RekapSegmen._tulis_rekap(0, lambda: {
+                row['segmen_jalan_id']: row
+                for row in RekapSegmen.objects.exclude(periode_tahun=0).order_by()
+                .values('segmen_jalan_id').annotate(
+                    jumlah=Sum('jumlah_kecelakaan'),
+                    meninggal=Sum('total_meninggal'),
+                    luka_berat=Sum('total_luka_berat'),
+                    luka_ringan=Sum('total_luka_ringan'),
+                    kerugian=Sum('total_kerugian')
+                )
+            })
+
+    @staticmethod
+    def _tahun_rekap_antri():
+        """Tahun (selain 0) yang antri rebuild penuh di AntrianZScore (satu query ke tabel antrian)"""
+        return sorted(set(
+            AntrianZScore.objects.filter(kunci_ruas=0).exclude(tahun=0).values_list('tahun', flat=True)
+        ))
+
+    @staticmethod
+    def _tahun_rekap_basi():
+        """
+        Tahun yang rekapnya tidak cocok dengan data kecelakaan, dibandingkan per
+        (segmen, tahun) atas jumlah, korban, dan kerugian (dua query GROUP BY
+        atas seluruh tabel; hanya untuk rebuild penuh eksplisit)
+        """
+        from django.db.models import Sum, Count
+        from django.db.models.functions import ExtractYear
+
+        data = {
+            (segmen_id, th): tuple(v or 0 for v in nilai)
+            for segmen_id, th, *nilai in KecelakaanPreprosesing.objects.filter(
+                segmen_jalan__isnull=False, tanggal__isnull=False
+            ).order_by().annotate(th=ExtractYear('tanggal')).values('segmen_jalan_id', 'th').annotate(
+                jumlah=Count('id'),
+                meninggal=Sum('korban_meninggal'),
+                luka_berat=Sum('korban_luka_berat'),
+                luka_ringan=Sum('korban_luka_ringan'),
+                kerugian=Sum('kerugian_materi')
+            ).values_list('segmen_jalan_id', 'th', 'jumlah', 'meninggal', 'luka_berat', 'luka_ringan', 'kerugian')
+        }
+        rekap = {
+            (segmen_id, th): tuple(nilai)
+            for segmen_id, th, *nilai in RekapSegmen.objects.exclude(periode_tahun=0).order_by().values_list(
+                'segmen_jalan_id', 'periode_tahun', 'jumlah_kecelakaan',
+                'total_meninggal', 'total_luka_berat', 'total_luka_ringan', 'total_kerugian'
             )
+        }
+
+        nol = (0, 0, 0, 0, 0)
+        return sorted({
+            th for (segmen_id, th) in set(data) | set(rekap)
+            if data.get((segmen_id, th), nol) != rekap.get((segmen_id, th), nol)
+        })
+
+    @staticmethod
+    def _tulis_rekap(tahun, hitung_agregat):
+        """
+        Tulis rekap satu periode dari hitung_agregat() (dict segmen_id -> agregat).
+        Mengembalikan True jika isinya berbeda dengan rekap sebelumnya.
+
+        Baris rekap periode tersebut dikunci dulu (select_for_update), baru
+        agregat dihitung, dalam satu transaksi. Baris yang sudah ada di-UPDATE
+        di tempat, bukan dihapus lalu dibuat ulang: delta F-expression
+        (terapkan_delta) yang sudah di-commit ikut terhitung di agregat,
+        sedangkan delta yang datang setelahnya menunggu lock baris lalu
+        diterapkan di atas nilai baru, sehingga tidak ada delta yang tertimpa.
+        """
+        from django.db import transaction
+
+        kolom = ('jumlah_kecelakaan', 'total_korban', 'total_meninggal', 'total_luka_berat',
+                 'total_luka_ringan', 'total_kerugian')
+        kosong = {'jumlah': 0, 'meninggal': 0, 'luka_berat': 0, 'luka_ringan': 0, 'kerugian': 0}
+
+        with transaction.atomic():
+            rekap_lama = {
+                segmen_id: (pk, tuple(nilai))
+                for pk, segmen_id, *nilai in RekapSegmen.objects.select_for_update().filter(
+                    periode_tahun=tahun
+                ).order_by('id').values_list('id', 'segmen_jalan_id', *kolom)
+            }
+            agregat = hitung_agregat()
+
+            sekarang = timezone.now()
+            rekap_ubah, rekap_baru = [], []
+            for segmen_id in SegmenJalan.objects.values_list('id', flat=True):
+                kecelakaan_data = agregat.get(segmen_id, kosong)
+                meninggal = kecelakaan_data['meninggal'] or 0
+                luka_berat = kecelakaan_data['luka_berat'] or 0
+                luka_ringan = kecelakaan_data['luka_ringan'] or 0
+
+                # Total korban = meninggal + luka_berat + luka_ringan
+                nilai = (
+                    kecelakaan_data['jumlah'] or 0, meninggal + luka_berat + luka_ringan,
+                    meninggal, luka_berat, luka_ringan, kecelakaan_data['kerugian'] or 0,
+                )
+                lama = rekap_lama.get(segmen_id)
+                if lama is None:
+                    rekap_baru.append(RekapSegmen(segmen_jalan_id=segmen_id, periode_tahun=tahun, **dict(zip(kolom, nilai))))
+                elif lama[1] != nilai:
+                    rekap_ubah.append(RekapSegmen(id=lama[0], updated_at=sekarang, **dict(zip(kolom, nilai))))
+
+            if rekap_ubah:
+                RekapSegmen.objects.bulk_update(rekap_ubah, [*kolom, 'updated_at'], batch_size=500)
+            if rekap_baru:
+                RekapSegmen.objects.bulk_create(rekap_baru, batch_size=1000)
+        return bool(rekap_ubah or rekap_baru)
+
+    @staticmethod
+    def terapkan_delta(segmen_jalan_id, tahun, tanda, meninggal=0, luka_berat=0, luka_ringan=0, kerugian=0):
+        """
+        Tambah (tanda=1) atau kurangi (tanda=-1) kontribusi satu kecelakaan pada
+        rekap segmen untuk tahun kecelakaan dan tahun 0 (semua tahun).
+
+        Memakai F-expression sehingga penambahan dilakukan di database (aman dari
+        race condition antar request). Mengembalikan daftar periode yang baris
+        rekapnya belum ada, yang perlu dibangun ulang dengan update_rekap.
+        """
+        from django.db.models import F
+        
+        total_korban = meninggal + luka_berat + luka_ringan
+        belum_ada = []
+        for periode in (tahun, 0):
+            jumlah_update = RekapSegmen.objects.filter(
+                segmen_jalan_id=segmen_jalan_id,
+                periode_tahun=periode
+            ).update(
+                jumlah_kecelakaan=F('jumlah_kecelakaan') + tanda,
+                total_korban=F('total_korban') + tanda * total_korban,
+                total_meninggal=F('total_meninggal') + tanda * meninggal,
+                total_luka_berat=F('total_luka_berat') + tanda * luka_berat,
+                total_luka_ringan=F('total_luka_ringan') + tanda * luka_ringan,
+                total_kerugian=F('total_kerugian') + tanda * kerugian,
+                updated_at=timezone.now()
+            )
+            if not jumlah_update:
+                belum_ada.append(periode)
+        return belum_ada
+
+    @staticmethod
+    def terapkan_delta_batch(delta):
+        """
+        Versi banyak kecelakaan dari terapkan_delta, untuk penulisan massal yang
+        tidak memicu signal (bulk_update command reassign).
+
+        `delta` berisi (segmen_jalan_id, tahun) -> [jumlah, meninggal, luka_berat,
+        luka_ringan, kerugian] yang sudah dijumlahkan (kontribusi lama bertanda
+        negatif). Satu UPDATE F-expression per (segmen, periode), termasuk tahun 0.
+        Mengembalikan set periode yang baris rekapnya belum ada.
+        """
+        from django.db.models import F
+
+        per_periode = {}
+        for (segmen_id, tahun), nilai in delta.items():
+            for periode in (tahun, 0):
+                total = per_periode.setdefault((segmen_id, periode), [0, 0, 0, 0, 0])
+                for i, v in enumerate(nilai):
+                    total[i] += v
+
+        belum_ada = set()
+        for (segmen_id, periode), (jumlah, meninggal, luka_berat, luka_ringan, kerugian) in per_periode.items():
+            if not any((jumlah, meninggal, luka_berat, luka_ringan, kerugian)):
+                continue
+            jumlah_update = RekapSegmen.objects.filter(
+                segmen_jalan_id=segmen_id,
+                periode_tahun=periode
+            ).update(
+                jumlah_kecelakaan=F('jumlah_kecelakaan') + jumlah,
+                total_korban=F('total_korban') + (meninggal + luka_berat + luka_ringan),
+                total_meninggal=F('total_meninggal') + meninggal,
+                total_luka_berat=F('total_luka_berat') + luka_berat,
+                total_luka_ringan=F('total_luka_ringan') + luka_ringan,
+                total_kerugian=F('total_kerugian') + kerugian,
+                updated_at=timezone.now()
+            )
+            if not jumlah_update:
+                belum_ada.add(periode)
+        return belum_ada
+
+
+class AnalisisZScoreQuerySet(models.QuerySet):
+    def aktif(self):
+        """
+        Hanya baris dari snapshot versi aktif untuk tahunnya (pointer di VersiData
+        'zscore_<tahun>'). Tahun yang belum punya pointer memakai versi 0.
+        """
+        from django.db.models import CharField, OuterRef, Subquery, Value
+        from django.db.models.functions import Cast, Coalesce, Concat
+        from .utils_zscore import KUNCI_ZSCORE_AKTIF
+
+        versi_aktif = VersiData.objects.filter(
+            kunci=Concat(Value(KUNCI_ZSCORE_AKTIF), Cast(OuterRef('tahun'), CharField()))
+        ).values('versi')[:1]
+        return self.filter(versi=Coalesce(Subquery(versi_aktif), Value(0)))
 
 
 class AnalisisZScore(models.Model):
-    """Model untuk analisis Z-Score tingkat kerawanan kecelakaan"""
+    """
+    Model untuk analisis Z-Score tingkat kerawanan kecelakaan.
+
+    Hasil perhitungan ditulis sebagai snapshot versi baru lalu diaktifkan
+    dengan memindahkan pointer versi; pembaca memakai objects.aktif() agar
+    selalu melihat klasifikasi yang lengkap.
+    """
     
     KATEGORI_CHOICES = (
         ('sangat_tinggi', 'Sangat Tinggi (Z > 1.5)'),
@@ -971,6 +1196,14 @@ class AnalisisZScore(models.Model):
         ('sangat_rendah', 'Sangat Rendah (Z ≤ -1.5)'),
     )
     
+    WARNA_KATEGORI = {
+        'sangat_tinggi': '#d32f2f',  # Merah gelap
+        'tinggi': '#f57c00',          # Oranye
+        'sedang': '#fbc02d',          # Kuning
+        'rendah': '#7cb342',          # Hijau muda
+        'sangat_rendah': '#388e3c',  # Hijau
+    }
+    
     id = models.AutoField(primary_key=True)
     segmen_jalan = models.ForeignKey(
         SegmenJalan,
@@ -980,154 +1213,379 @@ class AnalisisZScore(models.Model):
     nilai_zscore = models.DecimalField(max_digits=5, decimal_places=3)
     kategori = models.CharField(max_length=20, choices=KATEGORI_CHOICES)
     tahun = models.IntegerField()
+    versi = models.PositiveIntegerField(default=0, help_text='Versi snapshot hasil perhitungan')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = AnalisisZScoreQuerySet.as_manager()
+    
     class Meta:
         verbose_name_plural = 'Analisis Z-Score'
-        unique_together = ('segmen_jalan', 'tahun')
+        unique_together = ('segmen_jalan', 'tahun', 'versi')
         ordering = ['-tahun', '-nilai_zscore']
+        indexes = [
+            models.Index(fields=['tahun', 'versi']),
+        ]
     
     def __str__(self):
         return f"{self.segmen_jalan} - {self.kategori} ({self.nilai_zscore}) - {self.tahun}"
     
+    @staticmethod
+    def sidik_data():
+        """
+        Fingerprint data sumber Z-Score: jumlah baris dan updated_at terakhir
+        KecelakaanPreprosesing dan SegmenJalan. Berubah setiap ada data yang
+        ditambah, diubah, atau dihapus.
+        """
+        from django.db.models import Count, Max
+        
+        bagian = []
+        for model in (KecelakaanPreprosesing, SegmenJalan):
+            data = model.objects.order_by().aggregate(jumlah=Count('id'), terakhir=Max('updated_at'))
+            terakhir = data['terakhir'].timestamp() if data['terakhir'] else 0
+            bagian.append(f"{data['jumlah']}@{terakhir:.6f}")
+        return '|'.join(bagian)
+    
     @staticmethod
     def calculate_zscore_all_years():
-        """Hitung Z-Score untuk semua tahun (tahun=0)"""
-        AnalisisZScore.calculate_zscore(0)
+        """
+        Hitung Z-Score untuk semua tahun (tahun=0), hanya jika fingerprint data
+        sumber berubah sejak snapshot tahun 0 terakhir dibuat.
+        """
+        from .utils_zscore import kunci_zscore_aktif
+        
+        kunci = kunci_zscore_aktif(0)
+        sidik = AnalisisZScore.sidik_data()
+        sidik_tersimpan = VersiData.objects.filter(kunci=kunci).values_list('sidik', flat=True).first()
+        if sidik_tersimpan == sidik and AnalisisZScore.objects.aktif().filter(tahun=0).exists():
+            return False
+        
+        # Sidik baru disimpan oleh calculate_zscore setelah snapshot dibuat
+        return AnalisisZScore.calculate_zscore(0, gabung=True)
     
     @staticmethod
-    def calculate_zscore(tahun=None):
-        """Hitung Z-Score untuk setiap segmen PER RUAS JALAN dengan interval dinamis"""
-        from django.db.models import Avg, StdDev, Max, Min
-        import decimal
+    def pastikan_zscore(tahun):
+        """
+        Hitung Z-Score hanya jika tahun tersebut belum punya snapshot aktif.
+        Dipakai view: jika banyak request datang bersamaan, hanya satu yang
+        menghitung dan sisanya memakai hasilnya.
+        """
+        if AnalisisZScore.objects.aktif().filter(tahun=tahun).exists():
+            return False
+        return AnalisisZScore.calculate_zscore(tahun, gabung=True)
+    
+    @staticmethod
+    def calculate_zscore(tahun=None, gabung=False):
+        """
+        Hitung Z-Score untuk setiap segmen PER RUAS JALAN dengan interval dinamis.
+
+        Statistik semua ruas dihitung sekaligus (groupby NumPy di utils_zscore)
+        dari satu query rekap, lalu hasilnya ditulis dengan satu bulk_create.
+
+        Dijalankan di bawah single-flight lock per tahun: hanya satu proses yang
+        menghitung tahun yang sama pada satu waktu. Dengan gabung=True, proses
+        yang harus menunggu lock tidak menghitung ulang (memakai hasil proses
+        yang baru selesai), kecuali data sumber sudah berubah sejak perhitungan
+        itu dimulai (sidik_data berbeda dengan sidik yang disimpan bersama
+        pointer versi aktif). Jika lock tidak didapat sebelum timeout, snapshot
+        lama tetap dipakai. Mengembalikan True jika perhitungan dijalankan.
+        """
+        from django.conf import settings
+        from .utils_lock import single_flight
+        from .utils_zscore import kunci_zscore_aktif
         
         if tahun is None or tahun == 0 or tahun == '0':
             tahun = 0
         
-        # 1. Pastikan data rekapitulasi kecelakaan sudah diperbarui untuk tahun yang dipilih
-        RekapSegmen.update_rekap(tahun)
-        
-        # 2. Hapus data analisis Z-Score lama untuk tahun tersebut agar tidak duplikat
-        AnalisisZScore.objects.filter(tahun=tahun).delete()
+        timeout = getattr(settings, 'ZSCORE_LOCK_TIMEOUT', 30)
+        with single_flight(f"zscore_{tahun}", timeout=timeout) as kunci:
+            if not kunci.dapat:
+                print(f"⚠ Z-Score {tahun} sedang dihitung proses lain (timeout {timeout}s), memakai snapshot lama")
+                return False
+            # Sidik diambil sebelum perhitungan: jika data berubah selama proses,
+            # sidik tersimpan sudah basi dan perhitungan berikutnya tetap jalan
+            sidik = AnalisisZScore.sidik_data()
+            if gabung and kunci.menunggu:
+                sidik_tersimpan = VersiData.objects.filter(
+                    kunci=kunci_zscore_aktif(tahun)
+                ).values_list('sidik', flat=True).first()
+                if sidik_tersimpan == sidik:
+                    print(f"ℹ Z-Score {tahun} baru saja dihitung proses lain (tunggu {kunci.waktu_tunggu:.2f}s)")
+                    return False
+                print(f"ℹ Data berubah sejak perhitungan proses lain dimulai, Z-Score {tahun} dihitung ulang")
+            
+            # 1. Pastikan data rekapitulasi kecelakaan sudah diperbarui untuk tahun yang dipilih
+            RekapSegmen.update_rekap(tahun)
+            
+            # 2. Hitung ulang Z-Score semua ruas dari rekap tersebut
+            AnalisisZScore.hitung_ulang_zscore(tahun)
+            VersiData.objects.filter(kunci=kunci_zscore_aktif(tahun)).update(sidik=sidik)
+        return True
+    
+    @staticmethod
+    def hitung_ulang_zscore(tahun, ruas_ids=None):
+        """
+        Hitung ulang Z-Score dari RekapSegmen yang sudah ada (tanpa update_rekap).
+        Jika ruas_ids diberikan, hanya segmen pada ruas tersebut yang dihitung;
+        hasil ruas lain disalin apa adanya dari snapshot aktif.
+
+        Hasil ditulis sebagai snapshot versi baru, lalu pointer versi aktif tahun
+        tersebut dipindahkan (satu UPDATE) dan snapshot lama dihapus. Pembaca
+        tidak pernah melihat tabel kosong atau setengah terisi.
+        """
+        from .utils_zscore import hitung_zscore_per_ruas, KATEGORI_KELAS, VERSI_ZSCORE, kunci_zscore_aktif
+        import decimal
         
-        # 3. Ambil semua daftar ruas jalan yang unik
-        ruas_jalan_list = RuasJalan.objects.all().distinct()
+        # Ambil jumlah kecelakaan semua segmen beserta ruas-nya dalam satu query
+        rekap_qs = RekapSegmen.objects.filter(periode_tahun=tahun)
+        if ruas_ids is not None:
+            rekap_qs = rekap_qs.filter(segmen_jalan__ruas_jalan_id__in=ruas_ids)
+        rekap_rows = list(
+            rekap_qs.order_by('segmen_jalan__ruas_jalan_id', 'segmen_jalan_id')
+            .values_list('segmen_jalan_id', 'segmen_jalan__ruas_jalan_id', 'jumlah_kecelakaan')
+        )
         
         print(f"\n📊 Calculating Z-Score for {tahun} - Per Ruas Jalan (Dynamic Intervals)")
         print(f"{'='*80}")
         
-        # 4. Iterasi setiap ruas jalan untuk menghitung Z-Score secara spesifik per ruas
-        for ruas_jalan in ruas_jalan_list:
-            # Ambil semua segmen yang termasuk dalam ruas jalan ini
-            segments_in_ruas = SegmenJalan.objects.filter(ruas_jalan=ruas_jalan)
-            
-            # Hitung statistik dasar (Rata-rata dan Standar Deviasi) dari jumlah kecelakaan di ruas ini
-            # StdDev (σ) mengukur seberapa jauh variasi data kecelakaan dari rata-ratanya
-            
-            # Standar Deviasi digunakan untuk memahami apakah angka kecelakaan di suatu 
-            # ruas jalan cenderung merata di semua segmen, atau hanya menumpuk di titik-titik tertentu saja.
-            # Nilai ini kemudian menjadi pembagi dalam rumus Z-Score untuk menentukan apakah sebuah angka kecelakaan di satu segmen termasuk "ekstrim" (rawan) atau masih dalam batas wajar.
-            stats = RekapSegmen.objects.filter(
-                periode_tahun=tahun,
-                segmen_jalan__in=segments_in_ruas
-            ).aggregate(
-                mean=Avg('jumlah_kecelakaan'),
-                stddev=StdDev('jumlah_kecelakaan')
-            )
-            
-            mean = float(stats['mean'] or 0)
-            stddev = float(stats['stddev'] or 1)
-            
-            # Hindari pembagian dengan nol jika standar deviasi tidak terhitung
-            if stddev == 0:
-                stddev = 1
-            
-            # 5. Hitung nilai Z-Score mentah untuk setiap segmen
-            # Rumus: Z = (X - μ) / σ
-            # Di mana X = jumlah kecelakaan, μ = rata-rata, σ = standar deviasi
-            zscore_dict = {}
-            rekap_list = RekapSegmen.objects.filter(
-                periode_tahun=tahun,
-                segmen_jalan__in=segments_in_ruas
+        # Hitung mean, stddev (populasi), Z = (X - μ) / σ, Z_min/Z_max dan
+        # kategori interval untuk semua ruas sekaligus
+        zscores, kelas, statistik = hitung_zscore_per_ruas(
+            [row[1] for row in rekap_rows],
+            [row[2] for row in rekap_rows],
+        )
+        
+        nama_ruas = dict(RuasJalan.objects.filter(id__in=statistik.keys()).values_list('id', 'nama_ruas'))
+        for ruas_id, stat in statistik.items():
+            t1, t2, t3, t4 = stat['thresholds']
+            print(f"\n🛣️ Ruas: {nama_ruas.get(ruas_id)} ({stat['jumlah_segmen']} segmen)")
+            print(f"   Mean: {stat['mean']:.2f}, StdDev: {stat['stddev']:.2f}")
+            print(f"   Z_max: {stat['z_max']:.3f}, Z_min: {stat['z_min']:.3f}, Interval: {stat['interval']:.3f}")
+            print(f"   Thresholds: {t1:.3f} | {t2:.3f} | {t3:.3f} | {t4:.3f}")
+        
+        # Nomor versi unik untuk snapshot baru (urutan global, tidak bentrok antar proses)
+        versi_baru = VersiData.naikkan(VERSI_ZSCORE)
+        
+        hasil = [
+            AnalisisZScore(
+                segmen_jalan_id=segmen_id,
+                nilai_zscore=decimal.Decimal(str(round(float(zscore), 3))),
+                kategori=KATEGORI_KELAS[k],
+                tahun=tahun,
+                versi=versi_baru
             )
-            
-            for rekap in rekap_list:
-                zscore = (float(rekap.jumlah_kecelakaan) - mean) / stddev
-                zscore_dict[rekap.segmen_jalan.id] = {
-                    'rekap': rekap,
-                    'zscore': zscore
-                }
-            
-            # 6. Tentukan nilai Z_max dan Z_min untuk menentukan rentang interval klasifikasi
-            if zscore_dict:
-                zscore_values = [item['zscore'] for item in zscore_dict.values()]
-                z_max = max(zscore_values)
-                z_min = min(zscore_values)
-            else:
-                z_max = 0
-                z_min = 0
-            
-            # 7. Hitung Interval (I) untuk membagi data ke dalam 5 kategori klasifikasi
-            # Rumus Interval: I = (Z_max - Z_min) / Jumlah_Kelas
-            num_classifications = 5
-            if z_max != z_min:
-                interval = (z_max - z_min) / num_classifications
-            else:
-                interval = 1  # Default jika semua nilai Z-Score sama
-            
-            # 8. Tentukan ambang batas (threshold) untuk setiap tingkatan kategori
-            threshold_1 = z_min + (1 * interval)  # Batas Sangat Rendah -> Rendah
-            threshold_2 = z_min + (2 * interval)  # Batas Rendah -> Sedang
-            threshold_3 = z_min + (3 * interval)  # Batas Sedang -> Tinggi
-            threshold_4 = z_min + (4 * interval)  # Batas Tinggi -> Sangat Tinggi
-            
-            segmen_count = segments_in_ruas.count()
-            print(f"\n🛣️ Ruas: {ruas_jalan.nama_ruas} ({segmen_count} segmen)")
-            print(f"   Mean: {mean:.2f}, StdDev: {stddev:.2f}")
-            print(f"   Z_max: {z_max:.3f}, Z_min: {z_min:.3f}, Interval: {interval:.3f}")
-            print(f"   Thresholds: {threshold_1:.3f} | {threshold_2:.3f} | {threshold_3:.3f} | {threshold_4:.3f}")
-            
-            # 9. Klasifikasikan setiap segmen ke dalam kategori berdasarkan threshold yang sudah dihitung
-            for segmen_id, data in zscore_dict.items():
-                rekap = data['rekap']
-                zscore = data['zscore']
-                
-                # Penentuan kategori secara dinamis
-                if zscore >= threshold_4:
-                    kategori = 'sangat_tinggi'
-                elif zscore >= threshold_3:
-                    kategori = 'tinggi'
-                elif zscore >= threshold_2:
-                    kategori = 'sedang'
-                elif zscore >= threshold_1:
-                    kategori = 'rendah'
-                else:
-                    kategori = 'sangat_rendah'
-                
-                # 10. Simpan hasil analisis Z-Score ke database
-                AnalisisZScore.objects.create(
-                    segmen_jalan=rekap.segmen_jalan,
-                    nilai_zscore=decimal.Decimal(str(round(zscore, 3))),
+            for (segmen_id, _, _), zscore, k in zip(rekap_rows, zscores, kelas)
+        ]
+        
+        # Ruas di luar scope: salin hasil dari snapshot aktif
+        if ruas_ids is not None:
+            hasil += [
+                AnalisisZScore(
+                    segmen_jalan_id=segmen_id,
+                    nilai_zscore=nilai_zscore,
                     kategori=kategori,
-                    tahun=tahun
+                    tahun=tahun,
+                    versi=versi_baru
                 )
-                
-                print(f"   ✓ {rekap.segmen_jalan.nama_segmen}: {rekap.jumlah_kecelakaan} accidents → Z={zscore:.3f} ({kategori})")
+                for segmen_id, nilai_zscore, kategori in AnalisisZScore.objects.aktif().filter(
+                    tahun=tahun
+                ).exclude(
+                    segmen_jalan__ruas_jalan_id__in=ruas_ids
+                ).values_list('segmen_jalan_id', 'nilai_zscore', 'kategori')
+            ]
         
+        AnalisisZScore.objects.bulk_create(hasil, batch_size=1000)
+        
+        # Aktifkan snapshot baru, lalu buang snapshot lama. Jika snapshot yang
+        # lebih baru sudah aktif duluan, snapshot ini yang dibuang.
+        if VersiData.pindahkan(kunci_zscore_aktif(tahun), versi_baru):
+            AnalisisZScore.objects.filter(tahun=tahun, versi__lt=versi_baru).delete()
+        else:
+            AnalisisZScore.objects.filter(tahun=tahun, versi=versi_baru).delete()
+        
+        print(f"\n✓ {len(hasil)} segmen dianalisis (snapshot v{versi_baru})")
         print(f"\n{'='*80}\n")
-
+    
+    @staticmethod
+    def statistik_kategori(tahun):
+        """
+        Jumlah segmen per kategori dan total di snapshot aktif tahun tersebut
+        dalam satu query conditional aggregate. Hasil di-cache per versi
+        snapshot aktif, jadi otomatis basi saat snapshot baru dipasang.
+        """
+        from django.core.cache import cache
+        from django.db.models import Count, Q
+        from .utils_zscore import KATEGORI_KELAS, kunci_zscore_aktif
+        
+        tahun = int(tahun)
+        kunci_cache = f"statistik_zscore:{tahun}:{VersiData.get_versi(kunci_zscore_aktif(tahun))}"
+        statistik = cache.get(kunci_cache)
+        if statistik is None:
+            statistik = AnalisisZScore.objects.aktif().filter(tahun=tahun).aggregate(
+                total=Count('id'),
+                **{kategori: Count('id', filter=Q(kategori=kategori)) for kategori in KATEGORI_KELAS},
+            )
+            cache.set(kunci_cache, statistik, 60 * 60)
+        return statistik
+    
+    @staticmethod
+    def per_kategori(tahun):
+        """
+        Analisis snapshot aktif tahun tersebut dikelompokkan per kategori
+        (dict kategori -> list, urut Z-Score tertinggi), dari satu query dengan
+        segmen dan ruas (select_related) serta jumlah kecelakaan segmen.
+        """
+        from django.db.models import Count
+        from .utils_zscore import KATEGORI_KELAS
+        
+        per_kategori = {kategori: [] for kategori in reversed(KATEGORI_KELAS)}
+        analisis = AnalisisZScore.objects.aktif().filter(tahun=tahun).select_related(
+            'segmen_jalan__ruas_jalan'
+        ).defer(
+            'segmen_jalan__geometry', 'segmen_jalan__geometry_peta', 'segmen_jalan__ruas_jalan__geometry'
+        ).annotate(
+            jumlah_kecelakaan=Count('segmen_jalan__kecelakaan')
+        ).order_by('-nilai_zscore')
+        for item in analisis:
+            per_kategori.setdefault(item.kategori, []).append(item)
+        return per_kategori
     
     def get_kategori_display_color(self):
         """Dapatkan warna untuk kategori Z-Score"""
-        colors = {
-            'sangat_tinggi': '#d32f2f',  # Merah gelap
-            'tinggi': '#f57c00',          # Oranye
-            'sedang': '#fbc02d',          # Kuning
-            'rendah': '#7cb342',          # Hijau muda
-            'sangat_rendah': '#388e3c',  # Hijau
-        }
-        return colors.get(self.kategori, '#999999')
+        return AnalisisZScore.WARNA_KATEGORI.get(self.kategori, '#999999')
+
+
+class AntrianZScore(models.Model):
+    """
+    Antrian scope (tahun, ruas) yang Z-Score-nya perlu dihitung ulang.
+
+    Signal kecelakaan hanya menandai scope sebagai dirty; worker
+    (management command process_zscore_queue) menghitung ulang setiap scope
+    sekali saja setelah tidak ada penandaan baru selama jendela debounce.
+    ruas_jalan kosong berarti rekap dan Z-Score seluruh ruas tahun tersebut
+    harus dibangun ulang penuh. Keunikan dijaga lewat kunci_ruas (id ruas,
+    0 = semua ruas) karena NULL tidak dianggap sama oleh unique index.
+    """
+    tahun = models.IntegerField()
+    ruas_jalan = models.ForeignKey(
+        RuasJalan,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='antrian_zscore',
+        help_text='Kosong = hitung ulang rekap & Z-Score semua ruas'
+    )
+    kunci_ruas = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text='Id ruas untuk keunikan antrian, 0 = semua ruas'
+    )
+    dibuat_at = models.DateTimeField(auto_now_add=True)
+    ditandai_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Antrian Z-Score'
+        unique_together = ('tahun', 'kunci_ruas')
+        ordering = ['dibuat_at']
+
+    def __str__(self):
+        return f"{self.tahun} - {self.ruas_jalan_id or 'semua ruas'}"
+
+    def save(self, *args, **kwargs):
+        self.kunci_ruas = self.ruas_jalan_id or 0
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def tandai(tahun, ruas_ids=None):
+        """
+        Tandai (tahun, ruas) sebagai dirty; ruas_ids None = semua ruas.
+
+        INSERT dijalankan dalam savepoint sendiri: jika kalah race dengan
+        proses lain (IntegrityError), hanya savepoint itu yang di-rollback dan
+        transaksi pemanggil (misalnya save kecelakaan) tetap bisa di-commit.
+        """
+        from django.db import IntegrityError, transaction
+
+        for ruas_id in (ruas_ids if ruas_ids is not None else [None]):
+            updated = AntrianZScore.objects.filter(tahun=tahun, kunci_ruas=ruas_id or 0).update(
+                ditandai_at=timezone.now()
+            )
+            if not updated:
+                try:
+                    with transaction.atomic():
+                        AntrianZScore.objects.create(tahun=tahun, ruas_jalan_id=ruas_id)
+                except IntegrityError:
+                    pass
+
+    @staticmethod
+    def status_data(tahun):
+        """'pending' jika masih ada perhitungan Z-Score yang antri untuk tahun ini, selain itu 'fresh'"""
+        return 'pending' if AntrianZScore.objects.filter(tahun=tahun).exists() else 'fresh'
+
+    @staticmethod
+    def proses(debounce_detik=10, maks_tunggu_detik=60):
+        """
+        Hitung ulang semua scope yang sudah siap dan hapus dari antrian.
+
+        Scope siap jika tidak ditandai lagi selama `debounce_detik`, atau sudah
+        menunggu lebih dari `maks_tunggu_detik` (agar tidak tertahan terus saat
+        upload berjalan). Beberapa ruas di tahun yang sama digabung menjadi satu
+        perhitungan. Mengembalikan dict tahun -> daftar ruas (None = semua ruas).
+
+        Setelah perhitungan parsial yang menghabiskan antrian sebuah tahun,
+        bagian kecelakaan dari sidik tersimpan diperbarui (bagian segmen tetap)
+        agar calculate_zscore_all_years tidak menghitung ulang tahun 0 penuh
+        untuk perubahan yang sudah diproses worker.
+        """
+        from datetime import timedelta
+        from django.db.models import Q
+        from .utils_lock import single_flight
+        from .utils_zscore import kunci_zscore_aktif
+
+        waktu_ambil = timezone.now()
+        siap = AntrianZScore.objects.filter(
+            Q(ditandai_at__lte=waktu_ambil - timedelta(seconds=debounce_detik)) |
+            Q(dibuat_at__lte=waktu_ambil - timedelta(seconds=maks_tunggu_detik))
+        )
+
+        scope = {}
+        for pk, tahun, ruas_id in siap.values_list('id', 'tahun', 'ruas_jalan_id'):
+            entry = scope.setdefault(tahun, {'ids': [], 'ruas': set()})
+            entry['ids'].append(pk)
+            entry['ruas'].add(ruas_id)
+
+        hasil = {}
+        for tahun, entry in sorted(scope.items()):
+            sidik_kecelakaan = None
+            if None in entry['ruas']:
+                if not AnalisisZScore.calculate_zscore(tahun):
+                    continue
+                hasil[tahun] = [None]
+            else:
+                # Lock yang sama dengan calculate_zscore agar snapshot parsial
+                # tidak menimpa snapshot penuh yang sedang dibuat
+                with single_flight(f"zscore_{tahun}", timeout=getattr(settings, 'ZSCORE_LOCK_TIMEOUT', 30)) as kunci:
+                    if not kunci.dapat:
+                        continue
+                    # Diambil sebelum perhitungan, sama seperti di calculate_zscore
+                    sidik_kecelakaan = AnalisisZScore.sidik_data().split('|')[0]
+                    AnalisisZScore.hitung_ulang_zscore(tahun, ruas_ids=entry['ruas'])
+                hasil[tahun] = sorted(entry['ruas'])
+
+            # Entri yang ditandai ulang selama perhitungan tetap di antrian
+            AntrianZScore.objects.filter(id__in=entry['ids'], ditandai_at__lte=waktu_ambil).delete()
+
+            # Tahun ini sudah mengikuti semua perubahan kecelakaan yang diantrikan
+            # sebelum sidik diambil. Bagian segmen tidak diganti: perubahan
+            # segmen tetap memicu perhitungan penuh.
+            if sidik_kecelakaan is not None and not AntrianZScore.objects.filter(tahun=tahun).exists():
+                versi_aktif = VersiData.objects.filter(kunci=kunci_zscore_aktif(tahun))
+                sidik_tersimpan = versi_aktif.values_list('sidik', flat=True).first()
+                if sidik_tersimpan:
+                    sidik_segmen = sidik_tersimpan.split('|')[1]
+                    versi_aktif.update(sidik=f"{sidik_kecelakaan}|{sidik_segmen}")
+
+        return hasil
 
 
 class KecelakaanRaw(models.Model):
@@ -1178,6 +1636,10 @@ class KecelakaanPreprosesing(models.Model):
     latitude = models.DecimalField(max_digits=30, decimal_places=20)
     longitude = models.DecimalField(max_digits=30, decimal_places=20)
     segmen_jalan = models.ForeignKey(SegmenJalan, on_delete=models.SET_NULL, null=True, blank=True, related_name='kecelakaan_preprosesing')
+    jarak_segmen_km = models.FloatField(null=True, blank=True, help_text="Jarak perpendicular titik ke segmen saat di-match (km)")
+    posisi_km = models.FloatField(null=True, blank=True, help_text="Posisi titik sepanjang ruas jalan (km dari awal ruas) hasil match")
+    versi_matcher = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Versi algoritma matcher yang menghasilkan segmen_jalan")
+    versi_segmen = models.PositiveBigIntegerField(null=True, blank=True, help_text="Versi data segmen (VersiData 'segmen') yang dipakai saat match")
     korban_meninggal = models.IntegerField(default=0, validators=[MinValueValidator(0)])
     korban_luka_berat = models.IntegerField(default=0, validators=[MinValueValidator(0)])
     korban_luka_ringan = models.IntegerField(default=0, validators=[MinValueValidator(0)])
@@ -1200,6 +1662,9 @@ class KecelakaanPreprosesing(models.Model):
     class Meta:
         verbose_name_plural = 'Data Kecelakaan Preprocessing'
         ordering = ['-tanggal', '-waktu']
+        indexes = [
+            models.Index(fields=['segmen_jalan', 'posisi_km']),
+        ]
     
     @property
     def total_korban(self):
@@ -1209,142 +1674,61 @@ class KecelakaanPreprosesing(models.Model):
         return f"Preproses {self.tanggal} - {self.kecamatan}"
     
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        
-        # Otomatis assign segmen jalan terdekat
-        if self.latitude and self.longitude and not self.segmen_jalan:
-            self.find_closest_segment()
-            # Jika find_closest_segment berhasil assign, simpan perubahan
-            if self.segmen_jalan:
-                super().save(update_fields=['segmen_jalan'])
+        from django.db import transaction
+
+        # Simpan dan auto-assign dalam satu transaksi: versi data kecelakaan
+        # (signal on_commit) cukup dinaikkan sekali untuk kedua save
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            # Otomatis assign segmen jalan terdekat
+            if self.latitude and self.longitude and not self.segmen_jalan:
+                self.find_closest_segment()
+                # Jika find_closest_segment berhasil assign, simpan perubahan
+                if self.segmen_jalan:
+                    super().save(update_fields=['segmen_jalan', 'jarak_segmen_km', 'posisi_km', 'versi_matcher', 'versi_segmen'])
     
     def find_closest_segment(self):
         """
-        Temukan segmen jalan di mana titik kecelakaan berada TEPAT DI ANTARA
-        titik awal dan titik akhir segmen. Menggunakan proyeksi perpendicular
-        dari titik ke garis segmen untuk presisi maksimal.
+        Temukan segmen jalan di mana titik kecelakaan berada DI SEPANJANG
+        geometry segmen (polyline LineString, bukan hanya garis lurus titik
+        awal -> titik akhir). Menggunakan proyeksi perpendicular dari titik ke
+        sub-segmen polyline terdekat untuk presisi maksimal.
         
         Algoritma:
-        1. Cek apakah titik ada dalam bounding box segmen
-        2. Hitung jarak perpendicular dari titik ke garis segmen
-        3. Jika jarak <= tolerance, assign ke segmen tersebut
+        1. Ambil kandidat segmen dari spatial index (bounding box geometry memuat titik)
+        2. Proyeksikan titik ke setiap sub-segmen polyline kandidat
+        3. Jika jarak terkecil <= tolerance, assign ke segmen tersebut
         """
-        import math
+        from .utils_segmen import get_segmen_snapshot, TOLERANCE_KM, VERSI_MATCHER
         
         accident_lat = float(self.latitude)
         accident_lon = float(self.longitude)
         
         # Tolerance untuk jarak perpendicular: ~50 meter
-        tolerance_km = 0.050
+        tolerance_km = TOLERANCE_KM
         
         best_match = None
         smallest_distance = float('inf')
         
-        # Iterasi semua segmen untuk cek titik
-        for segmen in SegmenJalan.objects.select_related('ruas_jalan').all():
-            if not (segmen.lat_awal and segmen.lon_awal and segmen.lat_akhir and segmen.lon_akhir):
-                continue
-            
-            s_lat_awal = float(segmen.lat_awal)
-            s_lon_awal = float(segmen.lon_awal)
-            s_lat_akhir = float(segmen.lat_akhir)
-            s_lon_akhir = float(segmen.lon_akhir)
-            
-            # 1. Cek bounding box dulu (quick check)
-            buffer = 0.001  # ~111 meter
-            min_lat = min(s_lat_awal, s_lat_akhir) - buffer
-            max_lat = max(s_lat_awal, s_lat_akhir) + buffer
-            min_lon = min(s_lon_awal, s_lon_akhir) - buffer
-            max_lon = max(s_lon_awal, s_lon_akhir) + buffer
-            
-            if not (min_lat <= accident_lat <= max_lat and min_lon <= accident_lon <= max_lon):
-                continue
-            
-            # 2. Hitung jarak perpendicular dari titik ke garis segmen
-            perp_distance = self._calculate_perpendicular_distance(
-                accident_lat, accident_lon,
-                s_lat_awal, s_lon_awal,
-                s_lat_akhir, s_lon_akhir
-            )
-            
-            # 3. Jika jarak perpendicular <= tolerance, ini adalah match
-            if perp_distance is not None and perp_distance <= tolerance_km:
-                if perp_distance < smallest_distance:
-                    smallest_distance = perp_distance
-                    best_match = segmen
+        snapshot = get_segmen_snapshot()
+        match = snapshot.matcher.match(accident_lat, accident_lon, tolerance_km)
+        if match:
+            best_match_id, smallest_distance, posisi_dalam_segmen = match
+            best_match = SegmenJalan.objects.select_related('ruas_jalan').filter(pk=best_match_id).first()
         
         # Assign ke segmen terbaik jika ada match (tanpa save, dibiarkan parent save handle)
+        # Jarak dan posisi km ikut disimpan agar tidak perlu dihitung ulang saat analisis
         if best_match:
             self.segmen_jalan = best_match
+            self.jarak_segmen_km = smallest_distance
+            self.posisi_km = float(best_match.km_awal) + posisi_dalam_segmen
+            self.versi_matcher = VERSI_MATCHER
+            self.versi_segmen = snapshot.versi
             print(f"✓ KecelakaanPreprosesing {self.id} → Segmen '{best_match.nama_segmen}' (jarak perp: {smallest_distance*1000:.1f}m)")
         else:
             print(f"⚠ KecelakaanPreprosesing {self.id}: Tidak ada segmen yang sesuai (tolerance: {tolerance_km*1000:.0f}m)")
     
-    def _calculate_perpendicular_distance(self, lat, lon, lat1, lon1, lat2, lon2):
-        """
-        Hitung jarak PERPENDICULAR dari titik (lat, lon) ke garis segmen
-        antara titik (lat1, lon1) dan (lat2, lon2).
-        
-        Mengembalikan:
-        - Jarak dalam km jika titik proyeksi ada dalam segmen
-        - None jika titik proyeksi diluar rentang segmen
-        """
-        import math
-        
-        # Convert ke radians
-        lat = math.radians(lat)
-        lon = math.radians(lon)
-        lat1 = math.radians(lat1)
-        lon1 = math.radians(lon1)
-        lat2 = math.radians(lat2)
-        lon2 = math.radians(lon2)
-        
-        R = 6371  # Earth radius in km
-        
-        # Angular distance dari start ke accident
-        dLat = lat - lat1
-        dLon = lon - lon1
-        a = math.sin(dLat/2)**2 + math.cos(lat1) * math.cos(lat) * math.sin(dLon/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        d13 = R * c
-        
-        # Bearing dari start ke end
-        dLon12 = lon2 - lon1
-        y = math.sin(dLon12) * math.cos(lat2)
-        x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dLon12)
-        theta12 = math.atan2(y, x)
-        
-        # Bearing dari start ke accident
-        dLon13 = lon - lon1
-        y13 = math.sin(dLon13) * math.cos(lat)
-        x13 = math.cos(lat1) * math.sin(lat) - math.sin(lat1) * math.cos(lat) * math.cos(dLon13)
-        theta13 = math.atan2(y13, x13)
-        
-        # Cross-track distance (perpendicular distance)
-        dXt = math.asin(math.sin(d13/R) * math.sin(theta13 - theta12))
-        cross_track_distance_km = abs(dXt * R)
-        
-        # Along-track distance (untuk cek apakah dalam rentang)
-        try:
-            dAt = math.acos(max(-1, min(1, math.cos(d13/R) / abs(math.cos(dXt)))))
-        except:
-            dAt = 0
-        
-        # Jarak dari start ke end
-        dLat12 = lat2 - lat1
-        dLon12_calc = lon2 - lon1
-        a12 = math.sin(dLat12/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dLon12_calc/2)**2
-        c12 = 2 * math.asin(math.sqrt(a12))
-        d12 = R * c12
-        
-        # Cek apakah proyeksi ada dalam rentang segmen
-        # Dengan toleransi kecil di ujung-ujung segmen
-        if -0.05 <= dAt <= (d12 + 0.05):
-            return cross_track_distance_km
-        else:
-            # Proyeksi di luar segmen, jadi tidak cocok
-            return None
-    
     #=========================K-Means Location Models=========================
 class Kota(models.Model):
     nama = models.CharField(max_length=100)
@@ -1409,6 +1793,86 @@ class AIConfig(models.Model):
         return f"Config {self.tipe}"
 
 
+class VersiData(models.Model):
+    """
+    Penanda versi data per kunci (contoh: 'segmen'). Nilai `versi` dinaikkan
+    oleh signal setiap kali data terkait berubah, sehingga cache in-memory di
+    setiap proses/worker tahu kapan harus dibangun ulang.
+    """
+    kunci = models.CharField(max_length=30, unique=True)
+    versi = models.PositiveBigIntegerField(default=0)
+    sidik = models.CharField(max_length=100, blank=True, default='', help_text='Fingerprint data sumber saat versi ini dibuat')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Versi Data"
+
+    def __str__(self):
+        return f"{self.kunci} v{self.versi}"
+
+    @staticmethod
+    def get_versi(kunci):
+        """Versi terkini untuk kunci tertentu (0 jika belum pernah dinaikkan)"""
+        versi = VersiData.objects.filter(kunci=kunci).values_list('versi', flat=True).first()
+        return versi or 0
+
+    @staticmethod
+    def naikkan(kunci):
+        """
+        Naikkan versi secara atomik (UPDATE ... SET versi = versi + 1) dan
+        kembalikan nilai barunya (dibaca dalam transaksi yang sama, jadi unik).
+        """
+        from django.db import transaction
+        from django.db.models import F
+
+        with transaction.atomic():
+            updated = VersiData.objects.filter(kunci=kunci).update(
+                versi=F('versi') + 1, updated_at=timezone.now()
+            )
+            if not updated:
+                obj, created = VersiData.objects.get_or_create(kunci=kunci, defaults={'versi': 1})
+                if not created:
+                    VersiData.objects.filter(pk=obj.pk).update(versi=F('versi') + 1, updated_at=timezone.now())
+            return VersiData.get_versi(kunci)
+
+    @staticmethod
+    def pindahkan(kunci, versi):
+        """
+        Set versi ke nilai tertentu (pointer) hanya jika lebih baru dari nilai
+        sekarang. Mengembalikan True jika pointer berhasil dipindahkan.
+        """
+        from django.db import IntegrityError
+
+        updated = VersiData.objects.filter(kunci=kunci, versi__lt=versi).update(
+            versi=versi, updated_at=timezone.now()
+        )
+        if updated:
+            return True
+        try:
+            obj, created = VersiData.objects.get_or_create(kunci=kunci, defaults={'versi': versi})
+        except IntegrityError:
+            return False
+        return created
+
+
+class KunciProses(models.Model):
+    """
+    Baris lock single-flight untuk database yang tidak punya advisory lock
+    (dipakai utils_lock jika bukan MySQL). Lock yang melewati kedaluwarsa_at
+    dianggap yatim dan boleh diambil alih.
+    """
+    nama = models.CharField(max_length=64, unique=True)
+    token = models.CharField(max_length=32)
+    kedaluwarsa_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Kunci Proses"
+
+    def __str__(self):
+        return self.nama
+
+
 class LakaMentah(models.Model):
     """Model untuk menyimpan data laka mentah secara literal dari Excel"""
     id = models.AutoField(primary_key=True)
@@ -1,61 +1,192 @@
 """
 Django Signals untuk auto-update Z-Score, Rekap, dan auto-assign kecelakaan ke segmen
+
+Rekap diperbarui langsung (delta), sedangkan Z-Score hanya ditandai di
+AntrianZScore dan dihitung ulang oleh worker process_zscore_queue.
 """
-from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
-from .models import KecelakaanPreprosesing, RekapSegmen, AnalisisZScore, SegmenJalan
+from .models import KecelakaanPreprosesing, RekapSegmen, AntrianZScore, SegmenJalan, RuasJalan, VersiData
+from .utils_peta import VERSI_KECELAKAAN, VERSI_RUAS, kunci_versi_kecelakaan
+from .utils_geometri import hapus_geometri
+from .utils_segmen import invalidate_segmen_snapshot, vertex_segmen, SegmenPolylineMatcher, TOLERANCE_KM, VERSI_MATCHER, VERSI_SEGMEN
 
 
-@receiver(post_save, sender=KecelakaanPreprosesing)
-def update_on_kecelakaan_preprosesing_create(sender, instance, created, **kwargs):
+def _kontribusi_rekap(segmen_jalan_id, tanggal, meninggal, luka_berat, luka_ringan, kerugian):
+    """Kontribusi satu kecelakaan ke RekapSegmen, atau None jika belum punya segmen"""
+    if segmen_jalan_id is None or tanggal is None:
+        return None
+    return (segmen_jalan_id, tanggal.year, meninggal or 0, luka_berat or 0, luka_ringan or 0, kerugian or 0)
+
+
+def _kontribusi_instance(instance):
+    return _kontribusi_rekap(
+        instance.segmen_jalan_id,
+        instance.tanggal,
+        instance.korban_meninggal,
+        instance.korban_luka_berat,
+        instance.korban_luka_ringan,
+        instance.kerugian_materi,
+    )
+
+
+def _terapkan_perubahan_rekap(lama, baru):
     """
-    Trigger update RekapSegmen dan AnalisisZScore ketika KecelakaanPreprosesing dibuat atau diupdate
+    Geser kontribusi kecelakaan di RekapSegmen dari `lama` ke `baru` (F-expression),
+    lalu tandai Z-Score ruas yang distribusinya berubah sebagai dirty di AntrianZScore.
+    Periode yang baris rekapnya belum ada ditandai untuk dibangun ulang penuh.
+    Perhitungan Z-Score sendiri dilakukan worker process_zscore_queue.
     """
-    if created:
-        print(f"✅ Signal: Kecelakaan Preprosesing baru dibuat. Auto-updating calculations...")
-        
-        # Dapatkan tahun dari data kecelakaan
-        tahun = instance.tanggal.year
-        
-        # Update rekap untuk tahun tersebut
-        try:
-            RekapSegmen.update_rekap(tahun)
-            print(f"✅ RekapSegmen updated for tahun {tahun}")
-        except Exception as e:
-            print(f"❌ Error updating RekapSegmen: {str(e)}")
-        
-        # Update Z-Score untuk tahun tersebut
-        try:
-            AnalisisZScore.calculate_zscore(tahun)
-            print(f"✅ AnalisisZScore calculated for tahun {tahun}")
-        except Exception as e:
-            print(f"❌ Error calculating Z-Score: {str(e)}")
+    if lama == baru:
+        return
+    
+    ruas_per_periode = {}
+    periode_rebuild = set()
+    for kontribusi, tanda in ((lama, -1), (baru, 1)):
+        if kontribusi is None:
+            continue
+        segmen_id, tahun = kontribusi[0], kontribusi[1]
+        periode_rebuild.update(RekapSegmen.terapkan_delta(segmen_id, tahun, tanda, *kontribusi[2:]))
+        ruas_id = SegmenJalan.objects.filter(pk=segmen_id).values_list('ruas_jalan_id', flat=True).first()
+        for periode in (tahun, 0):
+            ruas_per_periode.setdefault(periode, set()).add(ruas_id)
+    
+    for periode, ruas_ids in sorted(ruas_per_periode.items()):
+        if periode in periode_rebuild:
+            AntrianZScore.tandai(periode)
+        else:
+            AntrianZScore.tandai(periode, ruas_ids)
+        print(f"🕒 Z-Score tahun {periode} ditandai untuk dihitung ulang (ruas: {sorted(ruas_ids)})")
+
 
+def _naikkan_versi_setelah_commit(kunci, naikkan_versi=None):
+    """
+    Naikkan versi VersiData `kunci` sekali per transaksi, setelah commit.
+
+    Baris VersiData di-update setiap ada perubahan data, jadi save beruntun
+    dalam satu transaksi (upload, save + auto-assign) cukup menaikkannya
+    sekali. Callback yang sudah terdaftar menjadi penanda dedupe; Django
+    membuangnya sendiri jika transaksi di-rollback. Di luar transaksi
+    callback langsung dijalankan. `naikkan_versi` mengganti fungsi yang
+    dipanggil (default VersiData.naikkan(kunci)).
+    """
+    koneksi = transaction.get_connection()
+    if koneksi.in_atomic_block and any(
+        getattr(callback, 'kunci_versi', None) == kunci for _, callback, *_ in koneksi.run_on_commit
+    ):
+        return
+
+    def naikkan():
+        if naikkan_versi is not None:
+            naikkan_versi()
+        else:
+            VersiData.naikkan(kunci)
+
+    naikkan.kunci_versi = kunci
+    transaction.on_commit(naikkan)
 
+
+@receiver(pre_save, sender=KecelakaanPreprosesing)
+def simpan_kontribusi_lama_kecelakaan_preprosesing(sender, instance, **kwargs):
+    """
+    Simpan kontribusi rekap baris lama (sebelum diubah) agar post_save bisa
+    menghitung selisihnya tanpa menghitung ulang seluruh rekap
+    """
+    instance._kontribusi_lama = None
+    instance._tahun_lama = None
+    if not instance._state.adding and instance.pk:
+        lama = KecelakaanPreprosesing.objects.filter(pk=instance.pk).values_list(
+            'segmen_jalan_id', 'tanggal', 'korban_meninggal', 'korban_luka_berat', 'korban_luka_ringan', 'kerugian_materi'
+        ).first()
+        if lama:
+            instance._kontribusi_lama = _kontribusi_rekap(*lama)
+            instance._tahun_lama = lama[1].year if lama[1] else None
+
+
+@receiver(post_save, sender=KecelakaanPreprosesing)
 @receiver(post_delete, sender=KecelakaanPreprosesing)
-def update_on_kecelakaan_preprosesing_delete(sender, instance, **kwargs):
+def naikkan_versi_kecelakaan(sender, instance, **kwargs):
     """
-    Trigger update RekapSegmen dan AnalisisZScore ketika KecelakaanPreprosesing dihapus
+    Naikkan versi data kecelakaan agar cache dokumen peta tidak dipakai lagi,
+    serta versi titik tahun lama, tahun baru, dan tahun 0 untuk indeks klaster
     """
-    print(f"🗑️ Signal: Kecelakaan Preprosesing dihapus. Auto-updating calculations...")
-    
-    # Dapatkan tahun dari data kecelakaan yang dihapus
-    tahun = instance.tanggal.year
+    _naikkan_versi_setelah_commit(VERSI_KECELAKAAN)
+    tahun_terdampak = {getattr(instance, '_tahun_lama', None), instance.tanggal.year if instance.tanggal else None}
+    for tahun in sorted(tahun_terdampak - {None}) + [0]:
+        _naikkan_versi_setelah_commit(kunci_versi_kecelakaan(tahun))
+
+
+@receiver(post_save, sender=RuasJalan)
+@receiver(post_delete, sender=RuasJalan)
+def naikkan_versi_ruas(sender, instance, **kwargs):
+    """Naikkan versi data ruas (nama ruas ikut tampil di dokumen peta)"""
+    _naikkan_versi_setelah_commit(VERSI_RUAS)
+
+
+@receiver(post_save, sender=KecelakaanPreprosesing)
+def update_on_kecelakaan_preprosesing_create(sender, instance, created, **kwargs):
+    """
+    Update RekapSegmen (tahun kecelakaan dan tahun 0) secara inkremental ketika
+    KecelakaanPreprosesing dibuat atau diupdate (termasuk saat segmen di-assign)
+    """
+    lama = getattr(instance, '_kontribusi_lama', None)
+    baru = _kontribusi_instance(instance)
+    if lama == baru:
+        return
     
-    # Update rekap untuk tahun tersebut
+    print(f"✅ Signal: Kecelakaan Preprosesing {'baru dibuat' if created else 'diupdate'}. Auto-updating calculations...")
     try:
-        RekapSegmen.update_rekap(tahun)
-        print(f"✅ RekapSegmen updated for tahun {tahun}")
+        # Savepoint sendiri: error database di rekap/antrian hanya membatalkan
+        # pekerjaan ini, bukan penyimpanan kecelakaan di transaksi pemanggil
+        with transaction.atomic():
+            _terapkan_perubahan_rekap(lama, baru)
+        instance._kontribusi_lama = baru
     except Exception as e:
         print(f"❌ Error updating RekapSegmen: {str(e)}")
+
+
+@receiver(post_delete, sender=KecelakaanPreprosesing)
+def update_on_kecelakaan_preprosesing_delete(sender, instance, **kwargs):
+    """
+    Kurangi kontribusi KecelakaanPreprosesing yang dihapus dari RekapSegmen
+    dan hitung ulang Z-Score ruas-nya
+    """
+    lama = _kontribusi_instance(instance)
+    if lama is None:
+        return
     
-    # Update Z-Score untuk tahun tersebut
+    print(f"🗑️ Signal: Kecelakaan Preprosesing dihapus. Auto-updating calculations...")
     try:
-        AnalisisZScore.calculate_zscore(tahun)
-        print(f"✅ AnalisisZScore calculated for tahun {tahun}")
+        with transaction.atomic():
+            _terapkan_perubahan_rekap(lama, None)
     except Exception as e:
-        print(f"❌ Error calculating Z-Score: {str(e)}")
+        print(f"❌ Error updating RekapSegmen: {str(e)}")
+
+
+@receiver(post_save, sender=SegmenJalan)
+@receiver(post_delete, sender=SegmenJalan)
+def invalidate_snapshot_segmen(sender, instance, **kwargs):
+    """
+    Naikkan versi tabel segmen ketika SegmenJalan dibuat, diubah, atau dihapus
+    agar snapshot segmen di semua proses dibangun ulang (tidak memakai koordinat basi).
+    Dijalankan setelah commit: snapshot yang dibangun proses lain sebelum
+    commit (tanpa perubahan ini) tidak boleh diberi label versi baru.
+    """
+    _naikkan_versi_setelah_commit(VERSI_SEGMEN, invalidate_segmen_snapshot)
+
+
+@receiver(post_delete, sender=SegmenJalan)
+def hapus_cache_geometri_segmen(sender, instance, **kwargs):
+    """Buang geometry ternormalisasi segmen yang dihapus dari cache proses ini"""
+    hapus_geometri('segmen', instance.id)
+
+
+@receiver(post_delete, sender=RuasJalan)
+def hapus_cache_geometri_ruas(sender, instance, **kwargs):
+    """Buang geometry ternormalisasi ruas yang dihapus dari cache proses ini"""
+    hapus_geometri('ruas', instance.id)
 
 
 @receiver(post_save, sender=SegmenJalan)
@@ -66,47 +197,79 @@ def auto_assign_kecelakaan_ke_segmen_baru(sender, instance, created, **kwargs):
     
     Flow:
     1. Ketika segmen jalan baru dibuat
-    2. Cari semua data preprocessing yang belum punya segmen (segmen_jalan is NULL)
-    3. Untuk setiap data, coba assign ke segmen baru jika koordinatnya cocok
+    2. Cari data preprocessing tanpa segmen yang berada di dalam bounding box segmen baru (+buffer)
+    3. Cocokkan data tersebut HANYA ke segmen baru (segmen lain sudah dicek saat data disimpan)
+    4. Simpan semua hasil assign sekaligus dengan bulk_update
     """
     if created:
         print(f"\n{'='*70}")
         print(f"🚨 Signal: Segmen Jalan BARU dibuat: {instance.nama_segmen or f'Segmen {instance.km_awal}-{instance.km_akhir}'}")
         print(f"{'='*70}")
         
-        # Cari semua data preprocessing yang belum punya segmen
-        kecelakaan_tanpa_segmen = KecelakaanPreprosesing.objects.filter(segmen_jalan__isnull=True)
-        print(f"📊 Ditemukan {kecelakaan_tanpa_segmen.count()} data preprocessing tanpa segmen")
+        vertices = vertex_segmen(
+            instance.lat_awal, instance.lon_awal,
+            instance.lat_akhir, instance.lon_akhir,
+            instance.geometry
+        )
+        if not vertices:
+            print(f"⚠ Segmen tidak punya geometry / koordinat lengkap, auto-assign dilewati")
+            print(f"{'='*70}\n")
+            return
+        
+        matcher = SegmenPolylineMatcher([(instance.id, vertices)])
+        min_lat, max_lat, min_lon, max_lon = matcher.index.bboxes[0]
+        
+        # Cari data preprocessing tanpa segmen di sekitar segmen baru saja
+        kandidat = list(
+            KecelakaanPreprosesing.objects.filter(
+                segmen_jalan__isnull=True,
+                latitude__gte=min_lat, latitude__lte=max_lat,
+                longitude__gte=min_lon, longitude__lte=max_lon,
+            ).values_list('id', 'latitude', 'longitude', 'tanggal')
+        )
+        print(f"📊 Ditemukan {len(kandidat)} data preprocessing tanpa segmen di sekitar segmen ini")
         
-        if kecelakaan_tanpa_segmen.exists():
-            assigned_count = 0
+        if kandidat:
+            now = timezone.now()
+            matched = []
             tahun_list = set()  # Track tahun yang ada assignment
             
-            for kecelakaan in kecelakaan_tanpa_segmen:
-                try:
-                    # Coba find closest segment
-                    kecelakaan.find_closest_segment()
-                    
-                    # Jika berhasil di-assign (segmen_jalan tidak null setelah find_closest_segment)
-                    if kecelakaan.segmen_jalan:
-                        kecelakaan.save(update_fields=['segmen_jalan', 'updated_at'])
-                        assigned_count += 1
-                        tahun_list.add(kecelakaan.tanggal.year)
-                        print(f"   ✅ Kecelakaan ({kecelakaan.tanggal} - {kecelakaan.kecamatan}) → {kecelakaan.segmen_jalan.nama_segmen}")
-                        
-                except Exception as e:
-                    print(f"   ❌ Error assigning kecelakaan {kecelakaan.id}: {str(e)}")
+            for kecelakaan_id, latitude, longitude, tanggal in kandidat:
+                match = matcher.match(float(latitude), float(longitude), TOLERANCE_KM)
+                if match:
+                    matched.append(KecelakaanPreprosesing(
+                        id=kecelakaan_id,
+                        segmen_jalan=instance,
+                        jarak_segmen_km=match[1],
+                        posisi_km=float(instance.km_awal) + match[2],
+                        versi_matcher=VERSI_MATCHER,
+                        # Hanya dicocokkan dengan segmen baru ini, bukan seluruh
+                        # snapshot: biarkan reassign --skip-valid memeriksanya lagi
+                        versi_segmen=None,
+                        updated_at=now,
+                    ))
+                    tahun_list.add(tanggal.year)
+                    print(f"   ✅ Kecelakaan #{kecelakaan_id} ({tanggal}) → {instance.nama_segmen} (jarak perp: {match[1]*1000:.1f}m)")
+            
+            if matched:
+                KecelakaanPreprosesing.objects.bulk_update(
+                    matched, ['segmen_jalan', 'jarak_segmen_km', 'posisi_km', 'versi_matcher', 'versi_segmen', 'updated_at']
+                )
+                # bulk_update tidak memicu signal: naikkan versi kecelakaan sendiri
+                # agar dokumen peta yang memuat jumlah kecelakaan per segmen tidak dipakai lagi
+                _naikkan_versi_setelah_commit(VERSI_KECELAKAAN)
             
-            print(f"\n📈 Total data yang di-assign: {assigned_count}/{kecelakaan_tanpa_segmen.count()}")
+            print(f"\n📈 Total data yang di-assign: {len(matched)}/{len(kandidat)}")
             
-            # Update rekap dan Z-Score untuk tahun-tahun yang ada assignment
-            if assigned_count > 0 and tahun_list:
+            # Tandai rekap dan Z-Score tahun-tahun yang ada assignment untuk
+            # dibangun ulang penuh (segmen baru belum punya baris rekap)
+            if matched and tahun_list:
                 try:
-                    print(f"\n🔄 Updating calculations untuk tahun: {sorted(tahun_list)}")
-                    for tahun in tahun_list:
-                        RekapSegmen.update_rekap(tahun)
-                        AnalisisZScore.calculate_zscore(tahun)
-                    print(f"✅ RekapSegmen dan AnalisisZScore berhasil di-update")
+                    print(f"\n🕒 Menandai perhitungan ulang untuk tahun: {sorted(tahun_list)}")
+                    with transaction.atomic():
+                        for tahun in sorted(tahun_list | {0}):
+                            AntrianZScore.tandai(tahun)
+                    print(f"✅ RekapSegmen dan AnalisisZScore masuk antrian")
                 except Exception as e:
                     print(f"❌ Error updating calculations: {str(e)}")
         else:
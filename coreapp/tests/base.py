@@ -0,0 +1,231 @@
+"""
+Fixture dan helper bersama untuk test coreapp.
+
+Data uji berupa ruas lurus arah timur di sekitar Madiun; setiap ruas dibagi
+segmen 1 km (LineString tiga titik) dan kecelakaan diletakkan di atas garis
+segmen sehingga matcher selalu menemukan segmennya.
+"""
+import datetime
+import json
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.db import connection
+
+from ..models import RuasJalan, SegmenJalan, KecelakaanPreprosesing, RekapSegmen, AnalisisZScore, AntrianZScore
+from .. import utils_geometri, utils_klaster
+
+
+TAHUN = 2024
+
+CACHES_TEST = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-default'},
+    'peta': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-peta'},
+    'tiles': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-tiles'},
+}
+
+LON_AWAL = 111.5
+LAT_AWAL = -7.5
+DERAJAT_PER_SEGMEN = 0.01
+
+
+class DataUjiMixin:
+    """Pembuat ruas, segmen, dan kecelakaan uji untuk TestCase"""
+
+    jumlah_ruas = 0
+
+    @contextmanager
+    def setelah_commit(self):
+        """
+        Jalankan callback on_commit yang didaftarkan di dalam blok seolah
+        transaksi di-commit. Berbeda dengan captureOnCommitCallbacks, callback
+        dikeluarkan dari antrian koneksi sehingga tidak menjadi penanda dedupe
+        _naikkan_versi_setelah_commit untuk save berikutnya di test yang sama.
+        """
+        awal = len(connection.run_on_commit)
+        yield
+        while len(connection.run_on_commit) > awal:
+            _, callback, *_ = connection.run_on_commit.pop(awal)
+            callback()
+
+    def buat_ruas(self, jumlah_segmen=3):
+        """Ruas lurus baru (lintang berbeda per ruas) beserta segmennya"""
+        lat = LAT_AWAL - DERAJAT_PER_SEGMEN * self.jumlah_ruas
+        ruas = RuasJalan.objects.create(
+            nama_ruas=f'Ruas {self.jumlah_ruas}', jenis_jalan='arteri', wilayah='Madiun',
+            panjang_km=jumlah_segmen,
+        )
+        self.jumlah_ruas += 1
+        segmen_list = []
+        # Versi segmen dinaikkan signal setelah commit; jalankan callback-nya
+        # agar snapshot segmen (matcher) ikut dibangun ulang seperti di produksi
+        with self.setelah_commit():
+            for i in range(jumlah_segmen):
+                lon_awal = LON_AWAL + DERAJAT_PER_SEGMEN * i
+                lon_akhir = lon_awal + DERAJAT_PER_SEGMEN
+                segmen_list.append(SegmenJalan.objects.create(
+                    ruas_jalan=ruas, km_awal=i, km_akhir=i + 1, panjang_segmen=1,
+                    lat_awal=lat, lon_awal=lon_awal, lat_akhir=lat, lon_akhir=lon_akhir,
+                    nama_segmen=f'S{i}',
+                    geometry=json.dumps({
+                        'type': 'LineString',
+                        'coordinates': [[lon_awal, lat], [(lon_awal + lon_akhir) / 2, lat], [lon_akhir, lat]],
+                    }),
+                ))
+        return ruas, segmen_list
+
+    def data_kecelakaan(self, segmen, ke=0, tahun=TAHUN, **kwargs):
+        """Field KecelakaanPreprosesing di atas garis segmen (posisi ke-`ke` dari titik awal)"""
+        data = {
+            'tanggal': datetime.date(tahun, 1 + ke % 12, 1), 'waktu': datetime.time(8, 0),
+            'latitude': float(segmen.lat_awal),
+            'longitude': float(segmen.lon_awal) + 0.002 * (ke % 4 + 1),
+            'korban_meninggal': ke % 2, 'korban_luka_ringan': 1,
+            'desa': 'Desa', 'kecamatan': 'Kecamatan', 'kabupaten_kota': 'Madiun',
+        }
+        data.update(kwargs)
+        return data
+
+    def buat_kecelakaan(self, segmen, ke=0, tahun=TAHUN, **kwargs):
+        """Simpan satu kecelakaan lewat save() (signal dan auto-assign berjalan)"""
+        return KecelakaanPreprosesing.objects.create(**self.data_kecelakaan(segmen, ke, tahun, **kwargs))
+
+    def tambah_data(self, jumlah_ruas, segmen_per_ruas, kecelakaan_per_segmen, tahun=TAHUN):
+        """
+        Tambah ruas, segmen, dan kecelakaan sekaligus (bulk_create, tanpa
+        signal), lalu bangun rekap dan Z-Score tahun tersebut langsung
+        """
+        kecelakaan = []
+        for _ in range(jumlah_ruas):
+            _, segmen_list = self.buat_ruas(segmen_per_ruas)
+            for segmen in segmen_list:
+                kecelakaan += [
+                    KecelakaanPreprosesing(segmen_jalan=segmen, **self.data_kecelakaan(segmen, k, tahun))
+                    for k in range(kecelakaan_per_segmen)
+                ]
+        KecelakaanPreprosesing.objects.bulk_create(kecelakaan)
+
+        RekapSegmen.update_rekap(tahun)
+        AnalisisZScore.calculate_zscore(tahun)
+        AntrianZScore.objects.all().delete()
+
+    def kosongkan_cache(self):
+        """Kosongkan cache dokumen peta/tile dan cache per proses (geometry, indeks klaster)"""
+        for alias in ('peta', 'tiles'):
+            caches[alias].clear()
+        for cache in utils_geometri._cache_geometri.values():
+            cache.clear()
+        utils_klaster._indeks_klaster.clear()
+
+
+def _baca_varint(data, i):
+    nilai = geser = 0
+    while True:
+        byte = data[i]
+        i += 1
+        nilai |= (byte & 0x7F) << geser
+        geser += 7
+        if not byte & 0x80:
+            return nilai, i
+
+
+def _baca_field(data):
+    """Iterasi (nomor_field, nilai) pesan protobuf; nilai bytes untuk wire type 2"""
+    import struct
+
+    i = 0
+    while i < len(data):
+        kunci, i = _baca_varint(data, i)
+        nomor, tipe = kunci >> 3, kunci & 7
+        if tipe == 0:
+            nilai, i = _baca_varint(data, i)
+        elif tipe == 1:
+            nilai, i = struct.unpack('<d', data[i:i + 8])[0], i + 8
+        elif tipe == 2:
+            panjang, i = _baca_varint(data, i)
+            nilai, i = data[i:i + panjang], i + panjang
+        elif tipe == 5:
+            nilai, i = struct.unpack('<f', data[i:i + 4])[0], i + 4
+        else:
+            raise ValueError(f"Wire type {tipe} tidak dikenal")
+        yield nomor, nilai
+
+
+def _baca_packed(data):
+    i, hasil = 0, []
+    while i < len(data):
+        nilai, i = _baca_varint(data, i)
+        hasil.append(nilai)
+    return hasil
+
+
+def _unzigzag(nilai):
+    return (nilai >> 1) ^ -(nilai & 1)
+
+
+def _baca_geometry(perintah):
+    """Titik tile absolut [(x, y), ...] dari perintah geometry MoveTo/LineTo"""
+    titik, cx, cy, i = [], 0, 0, 0
+    while i < len(perintah):
+        cmd, jumlah = perintah[i] & 7, perintah[i] >> 3
+        i += 1
+        for _ in range(jumlah if cmd in (1, 2) else 0):
+            cx += _unzigzag(perintah[i])
+            cy += _unzigzag(perintah[i + 1])
+            titik.append((cx, cy))
+            i += 2
+    return titik
+
+
+def _baca_value(data):
+    for nomor, nilai in _baca_field(data):
+        if nomor == 1:
+            return nilai.decode('utf-8')
+        if nomor == 6:
+            return _unzigzag(nilai)
+        if nomor == 7:
+            return bool(nilai)
+        return nilai
+
+
+def baca_tile(data):
+    """
+    Decode tile MVT menjadi dict nama_layer -> {'extent', 'version', 'features'}
+    dengan feature berupa dict id, type, titik (koordinat tile), properties
+    """
+    layers = {}
+    for nomor, isi_layer in _baca_field(data):
+        if nomor != 3:
+            continue
+        layer = {'features': [], 'keys': [], 'values': [], 'extent': 4096, 'version': 1}
+        features_mentah = []
+        for n, nilai in _baca_field(isi_layer):
+            if n == 1:
+                layer['name'] = nilai.decode('utf-8')
+            elif n == 2:
+                features_mentah.append(nilai)
+            elif n == 3:
+                layer['keys'].append(nilai.decode('utf-8'))
+            elif n == 4:
+                layer['values'].append(_baca_value(nilai))
+            elif n == 5:
+                layer['extent'] = nilai
+            elif n == 15:
+                layer['version'] = nilai
+        for isi in features_mentah:
+            feature = {'id': None, 'type': None, 'titik': [], 'properties': {}}
+            for n, nilai in _baca_field(isi):
+                if n == 1:
+                    feature['id'] = nilai
+                elif n == 2:
+                    tags = _baca_packed(nilai)
+                    feature['properties'] = {
+                        layer['keys'][k]: layer['values'][v] for k, v in zip(tags[::2], tags[1::2])
+                    }
+                elif n == 3:
+                    feature['type'] = nilai
+                elif n == 4:
+                    feature['titik'] = _baca_geometry(_baca_packed(nilai))
+            layer['features'].append(feature)
+        layers[layer['name']] = layer
+    return layers
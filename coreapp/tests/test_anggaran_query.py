@@ -0,0 +1,134 @@
+"""
+Test anggaran query endpoint peta dan analisis.
+
+Setiap endpoint yang sudah dioptimasi dicek dua hal:
+1. Jumlah query tidak bertambah ketika jumlah ruas, segmen, dan kecelakaan
+   bertambah (tidak ada query per baris / N+1).
+2. Jumlah query tetap di bawah anggaran tetap, baik saat dokumen dibangun
+   (cache kosong) maupun saat dijawab 304 dari ETag.
+Isi respons ikut dicek (jumlah segmen, jumlah kecelakaan, isi tile MVT)
+agar anggaran query tidak dicapai dengan membuang data.
+
+Cache 'peta' dan 'tiles' diganti LocMemCache agar test tidak menulis ke
+direktori cache aplikasi.
+"""
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import User, SegmenJalan, KecelakaanPreprosesing
+from ..utils_mvt import GEOM_LINESTRING, GEOM_POINT
+from .base import CACHES_TEST, TAHUN, DataUjiMixin, baca_tile
+
+
+# Anggaran query per request saat cache kosong. Sudah termasuk 5 query sesi
+# (baca sesi, user, simpan sesi karena SESSION_SAVE_EVERY_REQUEST) dan
+# pengecekan ulang penanda versi setelah dokumen dibangun.
+ANGGARAN_QUERY = {
+    'segmen_geojson': 13,
+    'segmen_geojson_bbox': 13,
+    'threshold_data': 14,
+    'analisis_statistik': 11,
+    'analisis_view': 8,
+    'kecelakaan_stream': 7,
+    'kecelakaan_cluster': 11,
+    'tile_segmen': 12,
+    'tile_kecelakaan': 10,
+}
+
+# Anggaran query untuk jawaban 304: sesi dan penanda versi saja
+ANGGARAN_QUERY_304 = 8
+
+
+@override_settings(CACHES=CACHES_TEST)
+class AnggaranQueryTest(DataUjiMixin, TestCase):
+    """Jumlah query endpoint peta/analisis tidak bergantung pada jumlah data"""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin@test.id', 'Admin', 'rahasia123')
+        self.client.force_login(self.user)
+        self.tambah_data(jumlah_ruas=2, segmen_per_ruas=3, kecelakaan_per_segmen=2)
+
+    def hitung_query(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            respons = self.client.get(url, **headers)
+            if respons.streaming:
+                b''.join(respons.streaming_content)
+        return respons, len(queries)
+
+    def cek_anggaran(self, nama, url):
+        """Jumlah query cache kosong sama untuk data kecil dan besar, di bawah anggaran, dan 304 murah"""
+        self.kosongkan_cache()
+        respons, query_kecil = self.hitung_query(url)
+        self.assertEqual(respons.status_code, 200)
+
+        self.tambah_data(jumlah_ruas=3, segmen_per_ruas=5, kecelakaan_per_segmen=4)
+        self.kosongkan_cache()
+        respons, query_besar = self.hitung_query(url)
+        self.assertEqual(respons.status_code, 200)
+
+        self.assertEqual(query_kecil, query_besar, f'{nama}: jumlah query bertambah mengikuti jumlah data')
+        self.assertLessEqual(query_besar, ANGGARAN_QUERY[nama], f'{nama}: melebihi anggaran query')
+
+        if respons.has_header('ETag'):
+            respons_304, query_304 = self.hitung_query(url, HTTP_IF_NONE_MATCH=respons['ETag'])
+            self.assertEqual(respons_304.status_code, 304)
+            self.assertLessEqual(query_304, ANGGARAN_QUERY_304, f'{nama}: 304 melebihi anggaran query')
+        return respons
+
+    def test_segmen_geojson(self):
+        respons = self.cek_anggaran('segmen_geojson', f"{reverse('api_segmen_geojson')}?tahun={TAHUN}")
+        lines = [f for f in respons.json()['features'] if f['geometry']['type'] == 'LineString']
+        self.assertEqual(len(lines), SegmenJalan.objects.count())
+
+    def test_segmen_geojson_bbox_compact(self):
+        url = f"{reverse('api_segmen_geojson')}?tahun={TAHUN}&bbox=111.49,-7.56,111.56,-7.49&zoom=13&compact=1"
+        self.cek_anggaran('segmen_geojson_bbox', url)
+
+    def test_segmen_geojson_cache_hangat(self):
+        """Dokumen yang sudah ada di cache dijawab tanpa query data segmen"""
+        url = f"{reverse('api_segmen_geojson')}?tahun={TAHUN}"
+        self.kosongkan_cache()
+        self.client.get(url)
+        with self.assertNumQueries(ANGGARAN_QUERY_304):
+            respons = self.client.get(url)
+        self.assertEqual(respons.status_code, 200)
+
+    def test_threshold_data(self):
+        self.cek_anggaran('threshold_data', f"{reverse('api_threshold_data')}?tahun={TAHUN}")
+
+    def test_analisis_statistik(self):
+        respons = self.cek_anggaran('analisis_statistik', f"{reverse('api_analisis_statistik')}?tahun={TAHUN}")
+        self.assertEqual(respons.json()['total_segmen'], SegmenJalan.objects.count())
+
+    def test_analisis_view(self):
+        self.cek_anggaran('analisis_view', f"{reverse('analisis')}?tahun={TAHUN}")
+
+    def test_kecelakaan_stream(self):
+        respons = self.cek_anggaran('kecelakaan_stream', f"{reverse('api_kecelakaan_geojson_stream')}?tahun={TAHUN}")
+        self.assertTrue(respons.streaming)
+
+    def test_kecelakaan_cluster(self):
+        respons = self.cek_anggaran('kecelakaan_cluster', f"{reverse('api_kecelakaan_cluster')}?tahun={TAHUN}&zoom=12")
+        total = sum(f['properties']['point_count'] for f in respons.json()['features'])
+        self.assertEqual(total, KecelakaanPreprosesing.objects.count())
+
+    def test_tile_segmen(self):
+        url = f"{reverse('api_tiles', args=['segmen', 10, 829, 533])}?tahun={TAHUN}"
+        layer = baca_tile(self.cek_anggaran('tile_segmen', url).content)['segmen']
+        self.assertEqual(len(layer['features']), SegmenJalan.objects.count())
+        self.assertTrue(all(f['type'] == GEOM_LINESTRING for f in layer['features']))
+        self.assertEqual(
+            sum(f['properties']['accident_count'] for f in layer['features']),
+            KecelakaanPreprosesing.objects.filter(tanggal__year=TAHUN).count(),
+        )
+
+    def test_tile_kecelakaan(self):
+        url = f"{reverse('api_tiles', args=['kecelakaan', 10, 829, 533])}?tahun={TAHUN}"
+        layer = baca_tile(self.cek_anggaran('tile_kecelakaan', url).content)['kecelakaan']
+        self.assertEqual(
+            {f['id'] for f in layer['features']},
+            set(KecelakaanPreprosesing.objects.values_list('id', flat=True)),
+        )
+        self.assertTrue(all(f['type'] == GEOM_POINT for f in layer['features']))
@@ -0,0 +1,120 @@
+"""
+Test antrian perhitungan ulang Z-Score (AntrianZScore.proses).
+"""
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from ..models import KecelakaanPreprosesing, AnalisisZScore, AntrianZScore, RuasJalan
+from .base import TAHUN, DataUjiMixin
+
+
+class AntrianDebounceTest(DataUjiMixin, TestCase):
+
+    def setUp(self):
+        self.tambah_data(jumlah_ruas=3, segmen_per_ruas=3, kecelakaan_per_segmen=2)
+        self.ruas = list(RuasJalan.objects.order_by('id').values_list('id', flat=True))
+
+    def mundurkan(self, detik, **filter_antrian):
+        """Geser waktu tandai dan buat entri antrian `detik` ke belakang"""
+        waktu = timezone.now() - timedelta(seconds=detik)
+        AntrianZScore.objects.filter(**filter_antrian).update(ditandai_at=waktu, dibuat_at=waktu)
+
+    def snapshot(self):
+        return dict(AnalisisZScore.objects.aktif().filter(tahun=TAHUN).values_list('segmen_jalan_id', 'versi'))
+
+    def test_tandai_ulang_tidak_menduplikasi_entri(self):
+        AntrianZScore.tandai(TAHUN, [self.ruas[0]])
+        self.mundurkan(30)
+        AntrianZScore.tandai(TAHUN, [self.ruas[0]])
+        AntrianZScore.tandai(TAHUN)
+        AntrianZScore.tandai(TAHUN)
+
+        entri = AntrianZScore.objects.get(tahun=TAHUN, kunci_ruas=self.ruas[0])
+        self.assertEqual(AntrianZScore.objects.count(), 2)
+        self.assertGreater(entri.ditandai_at, entri.dibuat_at)
+        self.assertEqual(AntrianZScore.status_data(TAHUN), 'pending')
+        self.assertEqual(AntrianZScore.status_data(TAHUN - 1), 'fresh')
+
+    def test_entri_baru_ditandai_menunggu_debounce(self):
+        AntrianZScore.tandai(TAHUN, [self.ruas[0]])
+        self.assertEqual(AntrianZScore.proses(debounce_detik=10), {})
+        self.assertTrue(AntrianZScore.objects.exists())
+
+        self.mundurkan(11)
+        self.assertEqual(AntrianZScore.proses(debounce_detik=10), {TAHUN: [self.ruas[0]]})
+        self.assertFalse(AntrianZScore.objects.exists())
+
+    def test_entri_yang_terus_ditandai_diproses_setelah_maks_tunggu(self):
+        AntrianZScore.tandai(TAHUN, [self.ruas[0]])
+        AntrianZScore.objects.update(dibuat_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(AntrianZScore.proses(debounce_detik=10, maks_tunggu_detik=60), {TAHUN: [self.ruas[0]]})
+
+    def test_ruas_satu_tahun_digabung_dan_ruas_lain_disalin(self):
+        lama = self.snapshot()
+        AntrianZScore.tandai(TAHUN, self.ruas[:2])
+        with mock.patch.object(AnalisisZScore, 'hitung_ulang_zscore', wraps=AnalisisZScore.hitung_ulang_zscore) as hitung:
+            self.assertEqual(AntrianZScore.proses(debounce_detik=0), {TAHUN: self.ruas[:2]})
+        hitung.assert_called_once_with(TAHUN, ruas_ids=set(self.ruas[:2]))
+
+        baru = self.snapshot()
+        self.assertEqual(set(baru), set(lama))
+        self.assertEqual(len(set(baru.values())), 1, 'semua segmen ada di satu snapshot versi baru')
+        self.assertGreater(next(iter(baru.values())), next(iter(lama.values())))
+
+    def test_entri_semua_ruas_menghitung_tahun_penuh(self):
+        AntrianZScore.tandai(TAHUN, [self.ruas[0]])
+        AntrianZScore.tandai(TAHUN)
+        with mock.patch.object(AnalisisZScore, 'calculate_zscore', return_value=True) as hitung:
+            self.assertEqual(AntrianZScore.proses(debounce_detik=0), {TAHUN: [None]})
+        hitung.assert_called_once_with(TAHUN)
+        self.assertFalse(AntrianZScore.objects.exists())
+
+    def test_entri_ditandai_ulang_selama_perhitungan_tetap_antri(self):
+        hitung_asli = AnalisisZScore.hitung_ulang_zscore
+
+        def hitung_sambil_ditandai(tahun, ruas_ids=None):
+            hitung_asli(tahun, ruas_ids=ruas_ids)
+            AntrianZScore.tandai(tahun, [self.ruas[0]])
+
+        AntrianZScore.tandai(TAHUN, [self.ruas[0]])
+        self.mundurkan(1)
+        with mock.patch.object(AnalisisZScore, 'hitung_ulang_zscore', side_effect=hitung_sambil_ditandai):
+            AntrianZScore.proses(debounce_detik=0)
+        self.assertTrue(AntrianZScore.objects.filter(tahun=TAHUN, kunci_ruas=self.ruas[0]).exists())
+
+
+class SidikAntrianTest(DataUjiMixin, TestCase):
+    """Perhitungan parsial worker ikut memperbarui sidik tahun yang diprosesnya"""
+
+    def setUp(self):
+        self.tambah_data(jumlah_ruas=2, segmen_per_ruas=3, kecelakaan_per_segmen=2)
+        self.assertTrue(AnalisisZScore.calculate_zscore_all_years())
+        AntrianZScore.objects.all().delete()
+        self.segmen = KecelakaanPreprosesing.objects.select_related('segmen_jalan').first().segmen_jalan
+
+    def test_proses_parsial_tidak_memicu_hitung_penuh_tahun_nol(self):
+        self.buat_kecelakaan(self.segmen)
+
+        hasil = AntrianZScore.proses(debounce_detik=0)
+        self.assertEqual(hasil, {0: [self.segmen.ruas_jalan_id], TAHUN: [self.segmen.ruas_jalan_id]})
+        self.assertFalse(AntrianZScore.objects.exists())
+        self.assertFalse(AnalisisZScore.calculate_zscore_all_years())
+
+    def test_perubahan_segmen_tetap_memicu_hitung_penuh(self):
+        self.buat_kecelakaan(self.segmen)
+        self.segmen.save()
+
+        AntrianZScore.proses(debounce_detik=0)
+        self.assertTrue(AnalisisZScore.calculate_zscore_all_years())
+
+    def test_perubahan_di_luar_antrian_memicu_hitung_penuh(self):
+        self.buat_kecelakaan(self.segmen)
+        AntrianZScore.proses(debounce_detik=0)
+
+        KecelakaanPreprosesing.objects.bulk_create([
+            KecelakaanPreprosesing(segmen_jalan=self.segmen, **self.data_kecelakaan(self.segmen))
+        ])
+        self.assertTrue(AnalisisZScore.calculate_zscore_all_years())
@@ -0,0 +1,68 @@
+"""
+Test auto-assign kecelakaan tanpa segmen ketika SegmenJalan baru dibuat
+(signal post_save SegmenJalan).
+"""
+import json
+
+from django.test import TestCase
+
+from ..models import SegmenJalan, KecelakaanPreprosesing, AntrianZScore, VersiData
+from ..utils_peta import VERSI_KECELAKAAN
+from ..utils_segmen import VERSI_SEGMEN, VERSI_MATCHER
+from .base import TAHUN, DataUjiMixin
+
+
+class AutoAssignSegmenBaruTest(DataUjiMixin, TestCase):
+
+    def setUp(self):
+        self.ruas, self.segmen = self.buat_ruas(2)
+        # Kecelakaan di perpanjangan ruas (km 2-3) yang segmennya belum ada
+        with self.setelah_commit():
+            self.segmen_dekat = [
+                self.buat_kecelakaan(self.segmen[1], longitude=float(self.segmen[1].lon_akhir) + 0.003 * (k + 1))
+                for k in range(2)
+            ]
+            self.jauh = self.buat_kecelakaan(
+                self.segmen[1], latitude=-7.6, longitude=float(self.segmen[1].lon_akhir) + 0.003
+            )
+        AntrianZScore.objects.all().delete()
+
+    def buat_segmen_baru(self):
+        lat = float(self.segmen[1].lat_akhir)
+        lon_awal = float(self.segmen[1].lon_akhir)
+        return SegmenJalan.objects.create(
+            ruas_jalan=self.ruas, km_awal=2, km_akhir=3, panjang_segmen=1,
+            lat_awal=lat, lon_awal=lon_awal, lat_akhir=lat, lon_akhir=lon_awal + 0.01,
+            nama_segmen='S2',
+            geometry=json.dumps({'type': 'LineString', 'coordinates': [[lon_awal, lat], [lon_awal + 0.01, lat]]}),
+        )
+
+    def test_assign_kecelakaan_di_sekitar_segmen_baru(self):
+        for kecelakaan in self.segmen_dekat + [self.jauh]:
+            self.assertIsNone(kecelakaan.segmen_jalan_id)
+
+        segmen_baru = self.buat_segmen_baru()
+
+        assigned = KecelakaanPreprosesing.objects.filter(segmen_jalan=segmen_baru)
+        self.assertEqual(set(assigned.values_list('id', flat=True)), {k.id for k in self.segmen_dekat})
+        self.assertTrue(all(k.versi_matcher == VERSI_MATCHER and k.jarak_segmen_km < 0.001 for k in assigned))
+        self.assertIsNone(KecelakaanPreprosesing.objects.get(pk=self.jauh.pk).segmen_jalan_id)
+        self.assertEqual(
+            set(AntrianZScore.objects.values_list('tahun', 'kunci_ruas')), {(TAHUN, 0), (0, 0)}
+        )
+
+    def test_versi_segmen_dan_kecelakaan_naik_setelah_commit(self):
+        versi_awal = {kunci: VersiData.get_versi(kunci) for kunci in (VERSI_SEGMEN, VERSI_KECELAKAAN)}
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.buat_segmen_baru()
+            # Sebelum commit belum ada versi yang naik: pembaca lain belum melihat assignment
+            self.assertEqual({kunci: VersiData.get_versi(kunci) for kunci in versi_awal}, versi_awal)
+        self.assertEqual(sorted(c.kunci_versi for c in callbacks), sorted([VERSI_KECELAKAAN, VERSI_SEGMEN]))
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            {kunci: VersiData.get_versi(kunci) for kunci in versi_awal},
+            {kunci: versi + 1 for kunci, versi in versi_awal.items()},
+        )
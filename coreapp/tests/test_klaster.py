@@ -0,0 +1,93 @@
+"""
+Test indeks klaster titik kecelakaan (utils_klaster): isi klaster per zoom
+dan pembangunan ulang indeks per tahun.
+"""
+from django.db.models import Sum
+from django.test import TestCase
+
+from ..models import KecelakaanPreprosesing
+from ..utils_klaster import get_indeks_klaster, MAKS_ZOOM_KLASTER
+from .base import TAHUN, DataUjiMixin
+
+
+class IndeksKlasterTest(DataUjiMixin, TestCase):
+
+    def setUp(self):
+        self.tambah_data(jumlah_ruas=2, segmen_per_ruas=3, kecelakaan_per_segmen=3, tahun=TAHUN)
+        self.tambah_data(jumlah_ruas=1, segmen_per_ruas=2, kecelakaan_per_segmen=2, tahun=TAHUN - 1)
+        self.kosongkan_cache()
+
+    def korban_db(self, tahun):
+        return KecelakaanPreprosesing.objects.filter(tanggal__year=tahun).aggregate(
+            meninggal=Sum('korban_meninggal'), luka_berat=Sum('korban_luka_berat'), luka_ringan=Sum('korban_luka_ringan'),
+        )
+
+    def test_jumlah_titik_dan_korban_sama_di_setiap_zoom(self):
+        indeks = get_indeks_klaster(TAHUN)
+        jumlah = KecelakaanPreprosesing.objects.filter(tanggal__year=TAHUN).count()
+        korban = self.korban_db(TAHUN)
+        for zoom in (0, 8, 12, MAKS_ZOOM_KLASTER):
+            features = indeks.cari(None, zoom)
+            self.assertEqual(sum(f['properties']['point_count'] for f in features), jumlah, zoom)
+            self.assertEqual(
+                {k: sum(f['properties'][f'korban_{k}'] for f in features) for k in korban}, korban, zoom
+            )
+        # Zoom rendah: semua titik satu ruas berdekatan, jadi pasti tergabung
+        self.assertLess(len(indeks.cari(None, 8)), jumlah)
+
+    def test_zoom_di_atas_maksimal_mengirim_titik_individu(self):
+        features = get_indeks_klaster(TAHUN).cari(None, MAKS_ZOOM_KLASTER + 1)
+        self.assertTrue(all(not f['properties']['cluster'] for f in features))
+        self.assertEqual(
+            sorted(f['properties']['kecelakaan_id'] for f in features),
+            sorted(KecelakaanPreprosesing.objects.filter(tanggal__year=TAHUN).values_list('id', flat=True)),
+        )
+
+    def test_bbox_membatasi_klaster(self):
+        zoom = MAKS_ZOOM_KLASTER + 1
+        kecelakaan = KecelakaanPreprosesing.objects.first()
+        lon, lat = float(kecelakaan.longitude), float(kecelakaan.latitude)
+        bbox = (lon - 0.0005, lat - 0.0005, lon + 0.0005, lat + 0.0005)
+        harapan = KecelakaanPreprosesing.objects.filter(
+            longitude__gte=bbox[0], latitude__gte=bbox[1], longitude__lte=bbox[2], latitude__lte=bbox[3],
+        ).values_list('id', flat=True)
+
+        features = get_indeks_klaster(0).cari(bbox, zoom)
+        self.assertEqual(sorted(f['id'] for f in features), sorted(harapan))
+        self.assertLess(len(features), len(get_indeks_klaster(0).cari(None, zoom)))
+
+    def test_perubahan_tahun_lain_tidak_membangun_ulang_indeks(self):
+        indeks = get_indeks_klaster(TAHUN)
+        segmen = KecelakaanPreprosesing.objects.filter(tanggal__year=TAHUN - 1).first().segmen_jalan
+        with self.setelah_commit():
+            self.buat_kecelakaan(segmen, tahun=TAHUN - 1)
+
+        # Cukup satu query versi, tanpa agregat atas data kecelakaan tahun ini
+        with self.assertNumQueries(1):
+            self.assertIs(get_indeks_klaster(TAHUN), indeks)
+        self.assertEqual(
+            sum(f['properties']['point_count'] for f in get_indeks_klaster(0).cari(None, 0)),
+            KecelakaanPreprosesing.objects.count(),
+        )
+
+    def test_reassign_segmen_massal_tidak_membangun_ulang_indeks(self):
+        indeks = get_indeks_klaster(TAHUN)
+        kecelakaan = list(KecelakaanPreprosesing.objects.filter(tanggal__year=TAHUN))
+        for k in kecelakaan:
+            k.segmen_jalan_id = None
+        KecelakaanPreprosesing.objects.bulk_update(kecelakaan, ['segmen_jalan'])
+        self.assertIs(get_indeks_klaster(TAHUN), indeks)
+
+    def test_simpan_kecelakaan_membangun_ulang_indeks_tahun_lama_dan_baru(self):
+        lama, baru = get_indeks_klaster(TAHUN), get_indeks_klaster(TAHUN - 1)
+        kecelakaan = KecelakaanPreprosesing.objects.filter(tanggal__year=TAHUN).first()
+        with self.setelah_commit():
+            kecelakaan.tanggal = kecelakaan.tanggal.replace(year=TAHUN - 1)
+            kecelakaan.korban_luka_berat = 5
+            kecelakaan.save()
+
+        self.assertIsNot(get_indeks_klaster(TAHUN), lama)
+        self.assertIsNot(get_indeks_klaster(TAHUN - 1), baru)
+        self.assertNotIn(kecelakaan.id, get_indeks_klaster(TAHUN).ids)
+        features = get_indeks_klaster(TAHUN - 1).cari(None, 0)
+        self.assertEqual(sum(f['properties']['korban_luka_berat'] for f in features), self.korban_db(TAHUN - 1)['luka_berat'])
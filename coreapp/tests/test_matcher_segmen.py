@@ -0,0 +1,109 @@
+"""
+Test pencocokan titik kecelakaan ke geometry polyline segmen
+(SegmenPolylineMatcher dan find_closest_segment).
+"""
+import json
+import math
+
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+
+from ..models import SegmenJalan
+from ..utils_segmen import SegmenPolylineMatcher, parse_vertex_geometry, KM_PER_DERAJAT, TOLERANCE_KM, VERSI_MATCHER
+from .base import LAT_AWAL, LON_AWAL, DataUjiMixin
+
+
+# Segmen berbentuk L: 1 km ke timur lalu 1 km ke utara. Garis lurus titik
+# awal -> akhir (engine lama) memotong diagonal jauh dari jalan sebenarnya.
+LAT_0, LON_0 = LAT_AWAL, LON_AWAL
+DERAJAT_LON_1KM = 1 / (KM_PER_DERAJAT * math.cos(math.radians(LAT_0)))
+DERAJAT_LAT_1KM = 1 / KM_PER_DERAJAT
+SEGMEN_L = [
+    (LAT_0, LON_0),
+    (LAT_0, LON_0 + DERAJAT_LON_1KM),
+    (LAT_0 + DERAJAT_LAT_1KM, LON_0 + DERAJAT_LON_1KM),
+]
+# Ruas lain sejajar 1 km di selatan
+SEGMEN_LURUS = [(LAT_0 - DERAJAT_LAT_1KM, LON_0), (LAT_0 - DERAJAT_LAT_1KM, LON_0 + DERAJAT_LON_1KM)]
+
+
+class SegmenPolylineMatcherTest(SimpleTestCase):
+
+    def setUp(self):
+        self.matcher = SegmenPolylineMatcher([(10, SEGMEN_L), (20, SEGMEN_LURUS)])
+
+    def test_titik_di_kaki_kedua_polyline(self):
+        # 20 m di barat kaki utara, 0.5 km setelah tikungan
+        lat = LAT_0 + 0.5 * DERAJAT_LAT_1KM
+        lon = LON_0 + DERAJAT_LON_1KM - 0.02 * DERAJAT_LON_1KM
+        segmen_id, jarak, posisi = self.matcher.match(lat, lon, TOLERANCE_KM)
+
+        self.assertEqual(segmen_id, 10)
+        self.assertAlmostEqual(jarak, 0.020, places=3)
+        self.assertAlmostEqual(posisi, 1.5, places=2)
+
+    def test_titik_dekat_garis_lurus_tapi_jauh_dari_polyline(self):
+        # Tepat di tengah diagonal titik awal -> akhir: ~350 m dari jalan sebenarnya
+        lat = LAT_0 + 0.5 * DERAJAT_LAT_1KM
+        lon = LON_0 + 0.5 * DERAJAT_LON_1KM
+        self.assertIsNone(self.matcher.match(lat, lon, TOLERANCE_KM))
+
+    def test_segmen_terdekat_dipilih(self):
+        lat = LAT_0 - 0.97 * DERAJAT_LAT_1KM
+        lon = LON_0 + 0.3 * DERAJAT_LON_1KM
+        segmen_id, jarak, posisi = self.matcher.match(lat, lon, TOLERANCE_KM)
+        self.assertEqual(segmen_id, 20)
+        self.assertAlmostEqual(jarak, 0.030, places=3)
+        self.assertAlmostEqual(posisi, 0.3, places=2)
+
+    def test_tie_memilih_segmen_urutan_awal(self):
+        matcher = SegmenPolylineMatcher([(7, SEGMEN_LURUS), (3, SEGMEN_LURUS)])
+        self.assertEqual(matcher.match(SEGMEN_LURUS[0][0], LON_0 + 0.001, TOLERANCE_KM)[0], 7)
+
+    def test_match_batch_sama_dengan_match(self):
+        rng = np.random.default_rng(0)
+        lats = LAT_0 + rng.uniform(-1.2, 1.2, 500) * DERAJAT_LAT_1KM
+        lons = LON_0 + rng.uniform(-0.2, 1.2, 500) * DERAJAT_LON_1KM
+        hasil_id, hasil_jarak, hasil_posisi = self.matcher.match_batch(lats, lons, 0.2, batch_size=64)
+
+        self.assertTrue((hasil_id >= 0).any() and (hasil_id < 0).any())
+        for lat, lon, segmen_id, jarak, posisi in zip(lats, lons, hasil_id, hasil_jarak, hasil_posisi):
+            match = self.matcher.match(lat, lon, 0.2)
+            if match is None:
+                self.assertEqual(segmen_id, -1)
+            else:
+                self.assertEqual(segmen_id, match[0])
+                self.assertAlmostEqual(jarak, match[1], places=9)
+                self.assertAlmostEqual(posisi, match[2], places=9)
+
+    def test_parse_vertex_geometry(self):
+        coords = [[LON_0, LAT_0], [LON_0 + 0.01, LAT_0]]
+        harapan = [(LAT_0, LON_0), (LAT_0, LON_0 + 0.01)]
+        self.assertEqual(parse_vertex_geometry(json.dumps({'type': 'LineString', 'coordinates': coords})), harapan)
+        self.assertEqual(
+            parse_vertex_geometry({'type': 'Feature', 'geometry': {'type': 'MultiLineString', 'coordinates': [coords[:1], coords[1:]]}}),
+            harapan,
+        )
+        self.assertEqual(parse_vertex_geometry('bukan json'), [])
+        self.assertEqual(parse_vertex_geometry(None), [])
+
+
+class FindClosestSegmentTest(DataUjiMixin, TestCase):
+
+    def test_kecelakaan_di_tikungan_masuk_segmen_polyline(self):
+        ruas, _ = self.buat_ruas(0)
+        with self.setelah_commit():
+            segmen = SegmenJalan.objects.create(
+                ruas_jalan=ruas, km_awal=4, km_akhir=6, panjang_segmen=2,
+                lat_awal=SEGMEN_L[0][0], lon_awal=SEGMEN_L[0][1], lat_akhir=SEGMEN_L[-1][0], lon_akhir=SEGMEN_L[-1][1],
+                nama_segmen='Tikungan',
+                geometry=json.dumps({'type': 'LineString', 'coordinates': [[lon, lat] for lat, lon in SEGMEN_L]}),
+            )
+        kecelakaan = self.buat_kecelakaan(
+            segmen, latitude=LAT_0 + 0.25 * DERAJAT_LAT_1KM, longitude=LON_0 + DERAJAT_LON_1KM,
+        )
+
+        self.assertEqual(kecelakaan.segmen_jalan_id, segmen.id)
+        self.assertEqual(kecelakaan.versi_matcher, VERSI_MATCHER)
+        self.assertLess(kecelakaan.jarak_segmen_km, 0.001)
+        self.assertAlmostEqual(kecelakaan.posisi_km, 4 + 1.25, places=2)
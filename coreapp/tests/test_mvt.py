@@ -0,0 +1,77 @@
+"""
+Test encoder Mapbox Vector Tile (utils_mvt): tile hasil encode dibaca ulang
+dengan decoder protobuf di tests/base.py.
+"""
+from django.test import SimpleTestCase
+
+from ..utils_mvt import encode_tile, bounds_tile, proyeksi_tile, EXTENT, GEOM_POINT, GEOM_LINESTRING
+from .base import baca_tile
+
+
+class EncodeTileTest(SimpleTestCase):
+
+    def test_round_trip_geometry_dan_properties(self):
+        garis = [(-10, 5), (100, 200), (4200, -30)]
+        tile = encode_tile({
+            'segmen': [
+                (7, GEOM_LINESTRING, garis, {'nama': 'Jl. Raya', 'kategori': 'tinggi', 'accident_count': 3}),
+                (8, GEOM_LINESTRING, [(0, 0), (EXTENT, EXTENT)], {'nama': 'Jl. Lain', 'kategori': 'tinggi', 'zscore': -1.25}),
+            ],
+            'kecelakaan': [
+                (101, GEOM_POINT, [(2048, 1024)], {'meninggal': 0, 'selisih': -4, 'cluster': False, 'kosong': None}),
+            ],
+        })
+        layers = baca_tile(tile)
+
+        self.assertEqual(set(layers), {'segmen', 'kecelakaan'})
+        segmen = layers['segmen']
+        self.assertEqual((segmen['version'], segmen['extent']), (2, EXTENT))
+        self.assertEqual([f['id'] for f in segmen['features']], [7, 8])
+        self.assertEqual(segmen['features'][0]['type'], GEOM_LINESTRING)
+        self.assertEqual(segmen['features'][0]['titik'], garis)
+        self.assertEqual(
+            segmen['features'][0]['properties'], {'nama': 'Jl. Raya', 'kategori': 'tinggi', 'accident_count': 3}
+        )
+        self.assertEqual(segmen['features'][1]['properties']['zscore'], -1.25)
+        # Key dan value yang sama dipakai bersama antar feature
+        self.assertEqual(segmen['keys'].count('kategori'), 1)
+        self.assertEqual(segmen['values'].count('tinggi'), 1)
+
+        titik = layers['kecelakaan']['features'][0]
+        self.assertEqual((titik['id'], titik['type'], titik['titik']), (101, GEOM_POINT, [(2048, 1024)]))
+        self.assertEqual(titik['properties'], {'meninggal': 0, 'selisih': -4, 'cluster': False})
+
+    def test_bool_dan_int_tidak_tertukar(self):
+        layer = baca_tile(encode_tile({'l': [
+            (1, GEOM_POINT, [(1, 1)], {'a': True}),
+            (2, GEOM_POINT, [(2, 2)], {'a': 1}),
+        ]}))['l']
+        nilai = [f['properties']['a'] for f in layer['features']]
+        self.assertEqual([(type(v), v) for v in nilai], [(bool, True), (int, 1)])
+
+    def test_titik_berulang_dibuang_dan_garis_satu_titik_dilewati(self):
+        layer = baca_tile(encode_tile({'segmen': [
+            (1, GEOM_LINESTRING, [(5, 5), (5, 5), (9, 9), (9, 9)], {}),
+            (2, GEOM_LINESTRING, [(3, 3), (3, 3)], {}),
+        ]}))['segmen']
+        self.assertEqual([(f['id'], f['titik']) for f in layer['features']], [(1, [(5, 5), (9, 9)])])
+
+    def test_layer_tanpa_feature_tidak_ditulis(self):
+        self.assertEqual(encode_tile({'segmen': [], 'kecelakaan': []}), b'')
+        self.assertEqual(set(baca_tile(encode_tile({'kosong': [], 'isi': [(1, GEOM_POINT, [(0, 0)], {})]}))), {'isi'})
+
+
+class ProyeksiTileTest(SimpleTestCase):
+
+    def test_sudut_tile_ke_sudut_extent(self):
+        z, x, y = 10, 829, 533
+        min_lon, min_lat, max_lon, max_lat = bounds_tile(z, x, y)
+        self.assertEqual(proyeksi_tile(min_lon, max_lat, z, x, y), (0, 0))
+        self.assertEqual(proyeksi_tile(max_lon, min_lat, z, x, y), (EXTENT, EXTENT))
+
+    def test_titik_di_dalam_tile(self):
+        z, x, y = 10, 829, 533
+        min_lon, min_lat, max_lon, max_lat = bounds_tile(z, x, y)
+        px, py = proyeksi_tile((min_lon + max_lon) / 2, (min_lat + max_lat) / 2, z, x, y)
+        self.assertTrue(0 < px < EXTENT and 0 < py < EXTENT)
+        self.assertEqual(px, EXTENT // 2)
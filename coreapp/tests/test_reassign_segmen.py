@@ -0,0 +1,52 @@
+"""
+Test command reassign_accidents_by_line --skip-valid: hasil match dianggap
+valid berdasarkan versi segmen yang disimpan per data saat match.
+"""
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..models import KecelakaanPreprosesing, VersiData
+from ..utils_segmen import VERSI_SEGMEN, VERSI_MATCHER
+from .base import DataUjiMixin
+
+
+class ReassignSkipValidTest(DataUjiMixin, TestCase):
+
+    def setUp(self):
+        self.ruas, self.segmen = self.buat_ruas(3)
+        with self.setelah_commit():
+            self.kecelakaan = [self.buat_kecelakaan(segmen, ke=k) for k, segmen in enumerate(self.segmen)]
+
+    def reassign(self):
+        """Jalankan reassign --skip-valid, kembalikan jumlah data yang diproses"""
+        out = StringIO()
+        call_command('reassign_accidents_by_line', '--force', '--skip-valid', stdout=out)
+        for baris in out.getvalue().splitlines():
+            if baris.startswith('Total records to process:'):
+                return int(baris.split(':')[1])
+        return 0
+
+    def test_match_menyimpan_versi_segmen(self):
+        versi = VersiData.get_versi(VERSI_SEGMEN)
+        for kecelakaan in KecelakaanPreprosesing.objects.all():
+            self.assertEqual((kecelakaan.versi_matcher, kecelakaan.versi_segmen), (VERSI_MATCHER, versi))
+
+    def test_skip_valid_hanya_memproses_data_dengan_versi_segmen_lama(self):
+        self.assertEqual(self.reassign(), 0)
+
+        with self.setelah_commit():
+            self.segmen[0].save()
+        self.assertEqual(self.reassign(), len(self.kecelakaan))
+        self.assertEqual(self.reassign(), 0)
+
+    def test_edit_kecelakaan_setelah_segmen_berubah_tetap_diproses(self):
+        """updated_at kecelakaan yang lebih baru dari perubahan segmen bukan tanda match valid"""
+        with self.setelah_commit():
+            self.segmen[1].save()
+        kecelakaan = self.kecelakaan[1]
+        kecelakaan.korban_luka_berat = 2
+        kecelakaan.save()
+
+        self.assertEqual(self.reassign(), len(self.kecelakaan))
@@ -0,0 +1,36 @@
+"""
+Test command recalculate_zscore: worker paralel harus bisa dijalankan dengan
+start method apa pun (fork, spawn, forkserver).
+"""
+import multiprocessing
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from ..management.commands.recalculate_zscore import _init_worker, proses_tahun
+
+
+def _django_siap():
+    """Dijalankan di proses worker: registry app sudah di-setup oleh _init_worker"""
+    from django.apps import apps
+
+    return apps.ready
+
+
+class WorkerRecalculateZScoreTest(SimpleTestCase):
+
+    def test_modul_bisa_diimpor_sebelum_django_setup(self):
+        """Proses spawn mengimpor modul command (unpickle fungsi) sebelum initializer berjalan"""
+        hasil = subprocess.run(
+            [sys.executable, '-c', f'import {proses_tahun.__module__}'],
+            capture_output=True, text=True, cwd=settings.BASE_DIR,
+        )
+        self.assertEqual(hasil.returncode, 0, hasil.stderr)
+
+    def test_worker_spawn(self):
+        konteks = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=1, mp_context=konteks, initializer=_init_worker) as executor:
+            self.assertTrue(executor.submit(_django_siap).result(timeout=60))
@@ -0,0 +1,90 @@
+"""
+Test pemeliharaan RekapSegmen inkremental (delta F-expression dari signal
+KecelakaanPreprosesing) dibandingkan dengan rekap yang dibangun ulang penuh.
+"""
+from decimal import Decimal
+
+from django.test import TestCase
+
+from ..models import KecelakaanPreprosesing, RekapSegmen, AntrianZScore
+from .base import TAHUN, DataUjiMixin
+
+
+KOLOM_REKAP = ('jumlah_kecelakaan', 'total_korban', 'total_meninggal', 'total_luka_berat', 'total_luka_ringan', 'total_kerugian')
+
+
+class RekapDeltaTest(DataUjiMixin, TestCase):
+
+    def setUp(self):
+        _, self.segmen = self.buat_ruas(3)
+        _, self.segmen_lain = self.buat_ruas(2)
+        for tahun in (TAHUN, TAHUN - 1, 0):
+            RekapSegmen.update_rekap(tahun)
+        AntrianZScore.objects.all().delete()
+
+    def rekap(self):
+        return {
+            (row[0], row[1]): row[2:]
+            for row in RekapSegmen.objects.values_list('segmen_jalan_id', 'periode_tahun', *KOLOM_REKAP)
+        }
+
+    def assertRekapSamaDenganRebuild(self):
+        """Rekap hasil delta identik dengan rekap yang dibangun ulang dari data kecelakaan"""
+        hasil_delta = self.rekap()
+        for tahun in (TAHUN, TAHUN - 1, 0):
+            RekapSegmen.update_rekap(tahun, perbarui_tahun_nol=False)
+        self.assertEqual(hasil_delta, self.rekap())
+
+    def test_create(self):
+        self.buat_kecelakaan(self.segmen[0], korban_meninggal=1, korban_luka_berat=2, kerugian_materi=Decimal('1500000'))
+        self.buat_kecelakaan(self.segmen[0], ke=1)
+        self.buat_kecelakaan(self.segmen_lain[1], ke=2, tahun=TAHUN - 1)
+
+        rekap = self.rekap()
+        self.assertEqual(rekap[(self.segmen[0].id, TAHUN)][:3], (2, 6, 2))
+        self.assertEqual(rekap[(self.segmen[0].id, 0)][0], 2)
+        self.assertEqual(rekap[(self.segmen_lain[1].id, TAHUN - 1)][0], 1)
+        self.assertRekapSamaDenganRebuild()
+
+    def test_update_pindah_segmen_tahun_dan_korban(self):
+        kecelakaan = self.buat_kecelakaan(self.segmen[1], korban_meninggal=1)
+        kecelakaan.segmen_jalan = self.segmen_lain[0]
+        kecelakaan.tanggal = kecelakaan.tanggal.replace(year=TAHUN - 1)
+        kecelakaan.korban_luka_ringan = 4
+        kecelakaan.save()
+
+        rekap = self.rekap()
+        self.assertEqual(rekap[(self.segmen[1].id, TAHUN)][0], 0)
+        self.assertEqual(rekap[(self.segmen_lain[0].id, TAHUN - 1)][:2], (1, 5))
+        self.assertRekapSamaDenganRebuild()
+
+    def test_delete(self):
+        tetap = self.buat_kecelakaan(self.segmen[2])
+        self.buat_kecelakaan(self.segmen[2], ke=1).delete()
+
+        self.assertEqual(self.rekap()[(self.segmen[2].id, TAHUN)][0], 1)
+        self.assertEqual(self.rekap()[(self.segmen[2].id, 0)][0], 1)
+        self.assertTrue(KecelakaanPreprosesing.objects.filter(pk=tetap.pk).exists())
+        self.assertRekapSamaDenganRebuild()
+
+    def test_delta_menandai_ruas_di_antrian(self):
+        self.buat_kecelakaan(self.segmen[0])
+        self.assertEqual(
+            set(AntrianZScore.objects.values_list('tahun', 'kunci_ruas')),
+            {(TAHUN, self.segmen[0].ruas_jalan_id), (0, self.segmen[0].ruas_jalan_id)},
+        )
+
+    def test_periode_tanpa_rekap_antri_rebuild_penuh(self):
+        self.buat_kecelakaan(self.segmen[0], tahun=TAHUN - 2)
+        self.assertTrue(AntrianZScore.objects.filter(tahun=TAHUN - 2, kunci_ruas=0).exists())
+
+    def test_rebuild_update_baris_di_tempat(self):
+        """Rebuild mempertahankan baris rekap (id sama) agar delta yang menunggu lock baris tetap berlaku"""
+        id_lama = dict(RekapSegmen.objects.filter(periode_tahun=TAHUN).values_list('segmen_jalan_id', 'id'))
+        KecelakaanPreprosesing.objects.bulk_create([
+            KecelakaanPreprosesing(segmen_jalan=self.segmen[0], **self.data_kecelakaan(self.segmen[0]))
+        ])
+        RekapSegmen.update_rekap(TAHUN)
+
+        self.assertEqual(dict(RekapSegmen.objects.filter(periode_tahun=TAHUN).values_list('segmen_jalan_id', 'id')), id_lama)
+        self.assertEqual(RekapSegmen.objects.get(segmen_jalan=self.segmen[0], periode_tahun=TAHUN).jumlah_kecelakaan, 1)
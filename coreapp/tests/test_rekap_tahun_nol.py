@@ -0,0 +1,82 @@
+"""
+Test rekap tahun 0 (semua tahun) yang diturunkan dari rekap per tahun.
+"""
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..models import KecelakaanPreprosesing, RekapSegmen, AntrianZScore
+from .base import TAHUN, DataUjiMixin
+
+
+KOLOM_REKAP = ('jumlah_kecelakaan', 'total_korban', 'total_meninggal', 'total_luka_berat', 'total_luka_ringan', 'total_kerugian')
+
+
+class RekapTahunNolTest(DataUjiMixin, TestCase):
+
+    def setUp(self):
+        self.tambah_data(jumlah_ruas=2, segmen_per_ruas=3, kecelakaan_per_segmen=2, tahun=TAHUN)
+        self.tambah_data(jumlah_ruas=1, segmen_per_ruas=2, kecelakaan_per_segmen=3, tahun=TAHUN - 1)
+
+    def rekap(self, periode):
+        return {
+            row[0]: row[1:]
+            for row in RekapSegmen.objects.filter(periode_tahun=periode).values_list('segmen_jalan_id', *KOLOM_REKAP)
+        }
+
+    def test_rollup_sama_dengan_jumlah_rekap_per_tahun(self):
+        RekapSegmen.update_rekap(0)
+
+        harapan = {
+            row['segmen_jalan_id']: tuple(row[k] for k in KOLOM_REKAP)
+            for row in RekapSegmen.objects.exclude(periode_tahun=0).values('segmen_jalan_id').annotate(
+                **{k: Sum(k) for k in KOLOM_REKAP}
+            )
+        }
+        self.assertEqual(self.rekap(0), harapan)
+        self.assertEqual(
+            sum(nilai[0] for nilai in self.rekap(0).values()), KecelakaanPreprosesing.objects.count()
+        )
+
+    def test_rollup_tidak_memindai_tabel_kecelakaan(self):
+        tabel = KecelakaanPreprosesing._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            RekapSegmen.update_rekap(0)
+        self.assertFalse([q['sql'] for q in queries if tabel in q['sql']])
+
+    def test_tahun_antri_rebuild_direkap_sebelum_rollup(self):
+        """Kecelakaan yang di-assign tanpa signal (bulk_update) masuk rekap lewat tanda di antrian"""
+        RekapSegmen.update_rekap(0)
+        kecelakaan = KecelakaanPreprosesing.objects.filter(tanggal__year=TAHUN).first()
+        segmen_lama = kecelakaan.segmen_jalan_id
+        kecelakaan.segmen_jalan_id = None
+        KecelakaanPreprosesing.objects.bulk_update([kecelakaan], ['segmen_jalan'])
+
+        RekapSegmen.update_rekap(0)
+        self.assertEqual(self.rekap(0)[segmen_lama][0], 2, 'tanpa tanda antrian rekap tidak disentuh')
+
+        AntrianZScore.tandai(TAHUN)
+        RekapSegmen.update_rekap(0)
+        self.assertEqual(self.rekap(TAHUN)[segmen_lama][0], 1)
+        self.assertEqual(self.rekap(0)[segmen_lama][0], 1)
+
+    def test_periksa_penuh_menemukan_perubahan_tanpa_signal(self):
+        RekapSegmen.update_rekap(0)
+        KecelakaanPreprosesing.objects.filter(tanggal__year=TAHUN - 1).update(segmen_jalan=None)
+
+        self.assertTrue(RekapSegmen.rollup_tahun_nol(periksa_penuh=True))
+        self.assertEqual(sum(nilai[0] for nilai in self.rekap(TAHUN - 1).values()), 0)
+        self.assertEqual(
+            sum(nilai[0] for nilai in self.rekap(0).values()),
+            KecelakaanPreprosesing.objects.filter(segmen_jalan__isnull=False).count(),
+        )
+
+    def test_rekap_tahun_menandai_tahun_nol_jika_berubah(self):
+        RekapSegmen.update_rekap(0)
+        RekapSegmen.update_rekap(TAHUN)
+        self.assertFalse(AntrianZScore.objects.filter(tahun=0).exists(), 'isi tidak berubah, tidak perlu antri')
+
+        KecelakaanPreprosesing.objects.filter(tanggal__year=TAHUN).update(korban_luka_berat=1)
+        RekapSegmen.update_rekap(TAHUN)
+        self.assertTrue(AntrianZScore.objects.filter(tahun=0, kunci_ruas=0).exists())
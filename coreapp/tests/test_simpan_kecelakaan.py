@@ -0,0 +1,67 @@
+"""
+Test save KecelakaanPreprosesing dalam satu transaksi (save + auto-assign).
+
+Pekerjaan signal (delta rekap, antrian Z-Score) yang gagal di database tidak
+boleh ikut membatalkan baris kecelakaan yang disimpan.
+"""
+from unittest import mock
+
+from django.db.models import QuerySet
+from django.test import TestCase
+
+from ..models import KecelakaanPreprosesing, RekapSegmen, AntrianZScore
+from .base import TAHUN, DataUjiMixin
+
+
+class SimpanKecelakaanTest(DataUjiMixin, TestCase):
+
+    def setUp(self):
+        self.ruas, self.segmen = self.buat_ruas(3)
+        RekapSegmen.update_rekap(TAHUN)
+        RekapSegmen.update_rekap(0)
+        AntrianZScore.objects.all().delete()
+
+    def test_race_antrian_tidak_membatalkan_kecelakaan(self):
+        """INSERT antrian yang kalah race (UPDATE 0 baris lalu IntegrityError) tidak menghapus kecelakaan"""
+        for tahun in (TAHUN, 0):
+            AntrianZScore.objects.create(tahun=tahun, ruas_jalan=self.ruas)
+
+        update_asli = QuerySet.update
+
+        def update_kalah_race(qs, **kwargs):
+            # Baris antrian baru di-commit proses lain setelah UPDATE dijalankan
+            if qs.model is AntrianZScore:
+                return 0
+            return update_asli(qs, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', update_kalah_race):
+            kecelakaan = self.buat_kecelakaan(self.segmen[1])
+
+        self.assertEqual(kecelakaan.segmen_jalan_id, self.segmen[1].id)
+        self.assertTrue(KecelakaanPreprosesing.objects.filter(pk=kecelakaan.pk, segmen_jalan=self.segmen[1]).exists())
+        self.assertEqual(
+            RekapSegmen.objects.get(segmen_jalan=self.segmen[1], periode_tahun=TAHUN).jumlah_kecelakaan, 1
+        )
+        self.assertEqual(AntrianZScore.objects.filter(kunci_ruas=self.ruas.id).count(), 2)
+
+    def test_error_database_di_signal_tidak_membatalkan_kecelakaan(self):
+        """Error database apa pun di delta rekap hanya membatalkan savepoint signal"""
+        def delta_gagal(segmen_jalan_id, tahun, *args, **kwargs):
+            # Baris rekap duplikat: IntegrityError dari ORM menandai transaksi untuk rollback
+            RekapSegmen.objects.create(segmen_jalan_id=segmen_jalan_id, periode_tahun=tahun)
+
+        with mock.patch.object(RekapSegmen, 'terapkan_delta', side_effect=delta_gagal):
+            kecelakaan = self.buat_kecelakaan(self.segmen[0])
+
+        self.assertTrue(KecelakaanPreprosesing.objects.filter(pk=kecelakaan.pk, segmen_jalan=self.segmen[0]).exists())
+        self.assertEqual(
+            RekapSegmen.objects.get(segmen_jalan=self.segmen[0], periode_tahun=TAHUN).jumlah_kecelakaan, 0
+        )
+
+    def test_hapus_kecelakaan_mengurangi_rekap(self):
+        kecelakaan = self.buat_kecelakaan(self.segmen[2], korban_meninggal=2)
+        kecelakaan.delete()
+
+        for periode in (TAHUN, 0):
+            rekap = RekapSegmen.objects.get(segmen_jalan=self.segmen[2], periode_tahun=periode)
+            self.assertEqual((rekap.jumlah_kecelakaan, rekap.total_meninggal), (0, 0))
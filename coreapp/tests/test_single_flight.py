@@ -0,0 +1,78 @@
+"""
+Test single-flight lock (utils_lock) dengan baris KunciProses (database
+selain MySQL) dan pemakaiannya di calculate_zscore.
+"""
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import utils_lock
+from ..models import AnalisisZScore, KunciProses, SegmenJalan, VersiData
+from ..utils_lock import single_flight, get_statistik_kunci, _nama_kunci
+from ..utils_zscore import kunci_zscore_aktif
+from .base import TAHUN, DataUjiMixin
+
+
+class SingleFlightTest(TestCase):
+
+    def pegang(self, nama, kedaluwarsa_detik=600):
+        """Baris lock milik proses lain"""
+        KunciProses.objects.create(
+            nama=_nama_kunci(nama), token='proses-lain',
+            kedaluwarsa_at=timezone.now() + timedelta(seconds=kedaluwarsa_detik),
+        )
+
+    def test_lock_bebas_langsung_didapat_dan_dilepas(self):
+        with single_flight('uji_bebas', timeout=0) as kunci:
+            self.assertTrue(kunci.dapat)
+            self.assertFalse(kunci.menunggu)
+            self.assertTrue(KunciProses.objects.filter(nama=_nama_kunci('uji_bebas')).exists())
+        self.assertFalse(KunciProses.objects.exists())
+
+    def test_lock_dipegang_proses_lain_timeout(self):
+        self.pegang('uji_dipegang')
+        with single_flight('uji_dipegang', timeout=0) as kunci:
+            self.assertFalse(kunci.dapat)
+            self.assertTrue(kunci.menunggu)
+        # Baris milik proses lain tidak ikut dilepas
+        self.assertTrue(KunciProses.objects.filter(token='proses-lain').exists())
+        stat = get_statistik_kunci()[_nama_kunci('uji_dipegang')]
+        self.assertGreaterEqual(stat['timeout'], 1)
+        self.assertGreaterEqual(stat['menunggu'], 1)
+
+    def test_lock_yatim_diambil_alih(self):
+        self.pegang('uji_yatim', kedaluwarsa_detik=-1)
+        with single_flight('uji_yatim', timeout=0) as kunci:
+            self.assertTrue(kunci.dapat)
+            self.assertFalse(kunci.menunggu)
+        self.assertFalse(KunciProses.objects.exists())
+
+
+class CalculateZScoreLockTest(DataUjiMixin, TestCase):
+
+    def setUp(self):
+        self.tambah_data(jumlah_ruas=2, segmen_per_ruas=3, kecelakaan_per_segmen=2)
+        self.versi = VersiData.get_versi(kunci_zscore_aktif(TAHUN))
+
+    def test_lock_tidak_didapat_memakai_snapshot_lama(self):
+        KunciProses.objects.create(
+            nama=_nama_kunci(f'zscore_{TAHUN}'), token='proses-lain',
+            kedaluwarsa_at=timezone.now() + timedelta(seconds=600),
+        )
+        with self.settings(ZSCORE_LOCK_TIMEOUT=0):
+            self.assertFalse(AnalisisZScore.calculate_zscore(TAHUN))
+        self.assertEqual(VersiData.get_versi(kunci_zscore_aktif(TAHUN)), self.versi)
+
+    def test_gabung_setelah_menunggu_memakai_hasil_proses_lain(self):
+        # Lock baru didapat pada percobaan kedua: proses lain baru selesai menghitung
+        with mock.patch.object(utils_lock, '_baris_ambil', side_effect=[False, True]):
+            self.assertFalse(AnalisisZScore.calculate_zscore(TAHUN, gabung=True))
+        self.assertEqual(VersiData.get_versi(kunci_zscore_aktif(TAHUN)), self.versi)
+
+    def test_gabung_tetap_menghitung_jika_data_berubah(self):
+        self.buat_kecelakaan(SegmenJalan.objects.first())
+        with mock.patch.object(utils_lock, '_baris_ambil', side_effect=[False, True]):
+            self.assertTrue(AnalisisZScore.calculate_zscore(TAHUN, gabung=True))
+        self.assertGreater(VersiData.get_versi(kunci_zscore_aktif(TAHUN)), self.versi)
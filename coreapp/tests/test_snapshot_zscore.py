@@ -0,0 +1,66 @@
+"""
+Test snapshot Z-Score berversi: hasil ditulis sebagai versi baru lalu
+pointer VersiData 'zscore_<tahun>' dipindahkan dengan satu UPDATE.
+"""
+from unittest import mock
+
+from django.test import TestCase
+
+from ..models import AnalisisZScore, SegmenJalan, VersiData
+from ..utils_zscore import VERSI_ZSCORE, kunci_zscore_aktif
+from .base import TAHUN, DataUjiMixin
+
+
+class SnapshotZScoreTest(DataUjiMixin, TestCase):
+
+    def setUp(self):
+        self.tambah_data(jumlah_ruas=2, segmen_per_ruas=3, kecelakaan_per_segmen=2)
+
+    def versi_tersimpan(self, tahun=TAHUN):
+        return set(AnalisisZScore.objects.filter(tahun=tahun).values_list('versi', flat=True))
+
+    def test_hitung_ulang_menyisakan_satu_snapshot_aktif(self):
+        versi_lama = VersiData.get_versi(kunci_zscore_aktif(TAHUN))
+        AnalisisZScore.hitung_ulang_zscore(TAHUN)
+
+        versi_baru = VersiData.get_versi(kunci_zscore_aktif(TAHUN))
+        self.assertGreater(versi_baru, versi_lama)
+        self.assertEqual(self.versi_tersimpan(), {versi_baru})
+        self.assertEqual(AnalisisZScore.objects.aktif().filter(tahun=TAHUN).count(), SegmenJalan.objects.count())
+
+    def test_snapshot_yang_kalah_race_dibuang(self):
+        """Snapshot bernomor lebih kecil yang selesai belakangan tidak menggantikan snapshot aktif"""
+        versi_aktif = VersiData.get_versi(kunci_zscore_aktif(TAHUN))
+        aktif = list(AnalisisZScore.objects.aktif().filter(tahun=TAHUN).values_list('id', flat=True))
+
+        naikkan_asli = VersiData.naikkan
+        with mock.patch.object(
+            VersiData, 'naikkan',
+            side_effect=lambda kunci: versi_aktif - 1 if kunci == VERSI_ZSCORE else naikkan_asli(kunci),
+        ):
+            AnalisisZScore.hitung_ulang_zscore(TAHUN)
+
+        self.assertEqual(VersiData.get_versi(kunci_zscore_aktif(TAHUN)), versi_aktif)
+        self.assertEqual(self.versi_tersimpan(), {versi_aktif})
+        self.assertEqual(list(AnalisisZScore.objects.aktif().filter(tahun=TAHUN).values_list('id', flat=True)), aktif)
+
+    def test_aktif_memakai_pointer_per_tahun(self):
+        AnalisisZScore.calculate_zscore(0)
+        self.assertNotEqual(VersiData.get_versi(kunci_zscore_aktif(0)), VersiData.get_versi(kunci_zscore_aktif(TAHUN)))
+        for tahun in (0, TAHUN):
+            self.assertEqual(
+                set(AnalisisZScore.objects.aktif().filter(tahun=tahun).values_list('versi', flat=True)),
+                {VersiData.get_versi(kunci_zscore_aktif(tahun))},
+            )
+        self.assertFalse(AnalisisZScore.objects.aktif().filter(tahun=TAHUN - 1).exists())
+
+
+class PindahkanPointerTest(TestCase):
+
+    def test_pointer_hanya_maju(self):
+        self.assertTrue(VersiData.pindahkan('zscore_uji', 5))
+        self.assertFalse(VersiData.pindahkan('zscore_uji', 3))
+        self.assertFalse(VersiData.pindahkan('zscore_uji', 5))
+        self.assertEqual(VersiData.get_versi('zscore_uji'), 5)
+        self.assertTrue(VersiData.pindahkan('zscore_uji', 8))
+        self.assertEqual(VersiData.get_versi('zscore_uji'), 8)
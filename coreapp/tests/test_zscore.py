@@ -0,0 +1,104 @@
+"""
+Test engine Z-Score per ruas (utils_zscore.hitung_zscore_per_ruas)
+dibandingkan dengan loop per ruas versi lama.
+"""
+import decimal
+import math
+import random
+
+from django.test import SimpleTestCase, TestCase
+
+from ..models import AnalisisZScore, RekapSegmen, SegmenJalan
+from ..utils_zscore import hitung_zscore_per_ruas, KATEGORI_KELAS
+from .base import TAHUN, DataUjiMixin
+
+
+def zscore_loop(ruas_ids, jumlah):
+    """Perhitungan lama: satu iterasi per ruas, stddev populasi, threshold if/elif"""
+    per_ruas = {}
+    for i, ruas_id in enumerate(ruas_ids):
+        per_ruas.setdefault(ruas_id, []).append(i)
+
+    zscore, kategori = [None] * len(jumlah), [None] * len(jumlah)
+    for indeks in per_ruas.values():
+        nilai = [float(jumlah[i]) for i in indeks]
+        mean = sum(nilai) / len(nilai)
+        stddev = math.sqrt(sum((x - mean) ** 2 for x in nilai) / len(nilai)) or 1
+        z = {i: (float(jumlah[i]) - mean) / stddev for i in indeks}
+        z_max, z_min = max(z.values()), min(z.values())
+        interval = (z_max - z_min) / 5 if z_max != z_min else 1
+        threshold = [z_min + k * interval for k in (1, 2, 3, 4)]
+        for i, nilai_z in z.items():
+            if nilai_z >= threshold[3]:
+                kategori[i] = 'sangat_tinggi'
+            elif nilai_z >= threshold[2]:
+                kategori[i] = 'tinggi'
+            elif nilai_z >= threshold[1]:
+                kategori[i] = 'sedang'
+            elif nilai_z >= threshold[0]:
+                kategori[i] = 'rendah'
+            else:
+                kategori[i] = 'sangat_rendah'
+            zscore[i] = nilai_z
+    return zscore, kategori
+
+
+class HitungZScorePerRuasTest(SimpleTestCase):
+
+    def assertSamaDenganLoop(self, ruas_ids, jumlah):
+        zscore, kelas, statistik = hitung_zscore_per_ruas(ruas_ids, jumlah)
+        zscore_lama, kategori_lama = zscore_loop(ruas_ids, jumlah)
+        for z, z_lama in zip(zscore, zscore_lama):
+            self.assertAlmostEqual(z, z_lama, places=9)
+        self.assertEqual([KATEGORI_KELAS[k] for k in kelas], kategori_lama)
+        self.assertEqual(set(statistik), set(ruas_ids))
+        return statistik
+
+    def test_data_acak_banyak_ruas(self):
+        acak = random.Random(8)
+        ruas_ids = [acak.randint(1, 40) for _ in range(2000)]
+        jumlah = [acak.choice([0, 0, 0, 1, 1, 2, 3, 5, 8, 13]) for _ in ruas_ids]
+        self.assertSamaDenganLoop(ruas_ids, jumlah)
+
+    def test_ruas_dengan_nilai_sama_dan_satu_segmen(self):
+        statistik = self.assertSamaDenganLoop([1, 1, 1, 2, 3, 3], [4, 4, 4, 7, 0, 6])
+        self.assertEqual(statistik[1]['stddev'], 1)
+        self.assertEqual(statistik[1]['interval'], 1)
+        self.assertEqual(statistik[2]['jumlah_segmen'], 1)
+
+    def test_nilai_tepat_di_threshold(self):
+        # Jumlah berjarak sama: setiap Z jatuh tepat di threshold Z_min + k * I,
+        # jadi kelas bergantung pada perbandingan >= yang sama persis dengan loop
+        self.assertSamaDenganLoop([5] * 6, [0, 1, 2, 3, 4, 5])
+
+    def test_kosong(self):
+        zscore, kelas, statistik = hitung_zscore_per_ruas([], [])
+        self.assertEqual((len(zscore), len(kelas), statistik), (0, 0, {}))
+
+
+class CalculateZScoreTest(DataUjiMixin, TestCase):
+
+    def test_snapshot_sama_dengan_loop(self):
+        self.tambah_data(jumlah_ruas=3, segmen_per_ruas=4, kecelakaan_per_segmen=0)
+        # Jumlah kecelakaan berbeda per segmen agar kategori bervariasi
+        for n, segmen in enumerate(SegmenJalan.objects.order_by('id')):
+            for k in range(n % 5):
+                self.buat_kecelakaan(segmen, ke=k)
+        AnalisisZScore.calculate_zscore(TAHUN)
+
+        rekap = list(RekapSegmen.objects.filter(periode_tahun=TAHUN).order_by('segmen_jalan_id').values_list(
+            'segmen_jalan_id', 'segmen_jalan__ruas_jalan_id', 'jumlah_kecelakaan'
+        ))
+        zscore_lama, kategori_lama = zscore_loop([r[1] for r in rekap], [r[2] for r in rekap])
+        harapan = {
+            r[0]: (decimal.Decimal(str(round(z, 3))), kategori)
+            for r, z, kategori in zip(rekap, zscore_lama, kategori_lama)
+        }
+        hasil = {
+            segmen_id: (nilai, kategori)
+            for segmen_id, nilai, kategori in AnalisisZScore.objects.aktif().filter(tahun=TAHUN).values_list(
+                'segmen_jalan_id', 'nilai_zscore', 'kategori'
+            )
+        }
+        self.assertEqual(hasil, harapan)
+        self.assertGreater(len(set(kategori_lama)), 2)
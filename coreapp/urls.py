@@ -124,7 +124,11 @@ urlpatterns = [
     path('api/segmen/geojson/', views.api_segmen_geojson, name='api_segmen_geojson'),
     path('api/segmen/thresholds/', views.api_threshold_data, name='api_threshold_data'),
     path('api/segmen/check-update/', views.api_data_update_check, name='api_data_update_check'),
+    path('api/lock-stats/', views.api_statistik_kunci, name='api_statistik_kunci'),
     path('api/kecelakaan/geojson/', views.api_kecelakaan_geojson, name='api_kecelakaan_geojson'),
+    path('api/kecelakaan/geojson/stream/', views.api_kecelakaan_geojson_stream, name='api_kecelakaan_geojson_stream'),
+    path('api/kecelakaan/cluster/', views.api_kecelakaan_cluster, name='api_kecelakaan_cluster'),
+    path('api/tiles/<str:layer>/<int:z>/<int:x>/<int:y>.mvt', views.api_tiles, name='api_tiles'),
     path('api/analisis/statistik/', views.api_analisis_statistik, name='api_analisis_statistik'),
     
     # Geoapify API
@@ -0,0 +1,145 @@
+"""
+Cache geometry ternormalisasi SegmenJalan dan RuasJalan per proses.
+
+Geometry GeoJSON (Feature / LineString / MultiLineString) diparse sekali
+menjadi LineString datar beserta bounding box, panjang, dan titik ujungnya,
+lalu disimpan di memori dengan kunci (id, updated_at). Request peta cukup
+memuat id dan updated_at; teks geometry hanya diambil dari database (satu
+query) untuk objek yang belum ada di cache atau sudah berubah.
+"""
+import json
+import math
+import threading
+
+from .utils_segmen import R_BUMI_KM
+
+
+# Cache per jenis: id -> (updated_at, GeometriNormal)
+_cache_geometri = {'segmen': {}, 'ruas': {}}
+_kunci_cache = threading.Lock()
+
+
+class GeometriNormal:
+    """
+    Geometry satu segmen/ruas yang sudah dinormalisasi.
+
+    - `geometry`: dict GeoJSON LineString (None jika geometry kosong/tidak valid)
+    - `tipe_asli`: type GeoJSON sebelum dinormalisasi
+    - `bbox`: (min_lon, min_lat, max_lon, max_lat)
+    - `panjang_km`: panjang polyline (haversine)
+    - `awal`, `akhir`: koordinat titik pertama dan terakhir
+    - `band`: geometry sederhana per zoom band (hanya segmen, lihat utils_peta)
+    """
+
+    def __init__(self, teks, teks_band=None, label=''):
+        self.label = label
+        self.geometry = None
+        self.tipe_asli = None
+        self.bbox = None
+        self.panjang_km = 0.0
+        self.awal = self.akhir = None
+        self.band = json.loads(teks_band) if teks_band else {}
+        if teks:
+            self._normalisasi(teks)
+
+    def _normalisasi(self, teks):
+        try:
+            geom = json.loads(teks)
+            self.tipe_asli = geom.get('type')
+            if self.tipe_asli == 'Feature':
+                geom = geom.get('geometry') or {}
+            if geom.get('type') == 'MultiLineString':
+                coords = [pt for line in geom.get('coordinates') or [] for pt in line]
+            elif geom.get('type') == 'LineString':
+                coords = geom.get('coordinates') or []
+            else:
+                coords = []
+        except (ValueError, TypeError, AttributeError) as e:
+            print(f"⚠ Error parsing geometry for {self.label}: {e}")
+            return
+
+        coords = [pt for pt in coords if isinstance(pt, (list, tuple)) and len(pt) >= 2]
+        if not coords:
+            return
+
+        self.geometry = {'type': 'LineString', 'coordinates': coords}
+        self.awal, self.akhir = coords[0], coords[-1]
+        lons = [float(pt[0]) for pt in coords]
+        lats = [float(pt[1]) for pt in coords]
+        self.bbox = (min(lons), min(lats), max(lons), max(lats))
+        self.panjang_km = sum(
+            _haversine_km(lats[i], lons[i], lats[i + 1], lons[i + 1]) for i in range(len(coords) - 1)
+        )
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return R_BUMI_KM * 2 * math.asin(math.sqrt(a))
+
+
+def _ambil(jenis, objek_list, muat, lengkap=False):
+    """
+    GeometriNormal untuk setiap objek (id -> GeometriNormal). `muat(ids)`
+    mengembalikan iterable (id, updated_at, teks, teks_band) untuk objek yang
+    belum ada di cache atau updated_at-nya berbeda. Dengan lengkap=True
+    (objek_list berisi seluruh tabel), entri cache yang id-nya sudah tidak
+    ada ikut dibuang (objek dihapus di proses lain).
+    """
+    cache = _cache_geometri[jenis]
+    hasil = {}
+    kurang = []
+    for obj in objek_list:
+        entri = cache.get(obj.id)
+        if entri is not None and entri[0] == obj.updated_at:
+            hasil[obj.id] = entri[1]
+        else:
+            kurang.append(obj.id)
+
+    if kurang:
+        baru = {}
+        for obj_id, updated_at, teks, teks_band in muat(kurang):
+            geometri = GeometriNormal(teks, teks_band, label=f"{jenis} {obj_id}")
+            baru[obj_id] = (updated_at, geometri)
+            hasil[obj_id] = geometri
+        with _kunci_cache:
+            cache.update(baru)
+    if lengkap:
+        with _kunci_cache:
+            for obj_id in [k for k in cache if k not in hasil]:
+                del cache[obj_id]
+    return hasil
+
+
+def geometri_segmen(segmen_list, lengkap=False):
+    """
+    GeometriNormal per id untuk daftar SegmenJalan (cukup id dan updated_at yang
+    dimuat). lengkap=True jika daftar berisi semua segmen (lihat _ambil).
+    """
+    from .models import SegmenJalan
+
+    return _ambil('segmen', segmen_list, lambda ids: SegmenJalan.objects.filter(id__in=ids).values_list(
+        'id', 'updated_at', 'geometry', 'geometry_peta'
+    ), lengkap=lengkap)
+
+
+def geometri_ruas(ruas_list):
+    """GeometriNormal per id untuk daftar RuasJalan (cukup id dan updated_at yang dimuat)"""
+    from .models import RuasJalan
+
+    return _ambil('ruas', ruas_list, lambda ids: (
+        (obj_id, updated_at, teks, None)
+        for obj_id, updated_at, teks in RuasJalan.objects.filter(id__in=ids).values_list('id', 'updated_at', 'geometry')
+    ))
+
+
+def simpan_geometri(jenis, obj, teks_band=None):
+    """Isi cache langsung saat objek disimpan, agar request berikutnya di proses ini tidak perlu parse"""
+    with _kunci_cache:
+        _cache_geometri[jenis][obj.id] = (obj.updated_at, GeometriNormal(obj.geometry, teks_band, label=f"{jenis} {obj.id}"))
+
+
+def hapus_geometri(jenis, obj_id):
+    """Buang entri cache objek yang dihapus"""
+    with _kunci_cache:
+        _cache_geometri[jenis].pop(obj_id, None)
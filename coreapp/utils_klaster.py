@@ -0,0 +1,219 @@
+"""
+Utilitas clustering titik kecelakaan di sisi server per level zoom.
+
+Indeks berupa piramida grid (gaya supercluster) di atas koordinat Web
+Mercator KecelakaanPreprosesing: level terdalam (MAKS_ZOOM_KLASTER)
+mengelompokkan titik per sel grid, lalu setiap level di atasnya
+menggabungkan 2x2 sel level di bawahnya. Setiap sel menyimpan jumlah titik,
+centroid, dan jumlah korban, sehingga request per bbox/zoom cukup memfilter
+array sel tanpa menyentuh database.
+
+Indeks disimpan per tahun di memori proses (LRU, maksimal
+MAKS_INDEKS_KLASTER tahun; tahun tanpa data tidak disimpan). Setiap indeks
+diberi label versi kecelakaan tahunnya (kunci_versi_kecelakaan, dinaikkan
+signal save/delete KecelakaanPreprosesing); indeks dibangun ulang penuh
+hanya jika versi tahun itu berubah, dicek dengan satu query ringan.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .utils_peta import kunci_versi_kecelakaan
+
+
+# Level zoom terdalam yang masih di-cluster; di atasnya titik dikirim satu per satu
+MAKS_ZOOM_KLASTER = 16
+
+# Ukuran sel grid dalam pixel tile 256px (sel per sumbu = 2**zoom * 256 / UKURAN_SEL_PX)
+UKURAN_SEL_PX = 64
+
+_SEL_PER_TILE = 256 // UKURAN_SEL_PX
+
+# Jumlah maksimal indeks tahun yang disimpan per proses (LRU)
+MAKS_INDEKS_KLASTER = 8
+
+# Indeks per tahun di proses ini (0 = semua tahun), urut dari yang paling lama dipakai
+_indeks_klaster = OrderedDict()
+_kunci_indeks = threading.Lock()
+
+
+def mercator(lon, lat):
+    """Koordinat Web Mercator ternormalisasi [0, 1] dari array lon/lat (derajat)"""
+    lat = np.clip(lat, -85.0511287798, 85.0511287798)
+    mx = (np.asarray(lon) + 180.0) / 360.0
+    my = (1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2
+    return mx, my
+
+
+def lonlat(mx, my):
+    """Kebalikan mercator(): array lon/lat (derajat) dari koordinat ternormalisasi"""
+    lon = mx * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * my))))
+    return lon, lat
+
+
+class IndeksKlaster:
+    """
+    Piramida grid klaster untuk satu tahun.
+
+    - `ids`, `mx`, `my`, `korban`: data titik (korban = kolom meninggal,
+      luka berat, luka ringan)
+    - `level[z]`: dict array sel (jumlah, lon, lat, korban, id_titik) untuk
+      zoom 0..MAKS_ZOOM_KLASTER; id_titik adalah id kecelakaan jika sel
+      hanya berisi satu titik
+    """
+
+    def __init__(self, ids, lon, lat, korban, versi=0):
+        self.versi = versi
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.korban = np.asarray(korban, dtype=np.int64).reshape(-1, 3)
+        self.mx, self.my = mercator(self.lon, self.lat)
+        self.level = self._bangun_piramida()
+
+    def _bangun_piramida(self):
+        level = {}
+        n = len(self.ids)
+        sel_per_sumbu = 2 ** MAKS_ZOOM_KLASTER * _SEL_PER_TILE
+        ix = np.clip((self.mx * sel_per_sumbu).astype(np.int64), 0, sel_per_sumbu - 1)
+        iy = np.clip((self.my * sel_per_sumbu).astype(np.int64), 0, sel_per_sumbu - 1)
+        # Level terdalam dibangun dari titik; setiap "sel" awal = satu titik
+        jumlah = np.ones(n, dtype=np.int64)
+        sum_mx, sum_my = self.mx.copy(), self.my.copy()
+        korban = self.korban.copy()
+        id_titik = self.ids.copy()
+
+        for z in range(MAKS_ZOOM_KLASTER, -1, -1):
+            if z < MAKS_ZOOM_KLASTER:
+                ix, iy = ix >> 1, iy >> 1
+            kunci = (ix << 32) | iy
+            kunci_unik, grup = np.unique(kunci, return_inverse=True)
+            jumlah_baru = np.bincount(grup, weights=jumlah, minlength=len(kunci_unik)).astype(np.int64)
+            sum_mx = np.bincount(grup, weights=sum_mx, minlength=len(kunci_unik))
+            sum_my = np.bincount(grup, weights=sum_my, minlength=len(kunci_unik))
+            korban = np.stack([
+                np.bincount(grup, weights=korban[:, k], minlength=len(kunci_unik)) for k in range(3)
+            ], axis=1).astype(np.int64)
+            # id titik hanya berarti untuk sel yang berisi tepat satu titik
+            anggota = np.full(len(kunci_unik), -1, dtype=np.int64)
+            anggota[grup] = id_titik
+            id_titik = np.where(jumlah_baru == 1, anggota, -1)
+            jumlah = jumlah_baru
+            ix, iy = kunci_unik >> 32, kunci_unik & 0xFFFFFFFF
+
+            lon, lat = lonlat(sum_mx / jumlah, sum_my / jumlah)
+            level[z] = {
+                'kunci': kunci_unik, 'jumlah': jumlah, 'lon': lon, 'lat': lat,
+                'korban': korban, 'id_titik': id_titik,
+            }
+        return level
+
+    def cari(self, bbox, zoom):
+        """
+        Feature GeoJSON klaster/titik di dalam bbox (min_lon, min_lat,
+        max_lon, max_lat) untuk zoom tertentu. bbox None = seluruh data.
+        """
+        z = int(zoom)
+        if z > MAKS_ZOOM_KLASTER:
+            data = {
+                'kunci': self.ids, 'jumlah': np.ones(len(self.ids), dtype=np.int64),
+                'lon': self.lon, 'lat': self.lat, 'korban': self.korban, 'id_titik': self.ids,
+            }
+        else:
+            data = self.level[max(z, 0)]
+
+        mask = np.ones(len(data['jumlah']), dtype=bool)
+        if bbox:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            mask = (data['lon'] >= min_lon) & (data['lon'] <= max_lon) & (data['lat'] >= min_lat) & (data['lat'] <= max_lat)
+
+        features = []
+        for i in np.flatnonzero(mask):
+            meninggal, luka_berat, luka_ringan = (int(v) for v in data['korban'][i])
+            properties = {
+                'point_count': int(data['jumlah'][i]),
+                'korban_meninggal': meninggal,
+                'korban_luka_berat': luka_berat,
+                'korban_luka_ringan': luka_ringan,
+                'total_korban': meninggal + luka_berat + luka_ringan,
+            }
+            kid = int(data['id_titik'][i])
+            if kid >= 0:
+                properties.update({'cluster': False, 'kecelakaan_id': kid, 'url': f'/kecelakaan/{kid}/'})
+                feature_id = kid
+            else:
+                properties['cluster'] = True
+                feature_id = f"cluster_{z}_{int(data['kunci'][i])}"
+            features.append({
+                'type': 'Feature',
+                'id': feature_id,
+                'properties': properties,
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': [float(data['lon'][i]), float(data['lat'][i])]
+                }
+            })
+        return features
+
+
+def _queryset_tahun(tahun):
+    from .models import KecelakaanPreprosesing
+
+    qs = KecelakaanPreprosesing.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    if tahun:
+        qs = qs.filter(tanggal__year=tahun)
+    return qs
+
+
+_KOLOM = ('id', 'longitude', 'latitude', 'korban_meninggal', 'korban_luka_berat', 'korban_luka_ringan')
+
+
+def _ke_array(rows):
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty((0, 3), dtype=np.int64)
+    ids = np.array([r[0] for r in rows], dtype=np.int64)
+    lon = np.array([float(r[1]) for r in rows])
+    lat = np.array([float(r[2]) for r in rows])
+    korban = np.array([r[3:6] for r in rows], dtype=np.int64)
+    return ids, lon, lat, korban
+
+
+def load_indeks_klaster(tahun, versi):
+    """Bangun indeks klaster satu tahun dari seluruh baris kecelakaan"""
+    rows = list(_queryset_tahun(tahun).values_list(*_KOLOM))
+    return IndeksKlaster(*_ke_array(rows), versi=versi)
+
+
+def get_indeks_klaster(tahun):
+    """
+    Indeks klaster tahun tertentu untuk proses ini, dibangun ulang jika versi
+    kecelakaan tahun itu di VersiData sudah berubah sejak indeks dibangun
+    (perubahan di tahun lain tidak menyentuh indeks ini).
+    """
+    from .models import VersiData
+
+    # Baca versi SEBELUM load data agar indeks tidak pernah diberi label versi yang lebih baru
+    versi = VersiData.get_versi(kunci_versi_kecelakaan(tahun))
+    indeks = _indeks_klaster.get(tahun)
+    if indeks is not None and indeks.versi == versi:
+        try:
+            _indeks_klaster.move_to_end(tahun)
+        except KeyError:
+            pass
+        return indeks
+
+    with _kunci_indeks:
+        indeks = _indeks_klaster.get(tahun)
+        if indeks is None or indeks.versi != versi:
+            indeks = load_indeks_klaster(tahun, versi)
+            if not len(indeks.ids):
+                # Tahun tanpa data tidak disimpan agar cache tidak terisi tahun sembarang
+                _indeks_klaster.pop(tahun, None)
+                return indeks
+        _indeks_klaster[tahun] = indeks
+        _indeks_klaster.move_to_end(tahun)
+        while len(_indeks_klaster) > MAKS_INDEKS_KLASTER:
+            _indeks_klaster.popitem(last=False)
+    return indeks
@@ -0,0 +1,148 @@
+"""
+Utilitas single-flight lock antar proses/worker gunicorn.
+
+Di MySQL memakai advisory lock (GET_LOCK / RELEASE_LOCK) yang otomatis lepas
+jika koneksi putus. Di database lain memakai baris lock di tabel KunciProses
+dengan masa berlaku, supaya lock yatim (proses mati) bisa diambil alih.
+Waktu tunggu setiap lock dicatat di log dan statistik per proses.
+"""
+import hashlib
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Batas nama lock MySQL GET_LOCK
+PANJANG_MAKS_NAMA = 64
+
+# Masa berlaku baris lock fallback (lebih lama dari perhitungan terlama)
+TTL_KUNCI_DETIK = 600
+
+# Jeda polling baris lock fallback
+INTERVAL_POLLING_DETIK = 0.2
+
+# Statistik tunggu per nama lock di proses ini
+_statistik_kunci = {}
+
+
+class HasilKunci:
+    """Status lock yang diberikan ke blok `with single_flight(...)`"""
+
+    def __init__(self):
+        self.dapat = False
+        self.menunggu = False
+        self.waktu_tunggu = 0.0
+
+
+def _nama_kunci(nama):
+    """Nama lock unik per database; di-hash jika melebihi batas GET_LOCK"""
+    nama = f"{settings.DATABASES['default'].get('NAME')}:{nama}"
+    if len(nama) > PANJANG_MAKS_NAMA:
+        nama = hashlib.sha1(nama.encode()).hexdigest()
+    return nama
+
+
+def _catat_statistik(nama, hasil):
+    stat = _statistik_kunci.setdefault(nama, {
+        'jumlah': 0, 'menunggu': 0, 'timeout': 0, 'total_tunggu': 0.0, 'maks_tunggu': 0.0,
+    })
+    stat['jumlah'] += 1
+    stat['menunggu'] += int(hasil.menunggu)
+    stat['timeout'] += int(not hasil.dapat)
+    stat['total_tunggu'] += hasil.waktu_tunggu
+    stat['maks_tunggu'] = max(stat['maks_tunggu'], hasil.waktu_tunggu)
+
+    if not hasil.dapat:
+        logger.warning("Lock %s timeout setelah menunggu %.2fs", nama, hasil.waktu_tunggu)
+    elif hasil.menunggu:
+        logger.info("Lock %s didapat setelah menunggu %.2fs", nama, hasil.waktu_tunggu)
+
+
+def get_statistik_kunci():
+    """Salinan statistik tunggu lock di proses ini (nama -> jumlah, menunggu, timeout, total/maks tunggu)"""
+    return {nama: dict(stat) for nama, stat in _statistik_kunci.items()}
+
+
+def _mysql_ambil(nama, timeout):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", [nama, timeout])
+        return cursor.fetchone()[0] == 1
+
+
+def _mysql_lepas(nama):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", [nama])
+
+
+def _baris_ambil(nama, token, timeout):
+    from .models import KunciProses
+
+    batas = time.monotonic() + timeout
+    while True:
+        sekarang = timezone.now()
+        kedaluwarsa = sekarang + timedelta(seconds=TTL_KUNCI_DETIK)
+        try:
+            with transaction.atomic():
+                KunciProses.objects.create(nama=nama, token=token, kedaluwarsa_at=kedaluwarsa)
+            return True
+        except IntegrityError:
+            # Ambil alih lock yang pemiliknya sudah mati (lewat masa berlaku)
+            if KunciProses.objects.filter(nama=nama, kedaluwarsa_at__lt=sekarang).update(
+                token=token, kedaluwarsa_at=kedaluwarsa
+            ):
+                return True
+        if time.monotonic() >= batas:
+            return False
+        time.sleep(INTERVAL_POLLING_DETIK)
+
+
+def _baris_lepas(nama, token):
+    from .models import KunciProses
+
+    KunciProses.objects.filter(nama=nama, token=token).delete()
+
+
+@contextmanager
+def single_flight(nama, timeout=30):
+    """
+    Context manager lock eksklusif bernama antar proses.
+
+    Yield HasilKunci: `dapat` False jika lock tidak didapat dalam `timeout`
+    detik (pemanggil sebaiknya memakai hasil lama), `menunggu` True jika lock
+    sedang dipegang proses lain saat diminta (berarti proses lain baru saja
+    menjalankan pekerjaan yang sama).
+    """
+    nama = _nama_kunci(nama)
+    pakai_mysql = connection.vendor == 'mysql'
+    token = uuid.uuid4().hex
+    hasil = HasilKunci()
+
+    mulai = time.monotonic()
+    if pakai_mysql:
+        hasil.dapat = _mysql_ambil(nama, 0)
+        if not hasil.dapat:
+            hasil.menunggu = True
+            hasil.dapat = _mysql_ambil(nama, timeout)
+    else:
+        hasil.dapat = _baris_ambil(nama, token, 0)
+        if not hasil.dapat:
+            hasil.menunggu = True
+            hasil.dapat = _baris_ambil(nama, token, timeout)
+    hasil.waktu_tunggu = time.monotonic() - mulai
+    _catat_statistik(nama, hasil)
+
+    try:
+        yield hasil
+    finally:
+        if hasil.dapat:
+            if pakai_mysql:
+                _mysql_lepas(nama)
+            else:
+                _baris_lepas(nama, token)
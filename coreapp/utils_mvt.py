@@ -0,0 +1,167 @@
+"""
+Encoder Mapbox Vector Tile (MVT 2.1) pure Python.
+
+Tile dienkode langsung ke format protobuf (varint, zigzag, packed) tanpa
+library tambahan. Koordinat lon/lat diproyeksikan ke Web Mercator lalu ke
+grid tile (extent default 4096). Geometry tidak di-clip ke batas tile;
+renderer (Leaflet.VectorGrid / MapLibre) yang memotong di sisi klien.
+"""
+import math
+import struct
+
+
+# Extent standar koordinat di dalam satu tile
+EXTENT = 4096
+
+# Versi spesifikasi MVT
+VERSI_MVT = 2
+
+# Tipe geometry Feature.type
+GEOM_POINT = 1
+GEOM_LINESTRING = 2
+
+# Perintah geometry
+_CMD_MOVE_TO = 1
+_CMD_LINE_TO = 2
+
+# Batas latitude Web Mercator
+LAT_MAKS = 85.0511287798
+
+
+def bounds_tile(z, x, y):
+    """Bounding box tile (min_lon, min_lat, max_lon, max_lat) dalam derajat"""
+    n = 2 ** z
+    min_lon = x / n * 360.0 - 180.0
+    max_lon = (x + 1) / n * 360.0 - 180.0
+    max_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    min_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def tile_valid(z, x, y):
+    return 0 <= z <= 24 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def proyeksi_tile(lon, lat, z, x, y, extent=EXTENT):
+    """Proyeksi titik lon/lat ke koordinat integer di dalam tile (z, x, y)"""
+    n = 2 ** z
+    lat = max(min(lat, LAT_MAKS), -LAT_MAKS)
+    fx = (lon + 180.0) / 360.0 * n
+    fy = (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+    return int(round((fx - x) * extent)), int(round((fy - y) * extent))
+
+
+def _varint(nilai):
+    hasil = bytearray()
+    while True:
+        byte = nilai & 0x7F
+        nilai >>= 7
+        if nilai:
+            hasil.append(byte | 0x80)
+        else:
+            hasil.append(byte)
+            return bytes(hasil)
+
+
+def _zigzag(nilai):
+    return (nilai << 1) ^ (nilai >> 63)
+
+
+def _field_varint(nomor, nilai):
+    return _varint(nomor << 3) + _varint(nilai)
+
+
+def _field_bytes(nomor, isi):
+    return _varint((nomor << 3) | 2) + _varint(len(isi)) + isi
+
+
+def _field_packed(nomor, nilai_list):
+    return _field_bytes(nomor, b''.join(_varint(v) for v in nilai_list))
+
+
+def _encode_value(nilai):
+    """Layer.Value: string(1), double(3), uint(5), sint(6), bool(7)"""
+    if isinstance(nilai, bool):
+        return _field_varint(7, int(nilai))
+    if isinstance(nilai, int):
+        if nilai >= 0:
+            return _field_varint(5, nilai)
+        return _field_varint(6, _zigzag(nilai))
+    if isinstance(nilai, float):
+        return _varint((3 << 3) | 1) + struct.pack('<d', nilai)
+    return _field_bytes(1, str(nilai).encode('utf-8'))
+
+
+def _encode_geometry(tipe, titik):
+    """
+    Perintah geometry dari titik tile [(x, y), ...]. Titik berurutan yang sama
+    (setelah pembulatan) dibuang; None jika geometry jadi tidak valid.
+    """
+    bersih = []
+    for pt in titik:
+        if not bersih or pt != bersih[-1]:
+            bersih.append(pt)
+    if tipe == GEOM_LINESTRING and len(bersih) < 2:
+        return None
+    if tipe == GEOM_POINT:
+        bersih = bersih[:1]
+
+    perintah = [_CMD_MOVE_TO | (1 << 3)]
+    cx = cy = 0
+    for i, (px, py) in enumerate(bersih):
+        if i == 1:
+            perintah.append(_CMD_LINE_TO | ((len(bersih) - 1) << 3))
+        perintah.append(_zigzag(px - cx))
+        perintah.append(_zigzag(py - cy))
+        cx, cy = px, py
+    return perintah
+
+
+def encode_layer(nama, features, extent=EXTENT):
+    """
+    Encode satu layer. `features` berisi tuple (id, tipe, titik_tile, properties)
+    dengan titik_tile list (x, y) integer dan properties dict nilai skalar
+    (None dilewati).
+    """
+    keys, key_index = [], {}
+    values, value_index = [], {}
+    isi_features = []
+
+    for feature_id, tipe, titik, properties in features:
+        geometry = _encode_geometry(tipe, titik)
+        if geometry is None:
+            continue
+        tags = []
+        for key, nilai in properties.items():
+            if nilai is None:
+                continue
+            if key not in key_index:
+                key_index[key] = len(keys)
+                keys.append(key)
+            kunci_nilai = (type(nilai), nilai)
+            if kunci_nilai not in value_index:
+                value_index[kunci_nilai] = len(values)
+                values.append(nilai)
+            tags.extend((key_index[key], value_index[kunci_nilai]))
+
+        isi = _field_varint(1, feature_id) if feature_id is not None else b''
+        isi += _field_packed(2, tags) + _field_varint(3, tipe) + _field_packed(4, geometry)
+        isi_features.append(_field_bytes(2, isi))
+
+    if not isi_features:
+        return b''
+
+    isi_layer = (
+        _field_varint(15, VERSI_MVT)
+        + _field_bytes(1, nama.encode('utf-8'))
+        + b''.join(isi_features)
+        + b''.join(_field_bytes(3, k.encode('utf-8')) for k in keys)
+        + b''.join(_field_bytes(4, _encode_value(v)) for v in values)
+        + _field_varint(5, extent)
+    )
+    return _field_bytes(3, isi_layer)
+
+
+def encode_tile(layers, extent=EXTENT):
+    """Encode tile dari dict nama_layer -> features (lihat encode_layer)"""
+    return b''.join(encode_layer(nama, features, extent) for nama, features in layers.items())
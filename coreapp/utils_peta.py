@@ -0,0 +1,283 @@
+"""
+Utilitas cache respons API peta.
+
+Dokumen GeoJSON peta hanya berubah jika segmen, ruas, data kecelakaan, atau
+snapshot Z-Score berubah. Setiap sumber punya penanda versi di VersiData
+(dinaikkan oleh signal), sehingga gabungan versi tersebut menjadi ETag.
+Byte JSON yang sudah diserialisasi disimpan di cache 'peta' (file-based)
+dengan kunci ETag, dan request dengan If-None-Match / If-Modified-Since yang
+cocok dijawab 304 tanpa membangun ulang dokumen.
+"""
+import hashlib
+import json
+
+import numpy as np
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .utils_segmen import VERSI_SEGMEN, vertex_segmen
+from .utils_zscore import kunci_zscore_aktif
+
+
+# Kunci VersiData untuk data kecelakaan preprocessing dan ruas jalan
+VERSI_KECELAKAAN = 'kecelakaan'
+VERSI_RUAS = 'ruas'
+
+# Alias cache untuk dokumen peta dan vector tile (lihat CACHES di settings)
+CACHE_PETA = 'peta'
+CACHE_TILE = 'tiles'
+
+# Zoom band geometry sederhana yang di-precompute saat SegmenJalan disimpan.
+# Request dengan zoom z memakai band terkecil >= z (tidak lebih kasar dari
+# 1 pixel); di atas band terakhir geometry asli yang dipakai.
+ZOOM_BAND = (8, 11, 14)
+
+# Marker awal/akhir segmen hanya dikirim mulai zoom ini
+MARKER_MIN_ZOOM = 14
+
+
+def kunci_versi_kecelakaan(tahun):
+    """
+    Kunci VersiData titik kecelakaan satu tahun (0 = semua tahun). Hanya
+    dinaikkan saat baris kecelakaan tahun itu disimpan atau dihapus, tidak
+    saat segmen di-assign ulang secara massal.
+    """
+    return f"{VERSI_KECELAKAAN}_{int(tahun or 0)}"
+
+
+def toleransi_zoom(zoom):
+    """Toleransi Douglas-Peucker (derajat) = lebar 1 pixel tile 256px pada zoom tersebut"""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def band_zoom(zoom):
+    """Zoom band precompute untuk zoom request, atau None jika perlu geometry penuh"""
+    for band in ZOOM_BAND:
+        if zoom <= band:
+            return band
+    return None
+
+
+def sederhanakan_garis(coords, toleransi):
+    """
+    Sederhanakan polyline [[lon, lat], ...] dengan algoritma Douglas-Peucker
+    (iteratif, jarak tegak lurus planar dalam derajat). Titik awal dan akhir
+    selalu dipertahankan.
+    """
+    if len(coords) <= 2:
+        return [list(pt) for pt in coords]
+
+    titik = np.asarray(coords, dtype=np.float64)
+    simpan = np.zeros(len(titik), dtype=bool)
+    simpan[0] = simpan[-1] = True
+    tumpukan = [(0, len(titik) - 1)]
+
+    while tumpukan:
+        awal, akhir = tumpukan.pop()
+        if akhir - awal < 2:
+            continue
+        a, b = titik[awal], titik[akhir]
+        tengah = titik[awal + 1:akhir]
+        ab = b - a
+        panjang = np.hypot(ab[0], ab[1])
+        if panjang == 0:
+            jarak = np.hypot(tengah[:, 0] - a[0], tengah[:, 1] - a[1])
+        else:
+            jarak = np.abs(ab[0] * (tengah[:, 1] - a[1]) - ab[1] * (tengah[:, 0] - a[0])) / panjang
+        i = int(np.argmax(jarak))
+        if jarak[i] > toleransi:
+            indeks = awal + 1 + i
+            simpan[indeks] = True
+            tumpukan.append((awal, indeks))
+            tumpukan.append((indeks, akhir))
+
+    return titik[simpan].tolist()
+
+
+def hitung_geometry_peta(lat_awal, lon_awal, lat_akhir, lon_akhir, geometry):
+    """
+    Precompute data peta satu segmen: bounding box dan geometry sederhana per
+    zoom band. Mengembalikan (bbox, band_json) dengan bbox =
+    (min_lat, max_lat, min_lon, max_lon), atau (None, None) jika segmen tidak
+    punya geometry maupun koordinat lengkap.
+    """
+    vertices = vertex_segmen(lat_awal, lon_awal, lat_akhir, lon_akhir, geometry)
+    if not vertices:
+        return None, None
+
+    coords = [[lon, lat] for lat, lon in vertices]
+    lats = [lat for lat, _ in vertices]
+    lons = [lon for _, lon in vertices]
+    bbox = (min(lats), max(lats), min(lons), max(lons))
+    band = {
+        str(zoom): sederhanakan_garis(coords, toleransi_zoom(zoom))
+        for zoom in ZOOM_BAND
+    }
+    return bbox, json.dumps(band, separators=(',', ':'))
+
+
+# Field yang bisa dipilih lewat ?fields= pada format compact api_segmen_geojson
+FIELD_KOMPAK_SEGMEN = (
+    'ruas_id', 'km_awal', 'km_akhir', 'panjang', 'kategori', 'zscore', 'color',
+    'accident_count', 'nama_segmen', 'keterangan', 'url', 'geometry',
+)
+
+# Presisi encoded polyline (5 desimal ~ 1,1 m)
+PRESISI_POLYLINE = 5
+
+
+def encode_polyline(coords, presisi=PRESISI_POLYLINE):
+    """
+    Encode [[lon, lat], ...] ke format Encoded Polyline Google (urutan lat,lon,
+    delta integer terkuantisasi 10^presisi).
+    """
+    faktor = 10 ** presisi
+    hasil = []
+    lat_lama = lon_lama = 0
+    for pt in coords:
+        lat = int(round(pt[1] * faktor))
+        lon = int(round(pt[0] * faktor))
+        for delta in (lat - lat_lama, lon - lon_lama):
+            nilai = ~(delta << 1) if delta < 0 else delta << 1
+            while nilai >= 0x20:
+                hasil.append(chr((0x20 | (nilai & 0x1F)) + 63))
+                nilai >>= 5
+            hasil.append(chr(nilai + 63))
+        lat_lama, lon_lama = lat, lon
+    return ''.join(hasil)
+
+
+def kompak_segmen_geojson(geojson, fields=FIELD_KOMPAK_SEGMEN, presisi=PRESISI_POLYLINE):
+    """
+    Ubah FeatureCollection api_segmen_geojson ke format compact:
+    - satu baris per segmen (`segmen`), kolom sesuai `fields` dengan
+      segmen_id selalu di depan; geometry sebagai encoded polyline
+    - marker awal/akhir segmen tidak dikirim ulang: posisinya titik pertama/
+      terakhir geometry dan propertinya baris segmen yang sama
+      (`marker_segmen` False jika marker memang tidak ditampilkan)
+    - nama dan marker awal/akhir ruas dikirim sekali per ruas (`ruas`)
+    """
+    kolom = ['segmen_id'] + list(fields)
+    faktor = 10 ** presisi
+    baris = []
+    ruas = {}
+    ada_marker_segmen = False
+
+    for feature in geojson['features']:
+        properties = feature['properties']
+        jenis = properties.get('marker_type')
+        if properties['type'] == 'line':
+            row = []
+            for field in kolom:
+                if field == 'geometry':
+                    row.append(encode_polyline(feature['geometry']['coordinates'], presisi))
+                else:
+                    row.append(properties.get(field))
+            baris.append(row)
+            ruas.setdefault(properties['ruas_id'], {'nama': properties['ruas_nama']})
+        elif jenis in ('ruas_start', 'ruas_end'):
+            info = ruas.setdefault(properties['ruas_id'], {'nama': properties['ruas_nama']})
+            lon, lat = feature['geometry']['coordinates'][:2]
+            info['awal' if jenis == 'ruas_start' else 'akhir'] = [round(lon * faktor), round(lat * faktor)]
+        else:
+            ada_marker_segmen = True
+
+    return {
+        'format': 'compact',
+        'tahun': geojson.get('tahun'),
+        'status_data': geojson.get('status_data'),
+        'presisi': presisi,
+        'fields': kolom,
+        'segmen': baris,
+        # Koordinat marker ruas dalam integer [lon, lat] * 10^presisi
+        'ruas': ruas,
+        'marker_segmen': ada_marker_segmen,
+    }
+
+
+def versi_data_peta(tahun, sumber=(VERSI_SEGMEN, VERSI_RUAS, VERSI_KECELAKAAN)):
+    """
+    Versi gabungan data sumber peta untuk satu tahun (satu query).
+    Mengembalikan (penanda_versi, last_modified) di mana last_modified adalah
+    waktu perubahan terakhir salah satu sumber (None jika belum pernah berubah).
+    """
+    from .models import VersiData
+
+    kunci = list(sumber) + [kunci_zscore_aktif(tahun)]
+    baris = {
+        k: (versi, updated_at)
+        for k, versi, updated_at in VersiData.objects.filter(kunci__in=kunci).values_list('kunci', 'versi', 'updated_at')
+    }
+    penanda = ':'.join(f"{k}={baris.get(k, (0, None))[0]}" for k in kunci)
+    waktu = [updated_at for _, updated_at in baris.values() if updated_at]
+    return penanda, max(waktu) if waktu else None
+
+
+def respons_json_cache(request, nama, tahun, bangun, varian='', sumber=None, simpan_cache=True):
+    """
+    Respons JSON dengan cache dokumen dan ETag/Last-Modified.
+
+    Args:
+        nama: nama endpoint (bagian kunci cache)
+        tahun: tahun data yang diminta
+        bangun: callable tanpa argumen yang mengembalikan dict dokumen JSON
+        varian: string tambahan pembeda dokumen (misalnya parameter query)
+        sumber: daftar kunci VersiData sumber data (default: semua sumber peta)
+        simpan_cache: False untuk dokumen yang jarang diminta ulang persis sama
+            (misalnya per viewport); ETag/304 tetap berlaku
+    """
+    return respons_cache(
+        request, nama, tahun,
+        lambda: json.dumps(bangun(), separators=(',', ':'), ensure_ascii=False).encode('utf-8'),
+        'application/json', varian=varian, sumber=sumber, simpan_cache=simpan_cache,
+    )
+
+
+def _etag_peta(nama, tahun, varian, sumber):
+    """ETag dokumen peta dari versi data sumber dan status antrian Z-Score, beserta last_modified"""
+    from .models import AntrianZScore
+
+    penanda, last_modified = versi_data_peta(tahun, **({'sumber': sumber} if sumber else {}))
+    status_data = AntrianZScore.status_data(tahun)
+    etag = hashlib.sha1(
+        f"{nama}|{tahun}|{varian}|{penanda}|{status_data}".encode()
+    ).hexdigest()[:32]
+    return etag, last_modified.timestamp() if last_modified else None
+
+
+def respons_cache(request, nama, tahun, bangun, content_type, varian='', sumber=None,
+                  simpan_cache=True, alias_cache=CACHE_PETA):
+    """
+    Seperti respons_json_cache, tetapi `bangun` mengembalikan byte isi respons
+    (misalnya vector tile) dan disimpan di cache `alias_cache`.
+
+    Jika versi data berubah selama `bangun()` berjalan (misalnya builder
+    memicu calculate_zscore yang memindahkan pointer versi), dokumen tidak
+    disimpan ke cache dan dikirim tanpa ETag/Last-Modified, karena tidak
+    jelas versi mana yang dicerminkannya.
+    """
+    etag, last_modified_ts = _etag_peta(nama, tahun, varian, sumber)
+
+    # If-None-Match / If-Modified-Since cocok -> 304 Not Modified
+    respons = get_conditional_response(request, etag=quote_etag(etag), last_modified=last_modified_ts)
+    if respons is None:
+        cache = caches[alias_cache]
+        kunci_cache = f"{nama}:{etag}"
+        isi = cache.get(kunci_cache) if simpan_cache else None
+        if isi is None:
+            isi = bangun()
+            if _etag_peta(nama, tahun, varian, sumber)[0] != etag:
+                etag = last_modified_ts = None
+            elif simpan_cache:
+                cache.set(kunci_cache, isi)
+        respons = HttpResponse(isi, content_type=content_type)
+
+    if etag:
+        respons['ETag'] = quote_etag(etag)
+    if last_modified_ts:
+        respons['Last-Modified'] = http_date(last_modified_ts)
+    # Browser boleh menyimpan, tapi wajib validasi ulang (murah: 304)
+    respons['Cache-Control'] = 'no-cache'
+    return respons
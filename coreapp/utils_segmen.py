@@ -0,0 +1,403 @@
+"""
+Utilitas pencocokan titik kecelakaan ke segmen jalan.
+
+Spatial index berbasis grid bucket atas bounding box SegmenJalan, supaya
+find_closest_segment hanya mengecek segmen di sekitar titik kecelakaan,
+bukan seluruh isi tabel SegmenJalan. Pencocokan memakai geometry polyline
+segmen (LineString Geoapify) yang sudah di-precompute menjadi array vertex.
+Semua data segmen disimpan dalam satu snapshot per proses (SegmenSnapshot)
+yang dibangun ulang hanya jika versi tabel SegmenJalan berubah.
+Matcher yang sama juga bisa mencocokkan banyak titik sekaligus per sel
+grid (dipakai command reassign).
+"""
+import json
+import math
+from collections import defaultdict
+
+import numpy as np
+
+
+R_BUMI_KM = 6371  # Earth radius in km
+KM_PER_DERAJAT = R_BUMI_KM * math.pi / 180
+
+# Versi algoritma matcher yang disimpan di kolom versi_matcher data kecelakaan:
+# 1 = garis lurus titik awal -> akhir (engine lama, sudah dihapus)
+# 2 = polyline geometry segmen (find_closest_segment, signal segmen baru, command reassign)
+VERSI_MATCHER = 2
+
+# Tolerance jarak perpendicular titik kecelakaan ke segmen: ~50 meter
+TOLERANCE_KM = 0.050
+
+# Buffer bounding box segmen (sama dengan quick check di find_closest_segment)
+BBOX_BUFFER = 0.001  # ~111 meter
+
+# Ukuran sel grid dalam derajat (~1.1 km). Segmen dimasukkan ke semua sel
+# yang dilalui bounding box-nya, jadi lookup cukup membaca satu sel.
+GRID_CELL_SIZE = 0.01
+
+# Kunci VersiData untuk tabel SegmenJalan
+VERSI_SEGMEN = 'segmen'
+
+_segmen_snapshot = None
+
+
+class SegmenGridIndex:
+    """
+    Grid bucket atas bounding box (min_lat, max_lat, min_lon, max_lon) yang sudah di-buffer.
+
+    Posisi bounding box di list input dipakai sebagai id entry, sehingga urutan
+    kandidat mengikuti urutan default queryset SegmenJalan (tie-break sama dengan
+    iterasi penuh).
+    """
+
+    def __init__(self, bboxes, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.bboxes = list(bboxes)
+        self.buckets = defaultdict(list)
+
+        for posisi, (min_lat, max_lat, min_lon, max_lon) in enumerate(self.bboxes):
+            for cell in self._cells_for_bbox(min_lat, max_lat, min_lon, max_lon):
+                self.buckets[cell].append(posisi)
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_size), math.floor(lon / self.cell_size))
+
+    def _cells_for_bbox(self, min_lat, max_lat, min_lon, max_lon):
+        row_min, col_min = self._cell(min_lat, min_lon)
+        row_max, col_max = self._cell(max_lat, max_lon)
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                yield (row, col)
+
+    def kandidat(self, lat, lon):
+        """Kembalikan posisi entry yang bounding box-nya memuat titik (lat, lon), urut sesuai input"""
+        hasil = []
+        for posisi in self.buckets.get(self._cell(lat, lon), ()):
+            min_lat, max_lat, min_lon, max_lon = self.bboxes[posisi]
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                hasil.append(posisi)
+        hasil.sort()
+        return hasil
+
+
+def parse_vertex_geometry(geometry):
+    """
+    Ambil daftar vertex [(lat, lon), ...] dari string GeoJSON segmen.
+    Mendukung Feature, LineString dan MultiLineString (digabung berurutan).
+    Mengembalikan list kosong jika geometry tidak valid.
+    """
+    if not geometry:
+        return []
+    try:
+        geom = json.loads(geometry) if isinstance(geometry, str) else geometry
+        if geom.get('type') == 'Feature':
+            geom = geom.get('geometry') or {}
+        coords = geom.get('coordinates') or []
+        if geom.get('type') == 'MultiLineString':
+            coords = [pt for line in coords for pt in line]
+        return [
+            (float(pt[1]), float(pt[0])) for pt in coords
+            if isinstance(pt, (list, tuple)) and len(pt) >= 2
+        ]
+    except (ValueError, TypeError, AttributeError):
+        return []
+
+
+class SegmenPolylineMatcher:
+    """
+    Matcher titik -> segmen berbasis geometry polyline.
+
+    Vertex seluruh segmen disimpan berurutan di array float64 (`v_lat`, `v_lon`,
+    `v_km`), dengan `offsets[i]:offsets[i + 1]` sebagai rentang vertex segmen ke-i.
+    `v_km` adalah jarak kumulatif (haversine) dari vertex pertama segmen.
+    Segmen tanpa geometry memakai garis lurus titik awal -> titik akhir.
+    """
+
+    def __init__(self, rows, buffer=BBOX_BUFFER, cell_size=GRID_CELL_SIZE):
+        self.segmen_ids = []
+        offsets = [0]
+        lat_parts = []
+        lon_parts = []
+        bboxes = []
+
+        for segmen_id, vertices in rows:
+            if len(vertices) < 2:
+                continue
+            lats = np.array([v[0] for v in vertices], dtype=np.float64)
+            lons = np.array([v[1] for v in vertices], dtype=np.float64)
+
+            self.segmen_ids.append(segmen_id)
+            lat_parts.append(lats)
+            lon_parts.append(lons)
+            offsets.append(offsets[-1] + len(vertices))
+            bboxes.append((
+                lats.min() - buffer, lats.max() + buffer,
+                lons.min() - buffer, lons.max() + buffer,
+            ))
+
+        self.offsets = np.array(offsets, dtype=np.int64)
+        if lat_parts:
+            self.v_lat = np.concatenate(lat_parts)
+            self.v_lon = np.concatenate(lon_parts)
+        else:
+            self.v_lat = np.empty(0, dtype=np.float64)
+            self.v_lon = np.empty(0, dtype=np.float64)
+
+        # Panjang tiap sub-segmen (vertex j -> j+1) dan jarak kumulatif per segmen
+        self.sub_km = np.zeros(len(self.v_lat), dtype=np.float64)
+        if len(self.v_lat) > 1:
+            lat1, lon1 = np.radians(self.v_lat[:-1]), np.radians(self.v_lon[:-1])
+            lat2, lon2 = np.radians(self.v_lat[1:]), np.radians(self.v_lon[1:])
+            a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+            self.sub_km[:-1] = R_BUMI_KM * 2 * np.arcsin(np.sqrt(a))
+            # Vertex terakhir tiap segmen bukan awal sub-segmen
+            self.sub_km[self.offsets[1:] - 1] = 0.0
+        self.v_km = np.zeros(len(self.v_lat), dtype=np.float64)
+        for i in range(len(self.segmen_ids)):
+            start, stop = self.offsets[i], self.offsets[i + 1]
+            self.v_km[start + 1:stop] = np.cumsum(self.sub_km[start:stop - 1])
+
+        self.index = SegmenGridIndex(bboxes, cell_size=cell_size)
+        self.bbox_array = np.array(bboxes, dtype=np.float64).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.segmen_ids)
+
+    def match(self, lat, lon, tolerance_km):
+        """
+        Cari segmen terdekat dari titik (lat, lon).
+
+        Titik diproyeksikan ke setiap sub-segmen polyline kandidat (proyeksi
+        equirectangular lokal, akurat untuk jarak puluhan meter). Mengembalikan
+        (segmen_id, jarak_km, posisi_km) dengan posisi_km = jarak sepanjang
+        geometry dari awal segmen, atau None jika tidak ada yang <= tolerance_km.
+        """
+        kandidat = self.index.kandidat(lat, lon)
+        if not kandidat:
+            return None
+
+        # Kumpulkan semua sub-segmen milik kandidat
+        starts = []
+        owners = []
+        for posisi in kandidat:
+            start, stop = self.offsets[posisi], self.offsets[posisi + 1]
+            starts.append(np.arange(start, stop - 1))
+            owners.append(np.full(stop - 1 - start, posisi, dtype=np.int64))
+        starts = np.concatenate(starts)
+        owners = np.concatenate(owners)
+
+        # Proyeksi lokal (km) dengan titik kecelakaan sebagai origin
+        skala_lon = math.cos(math.radians(lat)) * KM_PER_DERAJAT
+        ax = (self.v_lon[starts] - lon) * skala_lon
+        ay = (self.v_lat[starts] - lat) * KM_PER_DERAJAT
+        bx = (self.v_lon[starts + 1] - lon) * skala_lon
+        by = (self.v_lat[starts + 1] - lat) * KM_PER_DERAJAT
+
+        dx = bx - ax
+        dy = by - ay
+        panjang2 = dx * dx + dy * dy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(panjang2 > 0, -(ax * dx + ay * dy) / panjang2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        jarak = np.hypot(ax + t * dx, ay + t * dy)
+
+        # Jarak terkecil; tie -> segmen dengan urutan lebih awal
+        terbaik = np.lexsort((owners, jarak))[0]
+        if jarak[terbaik] > tolerance_km:
+            return None
+
+        posisi = owners[terbaik]
+        sub = starts[terbaik]
+        posisi_km = self.v_km[sub] + t[terbaik] * self.sub_km[sub]
+        return self.segmen_ids[posisi], float(jarak[terbaik]), float(posisi_km)
+
+    def match_batch(self, lats, lons, tolerance_km, batch_size=1000):
+        """
+        Versi banyak titik dari match(): titik dikelompokkan per sel grid, lalu
+        jarak setiap titik ke semua sub-segmen kandidat sel tersebut dihitung
+        sebagai satu matriks (maksimal `batch_size` titik per matriks).
+        Aturan kandidat, jarak, dan tie-break sama persis dengan match().
+
+        Mengembalikan array (segmen_id, jarak_km, posisi_km); segmen_id -1
+        berarti tidak ada segmen <= tolerance_km.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        n = len(lats)
+        hasil_id = np.full(n, -1, dtype=np.int64)
+        hasil_jarak = np.full(n, np.nan)
+        hasil_posisi = np.full(n, np.nan)
+        if n == 0 or not len(self):
+            return hasil_id, hasil_jarak, hasil_posisi
+
+        segmen_ids = np.asarray(self.segmen_ids, dtype=np.int64)
+        rows = np.floor(lats / self.index.cell_size).astype(np.int64)
+        cols = np.floor(lons / self.index.cell_size).astype(np.int64)
+        sel_unik, grup = np.unique(np.stack([rows, cols], axis=1), axis=0, return_inverse=True)
+        grup = grup.reshape(-1)
+        batch_size = max(int(batch_size), 1)
+
+        for g, (row, col) in enumerate(sel_unik):
+            bucket = self.index.buckets.get((int(row), int(col)))
+            if not bucket:
+                continue
+            posisi_list = sorted(bucket)
+            starts = np.concatenate([
+                np.arange(self.offsets[p], self.offsets[p + 1] - 1) for p in posisi_list
+            ])
+            owners = np.concatenate([
+                np.full(self.offsets[p + 1] - 1 - self.offsets[p], p, dtype=np.int64) for p in posisi_list
+            ])
+            bb = self.bbox_array[owners]
+
+            anggota = np.flatnonzero(grup == g)
+            for awal in range(0, len(anggota), batch_size):
+                idx = anggota[awal:awal + batch_size]
+                lat = lats[idx][:, None]
+                lon = lons[idx][:, None]
+
+                skala_lon = np.cos(np.radians(lat)) * KM_PER_DERAJAT
+                ax = (self.v_lon[starts] - lon) * skala_lon
+                ay = (self.v_lat[starts] - lat) * KM_PER_DERAJAT
+                bx = (self.v_lon[starts + 1] - lon) * skala_lon
+                by = (self.v_lat[starts + 1] - lat) * KM_PER_DERAJAT
+
+                dx = bx - ax
+                dy = by - ay
+                panjang2 = dx * dx + dy * dy
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    t = np.where(panjang2 > 0, -(ax * dx + ay * dy) / panjang2, 0.0)
+                t = np.clip(t, 0.0, 1.0)
+                jarak = np.hypot(ax + t * dx, ay + t * dy)
+
+                # Hanya segmen yang bounding box-nya memuat titik (sama dengan index.kandidat)
+                di_bbox = (bb[:, 0] <= lat) & (lat <= bb[:, 1]) & (bb[:, 2] <= lon) & (lon <= bb[:, 3])
+                jarak = np.where(di_bbox, jarak, np.inf)
+
+                # Kolom urut (segmen, sub-segmen): argmin mengambil segmen lebih awal saat tie
+                terbaik = np.argmin(jarak, axis=1)
+                baris = np.arange(len(idx))
+                jarak_terbaik = jarak[baris, terbaik]
+                cocok = jarak_terbaik <= tolerance_km
+                if not cocok.any():
+                    continue
+
+                sub = starts[terbaik[cocok]]
+                tujuan = idx[cocok]
+                hasil_id[tujuan] = segmen_ids[owners[terbaik[cocok]]]
+                hasil_jarak[tujuan] = jarak_terbaik[cocok]
+                hasil_posisi[tujuan] = self.v_km[sub] + t[baris[cocok], terbaik[cocok]] * self.sub_km[sub]
+
+        return hasil_id, hasil_jarak, hasil_posisi
+
+
+def vertex_segmen(lat1, lon1, lat2, lon2, geometry):
+    """Vertex polyline satu segmen; fallback ke garis titik awal -> akhir jika geometry kosong"""
+    vertices = parse_vertex_geometry(geometry)
+    if len(vertices) < 2:
+        if not (lat1 and lon1 and lat2 and lon2):
+            return []
+        vertices = [(float(lat1), float(lon1)), (float(lat2), float(lon2))]
+    return vertices
+
+
+class SegmenSnapshot:
+    """
+    Snapshot ringkas seluruh SegmenJalan dalam array float64, dipakai bersama oleh
+    find_closest_segment, command reassign/assign, dan signal.
+
+    - `ids`, `ruas_ids`: id segmen dan id ruas (urut sesuai queryset default)
+    - `km_awal`: posisi km awal segmen pada ruas
+    - `lat_awal`, `lon_awal`, `lat_akhir`, `lon_akhir`: titik awal/akhir (NaN jika kosong)
+    - `lengkap`: mask segmen yang keempat koordinatnya terisi
+    - `min_lat`, `max_lat`, `min_lon`, `max_lon`: bounding box titik awal/akhir + buffer
+    - `matcher`: SegmenPolylineMatcher atas geometry segmen
+    """
+
+    def __init__(self, rows, versi=0, buffer=BBOX_BUFFER):
+        self.versi = versi
+        n = len(rows)
+        self.ids = np.empty(n, dtype=np.int64)
+        self.ruas_ids = np.empty(n, dtype=np.int64)
+        self.km_awal = np.zeros(n, dtype=np.float64)
+        coords = np.full((n, 4), np.nan, dtype=np.float64)
+        polylines = []
+
+        for i, (segmen_id, ruas_id, km_awal, lat1, lon1, lat2, lon2, geometry) in enumerate(rows):
+            self.ids[i] = segmen_id
+            self.ruas_ids[i] = ruas_id
+            self.km_awal[i] = float(km_awal or 0)
+            if lat1 and lon1 and lat2 and lon2:
+                coords[i] = (float(lat1), float(lon1), float(lat2), float(lon2))
+            vertices = vertex_segmen(lat1, lon1, lat2, lon2, geometry)
+            if vertices:
+                polylines.append((segmen_id, vertices))
+
+        self.lat_awal, self.lon_awal, self.lat_akhir, self.lon_akhir = coords.T
+        self.lengkap = ~np.isnan(coords).any(axis=1)
+        self.min_lat = np.fmin(self.lat_awal, self.lat_akhir) - buffer
+        self.max_lat = np.fmax(self.lat_awal, self.lat_akhir) + buffer
+        self.min_lon = np.fmin(self.lon_awal, self.lon_akhir) - buffer
+        self.max_lon = np.fmax(self.lon_awal, self.lon_akhir) + buffer
+        self.matcher = SegmenPolylineMatcher(polylines, buffer=buffer)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def titik_ujung(self):
+        """(ids, lat_awal, lon_awal, lat_akhir, lon_akhir) untuk segmen dengan koordinat lengkap"""
+        m = self.lengkap
+        return self.ids[m], self.lat_awal[m], self.lon_awal[m], self.lat_akhir[m], self.lon_akhir[m]
+
+
+def load_segmen_snapshot(versi=0):
+    """Bangun SegmenSnapshot dari database (satu query)"""
+    from .models import SegmenJalan
+
+    rows = list(SegmenJalan.objects.values_list(
+        'id', 'ruas_jalan_id', 'km_awal', 'lat_awal', 'lon_awal', 'lat_akhir', 'lon_akhir', 'geometry'
+    ))
+    return SegmenSnapshot(rows, versi=versi)
+
+
+def get_segmen_snapshot():
+    """
+    Kembalikan snapshot segmen untuk proses ini. Snapshot dibangun ulang hanya jika
+    versi 'segmen' di VersiData sudah berubah (dinaikkan signal save/delete SegmenJalan),
+    jadi perubahan dari worker lain juga terdeteksi.
+    """
+    global _segmen_snapshot
+    from .models import VersiData
+
+    # Baca versi SEBELUM load data agar snapshot tidak pernah diberi label versi yang lebih baru
+    versi = VersiData.get_versi(VERSI_SEGMEN)
+    snapshot = _segmen_snapshot
+    if snapshot is None or snapshot.versi != versi:
+        snapshot = load_segmen_snapshot(versi)
+        _segmen_snapshot = snapshot
+    return snapshot
+
+
+def get_segmen_matcher():
+    """Matcher polyline dari snapshot segmen terkini"""
+    return get_segmen_snapshot().matcher
+
+
+def invalidate_segmen_snapshot():
+    """Naikkan versi segmen dan buang snapshot lokal agar dibangun ulang pada lookup berikutnya"""
+    global _segmen_snapshot
+    from .models import VersiData
+
+    VersiData.naikkan(VERSI_SEGMEN)
+    _segmen_snapshot = None
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Jarak haversine (km) dari titik (lat, lon) ke array titik (lats, lons)"""
+    lat = np.radians(lat)
+    lats = np.radians(lats)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((np.radians(lons) - np.radians(lon)) / 2) ** 2
+    return R_BUMI_KM * 2 * np.arcsin(np.sqrt(a))
@@ -0,0 +1,85 @@
+"""
+Utilitas perhitungan Z-Score kerawanan segmen per ruas jalan.
+
+Engine NumPy yang menghitung rata-rata, standar deviasi, Z-Score, Z_min/Z_max
+dan kategori interval dinamis untuk semua segmen dari semua ruas sekaligus
+(groupby per ruas_jalan_id), menggantikan loop query per ruas.
+"""
+import numpy as np
+
+
+# Urutan kategori dari kelas interval terendah ke tertinggi
+KATEGORI_KELAS = ['sangat_rendah', 'rendah', 'sedang', 'tinggi', 'sangat_tinggi']
+
+# Jumlah kelas untuk Interval: I = (Z_max - Z_min) / Jumlah_Kelas
+JUMLAH_KELAS = len(KATEGORI_KELAS)
+
+# Kunci VersiData: urutan nomor snapshot Z-Score (global) dan pointer
+# snapshot aktif per tahun ('zscore_<tahun>')
+VERSI_ZSCORE = 'zscore'
+KUNCI_ZSCORE_AKTIF = 'zscore_'
+
+
+def kunci_zscore_aktif(tahun):
+    return f"{KUNCI_ZSCORE_AKTIF}{tahun}"
+
+
+def hitung_zscore_per_ruas(ruas_ids, jumlah):
+    """
+    Hitung Z-Score dan kelas kategori setiap segmen, dikelompokkan per ruas.
+
+    Args:
+        ruas_ids: array ruas_jalan_id per segmen
+        jumlah: array jumlah kecelakaan per segmen (urutan sama dengan ruas_ids)
+
+    Returns:
+        (zscore, kelas, statistik)
+        - zscore: array float64 Z-Score per segmen
+        - kelas: array int 0..4 (indeks KATEGORI_KELAS) per segmen
+        - statistik: dict ruas_jalan_id -> dict(jumlah_segmen, mean, stddev,
+          z_min, z_max, interval, thresholds)
+    """
+    ruas_ids = np.asarray(ruas_ids)
+    x = np.asarray(jumlah, dtype=np.float64)
+    if not len(x):
+        return np.empty(0), np.empty(0, dtype=np.int64), {}
+
+    ruas_unik, grup, n = np.unique(ruas_ids, return_inverse=True, return_counts=True)
+
+    # Rata-rata (μ) dan standar deviasi populasi (σ) per ruas
+    mean = np.bincount(grup, weights=x) / n
+    selisih = x - mean[grup]
+    stddev = np.sqrt(np.bincount(grup, weights=selisih * selisih) / n)
+    # Hindari pembagian dengan nol jika semua segmen dalam ruas bernilai sama
+    stddev[stddev == 0] = 1
+
+    # Rumus: Z = (X - μ) / σ
+    zscore = selisih / stddev[grup]
+
+    z_min = np.full(len(ruas_unik), np.inf)
+    z_max = np.full(len(ruas_unik), -np.inf)
+    np.minimum.at(z_min, grup, zscore)
+    np.maximum.at(z_max, grup, zscore)
+
+    # Interval dinamis, default 1 jika semua nilai Z-Score sama
+    interval = np.where(z_max != z_min, (z_max - z_min) / JUMLAH_KELAS, 1.0)
+
+    # Threshold ke-1..4: Z_min + k * I (batas antar kelas)
+    thresholds = z_min[:, None] + np.arange(1, JUMLAH_KELAS) * interval[:, None]
+
+    # Kelas = jumlah threshold yang dilewati (setara if/elif dari atas ke bawah)
+    kelas = (zscore[:, None] >= thresholds[grup]).sum(axis=1)
+
+    statistik = {
+        ruas_id.item(): {
+            'jumlah_segmen': int(n[i]),
+            'mean': float(mean[i]),
+            'stddev': float(stddev[i]),
+            'z_min': float(z_min[i]),
+            'z_max': float(z_max[i]),
+            'interval': float(interval[i]),
+            'thresholds': [float(t) for t in thresholds[i]],
+        }
+        for i, ruas_id in enumerate(ruas_unik)
+    }
+    return zscore, kelas, statistik
@@ -3,7 +3,7 @@ from django.views.decorators.http import require_POST
 from django.contrib.auth import authenticate, login, logout, get_user_model
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse, Http404
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
 from django.views.generic import (
     ListView, DetailView, CreateView, UpdateView, DeleteView
 )
@@ -14,7 +14,7 @@ from django.utils import timezone
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from .models import (
-    RuasJalan, SegmenJalan, Kecelakaan, AnalisisZScore, RekapSegmen,
+    RuasJalan, SegmenJalan, Kecelakaan, AnalisisZScore, RekapSegmen, AntrianZScore,
     Kota, Kecamatan, Kelurahan, ClusterData, AIConfig, Profile, Polres, Polda,
     KecelakaanRaw, KecelakaanPreprosesing, LakaMentah
 )
@@ -44,6 +44,16 @@ from .forms import (
     RuasJalanForm, SegmenJalanForm,
     KecelakaanForm, RekapSegmenForm, UploadKecelakaanRawForm, UploadKecelakaanPreprosesForm
 )
+from .utils_peta import (
+    respons_json_cache, respons_cache, kompak_segmen_geojson, band_zoom,
+    MARKER_MIN_ZOOM, CACHE_TILE, FIELD_KOMPAK_SEGMEN,
+    VERSI_KECELAKAAN, VERSI_RUAS,
+)
+from .utils_mvt import encode_tile, bounds_tile, tile_valid, proyeksi_tile, GEOM_POINT, GEOM_LINESTRING
+from .utils_klaster import get_indeks_klaster
+from .utils_geometri import geometri_segmen, geometri_ruas
+from .utils_segmen import VERSI_SEGMEN
+from .utils_zscore import KATEGORI_KELAS
 
 User = get_user_model()
 
@@ -845,8 +855,7 @@ def map_view(request):
             # 🔥 Hitung Z-Score dari SEMUA DATA
             AnalisisZScore.calculate_zscore_all_years()
         else:
-            if not AnalisisZScore.objects.filter(tahun=tahun).exists():
-                AnalisisZScore.calculate_zscore(tahun)
+            AnalisisZScore.pastikan_zscore(tahun)
     except Exception as e:
         print(f"Warning: Z-Score calculation failed: {e}")
 
@@ -870,10 +879,9 @@ def peta_user_view(request):
     else:
         tahun = 0  # Semua tahun
     
-    # Hitung Z-Score jika belum ada
+    # Hitung Z-Score jika belum ada (single-flight antar worker)
     try:
-        if not AnalisisZScore.objects.filter(tahun=tahun).exists():
-            AnalisisZScore.calculate_zscore(tahun)
+        AnalisisZScore.pastikan_zscore(tahun)
     except Exception as e:
         print(f"Warning: Could not calculate Z-Score for {tahun}: {e}")
     
@@ -901,75 +909,204 @@ def api_segmen_geojson(request):
     print(f"📍 API: api_segmen_geojson called for tahun={tahun}")
     print(f"{'='*80}")
     
-    # Ensure Z-Score calculation exists for this year
-    if not AnalisisZScore.objects.filter(tahun=tahun).exists():
-        try:
-            AnalisisZScore.calculate_zscore(tahun)
+    # Ensure Z-Score calculation exists for this year (single-flight antar worker)
+    try:
+        if AnalisisZScore.pastikan_zscore(tahun):
             print(f"✓ Auto-calculated Z-Score for {tahun}")
+    except Exception as e:
+        print(f"⚠ Could not auto-calculate Z-Score: {e}")
+    
+    # Varian viewport: ?bbox=minLon,minLat,maxLon,maxLat dan/atau ?zoom=
+    bbox = None
+    zoom = None
+    try:
+        if request.GET.get('bbox'):
+            bbox = [float(v) for v in request.GET['bbox'].split(',')]
+            if len(bbox) != 4:
+                raise ValueError('bbox harus berisi 4 nilai')
+        if request.GET.get('zoom'):
+            zoom = int(float(request.GET['zoom']))
+    except (ValueError, TypeError) as e:
+        return Response({'error': f'Parameter bbox/zoom tidak valid: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Format compact: ?compact=1 dan opsional ?fields=kategori,zscore,geometry
+    compact = request.GET.get('compact') in ('1', 'true')
+    fields = FIELD_KOMPAK_SEGMEN
+    if request.GET.get('fields'):
+        fields = tuple(f for f in request.GET['fields'].split(',') if f and f != 'segmen_id')
+        tidak_dikenal = [f for f in fields if f not in FIELD_KOMPAK_SEGMEN]
+        if tidak_dikenal:
+            return Response(
+                {'error': f"Field tidak dikenal: {', '.join(tidak_dikenal)}", 'fields': list(FIELD_KOMPAK_SEGMEN)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    if bbox is not None or zoom is not None:
+        band = band_zoom(zoom) if zoom is not None else None
+        varian = f"{','.join(f'{v:.5f}' for v in bbox) if bbox else '-'}|{zoom}|{band}"
+        bangun = lambda: _bangun_segmen_geojson_viewport(tahun, bbox, zoom)
+        nama = 'segmen_geojson_viewport'
+        simpan_cache = False
+    else:
+        # Dokumen GeoJSON di-cache per tahun dan versi data; klien dengan ETag
+        # yang sama mendapat 304 tanpa dokumen dibangun ulang
+        varian = ''
+        bangun = lambda: _bangun_segmen_geojson(tahun)
+        nama = 'segmen_geojson'
+        simpan_cache = True
+    
+    if compact:
+        bangun_geojson = bangun
+        bangun = lambda: kompak_segmen_geojson(bangun_geojson(), fields)
+        varian = f"{varian}|compact|{','.join(fields)}"
+    
+    return respons_json_cache(request, nama, tahun, bangun, varian=varian, simpan_cache=simpan_cache)
+
+
+def _koordinat_segmen(segmen, geom, band):
+    """
+    Koordinat [[lon, lat], ...] segmen untuk peta: geometry sederhana zoom
+    band, atau geometry penuh (fallback garis titik awal -> akhir) jika band None.
+    """
+    if band:
+        return geom.band.get(str(band))
+    if geom.geometry:
+        return [[float(pt[0]), float(pt[1])] for pt in geom.geometry['coordinates']]
+    if segmen.lat_awal and segmen.lon_awal and segmen.lat_akhir and segmen.lon_akhir:
+        return [[float(segmen.lon_awal), float(segmen.lat_awal)], [float(segmen.lon_akhir), float(segmen.lat_akhir)]]
+    return None
+
+
+def _bangun_segmen_geojson_viewport(tahun, bbox, zoom):
+    """
+    Bangun FeatureCollection segmen yang beririsan dengan viewport `bbox`
+    (minLon, minLat, maxLon, maxLat). Geometry memakai hasil Douglas-Peucker
+    yang sudah di-precompute untuk zoom band terdekat; di atas band terakhir
+    (atau tanpa zoom) memakai geometry asli. Marker awal/akhir segmen hanya
+    dikirim mulai MARKER_MIN_ZOOM, marker ruas tidak dikirim.
+    """
+    band = band_zoom(zoom) if zoom is not None else None
+    
+    segmen_qs = SegmenJalan.untuk_peta(tahun).defer('ruas_jalan__geometry')
+    segmen_qs = segmen_qs.defer('geometry', 'geometry_peta')
+    if bbox:
+        segmen_qs = segmen_qs.filter(SegmenJalan.di_viewport(*bbox))
+    segmen_list = list(segmen_qs)
+    
+    # Ada kecelakaan tapi belum ada Z-Score → hitung sekali lalu ambil ulang
+    if any(s.accident_count and s.zscore_nilai is None for s in segmen_list):
+        try:
+            AnalisisZScore.calculate_zscore(tahun, gabung=True)
+            segmen_list = list(segmen_qs.all())
+        except Exception as e:
+            print(f"⚠ Could not auto-calculate Z-Score: {e}")
+    print(f"📊 Viewport bbox={bbox} zoom={zoom} band={band}: {len(segmen_list)} segments")
+    
+    tampilkan_marker = zoom is None or zoom >= MARKER_MIN_ZOOM
+    geometri = geometri_segmen(segmen_list)
+    features = []
+    
+    for segmen in segmen_list:
+        coords = _koordinat_segmen(segmen, geometri[segmen.id], band)
+        if not coords:
+            continue
+        
+        accident_count = segmen.accident_count
+        if accident_count == 0:
+            kategori, zscore, color = 'aman', -2.0, '#1976d2'
+        elif segmen.zscore_nilai is not None:
+            kategori = segmen.zscore_kategori
+            zscore = float(segmen.zscore_nilai)
+            color = AnalisisZScore.WARNA_KATEGORI.get(kategori, '#999999')
+        else:
+            kategori, zscore, color = 'unknown', 0, '#999999'
+        
+        properties = {
+            'type': 'line',
+            'segmen_id': segmen.id,
+            'ruas_id': segmen.ruas_jalan.id,
+            'ruas_nama': segmen.ruas_jalan.nama_ruas,
+            'km_awal': float(segmen.km_awal),
+            'km_akhir': float(segmen.km_akhir),
+            'panjang': float(segmen.panjang_segmen),
+            'kategori': kategori,
+            'zscore': zscore,
+            'color': color,
+            'accident_count': accident_count,
+            'nama_segmen': segmen.nama_segmen or f"Segmen {segmen.km_awal}-{segmen.km_akhir}",
+            'keterangan': segmen.keterangan or '',
+            'url': f'/kecelakaan/segmen/{segmen.id}/'
+        }
+        features.append({
+            'type': 'Feature',
+            'id': f"line_{segmen.id}",
+            'properties': properties,
+            'geometry': {'type': 'LineString', 'coordinates': coords}
+        })
+        
+        if tampilkan_marker:
+            for marker_type, titik in (('start', coords[0]), ('end', coords[-1])):
+                features.append({
+                    'type': 'Feature',
+                    'id': f"point_{marker_type}_{segmen.id}",
+                    'properties': {**properties, 'type': 'segment_marker', 'marker_type': marker_type},
+                    'geometry': {'type': 'Point', 'coordinates': titik}
+                })
+    
+    print(f"✅ Response: {len(features)} features")
+    return {
+        'type': 'FeatureCollection',
+        'features': features,
+        'tahun': tahun,
+        'bbox': bbox,
+        'zoom': zoom,
+        'status_data': AntrianZScore.status_data(tahun)
+    }
+
+
+def _bangun_segmen_geojson(tahun):
+    """Bangun FeatureCollection segmen (garis + marker) untuk tahun tertentu"""
+    # Satu query: segmen + ruas + jumlah kecelakaan tahun ini + Z-Score aktif.
+    # Teks geometry tidak dimuat; geometry ternormalisasi diambil dari cache
+    segmen_qs = SegmenJalan.untuk_peta(tahun).defer('geometry', 'geometry_peta', 'ruas_jalan__geometry')
+    segmen_list = list(segmen_qs)
+    
+    # Ada kecelakaan tapi belum ada Z-Score → hitung sekali lalu ambil ulang
+    if any(s.accident_count and s.zscore_nilai is None for s in segmen_list):
+        try:
+            AnalisisZScore.calculate_zscore(tahun, gabung=True)
+            segmen_list = list(segmen_qs.all())
         except Exception as e:
             print(f"⚠ Could not auto-calculate Z-Score: {e}")
+    print(f"📊 Found {len(segmen_list)} segments in database")
     
-    segmen_list = SegmenJalan.objects.select_related('ruas_jalan').all()
-    print(f"📊 Found {segmen_list.count()} segments in database")
+    geometri = geometri_segmen(segmen_list, lengkap=True)
+    geometri_ruas_jalan = {}
     
     features = []
     line_count = 0
     marker_count = 0
     
     for segmen in segmen_list:
-        # Hitung jumlah kecelakaan di segmen ini untuk tahun tertentu
-        if tahun == 0:
-            accident_count = KecelakaanPreprosesing.objects.filter(
-                segmen_jalan=segmen
-            ).count()
-        else:
-            accident_count = KecelakaanPreprosesing.objects.filter(
-                segmen_jalan=segmen,
-                tanggal__year=tahun
-            ).count()
+        accident_count = segmen.accident_count
         
         # PENTING: Jika tidak ada kecelakaan, selalu set AMAN (ignore Z-Score jika ada)
         if accident_count == 0:
             kategori = 'aman'
             zscore = -2.0
             color = '#1976d2'  # Blue
+        elif segmen.zscore_nilai is not None:
+            # Ada kecelakaan - pakai analisis Z-Score
+            kategori = segmen.zscore_kategori
+            zscore = float(segmen.zscore_nilai)
+            color = AnalisisZScore.WARNA_KATEGORI.get(kategori, '#999999')
         else:
-            # Ada kecelakaan - cari analisis Z-Score
-            try:
-                analisis = AnalisisZScore.objects.get(segmen_jalan=segmen, tahun=tahun)
-                kategori = analisis.kategori
-                zscore = float(analisis.nilai_zscore)
-                color = analisis.get_kategori_display_color()
-            except AnalisisZScore.DoesNotExist:
-                # Ada kecelakaan tapi belum ada Z-Score → coba hitung
-                try:
-                    AnalisisZScore.calculate_zscore(tahun)
-                    analisis = AnalisisZScore.objects.get(segmen_jalan=segmen, tahun=tahun)
-                    kategori = analisis.kategori
-                    zscore = float(analisis.nilai_zscore)
-                    color = analisis.get_kategori_display_color()
-                except Exception:
-                    kategori = 'unknown'
-                    zscore = 0
-                    color = '#999999'
+            kategori = 'unknown'
+            zscore = 0
+            color = '#999999'
         
-        # PENTING: Generate geometry dari lat/lon jika kosong
-        geometry = None
-        if segmen.geometry:
-            try:
-                parsed_geom = json.loads(segmen.geometry)
-                # Convert MultiLineString to LineString untuk rendering yang lebih baik
-                if parsed_geom.get('type') == 'MultiLineString':
-                    coords = []
-                    for line in parsed_geom.get('coordinates', []):
-                        coords.extend(line)
-                    geometry = {'type': 'LineString', 'coordinates': coords}
-                    print(f"✓ Converted MultiLineString to LineString for segmen {segmen.id}")
-                else:
-                    geometry = parsed_geom
-            except Exception as e:
-                print(f"⚠ Error parsing geometry for segmen {segmen.id}: {e}")
-                geometry = None
+        # Geometry ternormalisasi (MultiLineString sudah digabung jadi LineString)
+        geometry = geometri[segmen.id].geometry
         
         # Fallback: Jika geometry kosong, buat dari lat/lon awal-akhir
         if not geometry:
@@ -984,24 +1121,11 @@ def api_segmen_geojson(request):
                 print(f"✓ Generated fallback geometry for segmen {segmen.id} from lat/lon")
             else:
                 # Coba ambil dari ruas_jalan geometry
-                if segmen.ruas_jalan.geometry:
-                    try:
-                        ruas_geom = json.loads(segmen.ruas_jalan.geometry)
-                        if ruas_geom.get('type') == 'Feature':
-                            ruas_geom = ruas_geom.get('geometry', {})
-                        
-                        if ruas_geom.get('type') == 'LineString':
-                            geometry = ruas_geom
-                        elif ruas_geom.get('type') == 'MultiLineString':
-                            coords = []
-                            for line in ruas_geom.get('coordinates', []):
-                                coords.extend(line)
-                            geometry = {'type': 'LineString', 'coordinates': coords}
-                        
-                        if geometry:
-                            print(f"✓ Generated geometry for segmen {segmen.id} from ruas_jalan")
-                    except Exception as e:
-                        print(f"⚠ Error getting ruas geometry for segmen {segmen.id}: {e}")
+                if segmen.ruas_jalan_id not in geometri_ruas_jalan:
+                    geometri_ruas_jalan.update(geometri_ruas([segmen.ruas_jalan]))
+                geometry = geometri_ruas_jalan[segmen.ruas_jalan_id].geometry
+                if geometry:
+                    print(f"✓ Generated geometry for segmen {segmen.id} from ruas_jalan")
         
         if geometry:
             # 1. Feature LineString (Garis Jalan)
@@ -1111,11 +1235,11 @@ def api_segmen_geojson(request):
             
             # Marker untuk AWAL ruas jalan
             first_segmen = sorted_segments[0]
-            if first_segmen.geometry:
+            geom = geometri[first_segmen.id]
+            if geom.geometry:
                 try:
-                    geom = json.loads(first_segmen.geometry)
-                    if geom.get('type') == 'LineString' and geom.get('coordinates'):
-                        start_coord = geom['coordinates'][0]
+                    if geom.tipe_asli == 'LineString':
+                        start_coord = geom.awal
                         feature_ruas_start = {
                             'type': 'Feature',
                             'id': f"ruas_start_{ruas_id}",
@@ -1138,11 +1262,11 @@ def api_segmen_geojson(request):
             
             # Marker untuk AKHIR ruas jalan
             last_segmen = sorted_segments[-1]
-            if last_segmen.geometry:
+            geom = geometri[last_segmen.id]
+            if geom.geometry:
                 try:
-                    geom = json.loads(last_segmen.geometry)
-                    if geom.get('type') == 'LineString' and geom.get('coordinates'):
-                        end_coord = geom['coordinates'][-1]
+                    if geom.tipe_asli == 'LineString':
+                        end_coord = geom.akhir
                         feature_ruas_end = {
                             'type': 'Feature',
                             'id': f"ruas_end_{ruas_id}",
@@ -1165,20 +1289,21 @@ def api_segmen_geojson(request):
     
     geojson = {
         'type': 'FeatureCollection',
-        'features': features
+        'features': features,
+        'tahun': tahun,
+        # 'pending' = masih ada perhitungan Z-Score yang antri untuk tahun ini
+        'status_data': AntrianZScore.status_data(tahun)
     }
     
     print(f"✅ Response: {line_count} lines, {marker_count} markers - {len(features)} total features")
     print(f"{'='*80}\n")
     
-    return Response(geojson)
+    return geojson
 
 
 @api_view(['GET'])
 def api_threshold_data(request):
     """API untuk mendapatkan threshold data per ruas jalan untuk dynamic legend"""
-    from django.db.models import Avg, StdDev
-    
     tahun_raw = request.GET.get('tahun')
     if not tahun_raw or tahun_raw == 'None' or tahun_raw == '0':
         tahun = 0
@@ -1188,29 +1313,60 @@ def api_threshold_data(request):
         except (ValueError, TypeError):
             tahun = 0
     
-    # Ensure Z-Score calculation exists
-    if not AnalisisZScore.objects.filter(tahun=tahun).exists():
-        try:
-            AnalisisZScore.calculate_zscore(tahun)
-        except Exception as e:
-            print(f"Warning: Could not auto-calculate Z-Score: {e}")
+    # Ensure Z-Score calculation exists (single-flight antar worker)
+    try:
+        AnalisisZScore.pastikan_zscore(tahun)
+    except Exception as e:
+        print(f"Warning: Could not auto-calculate Z-Score: {e}")
     
-    ruas_jalan_list = RuasJalan.objects.all().distinct()
-    threshold_data = {}
+    # Legend berubah jika snapshot Z-Score aktif, segmen/ruas, atau data
+    # kecelakaan (mean/stddev RekapSegmen diperbarui per delta) berubah
+    return respons_json_cache(
+        request, 'threshold_data', tahun, lambda: _bangun_threshold_data(tahun),
+        sumber=(VERSI_SEGMEN, VERSI_RUAS, VERSI_KECELAKAAN),
+    )
+
+
+def _bangun_threshold_data(tahun):
+    """
+    Data legend per ruas dari tiga query: daftar ruas + jumlah segmen,
+    agregat Z-Score snapshot aktif per ruas (min/max + jumlah per kategori),
+    dan statistik RekapSegmen per ruas (mean/stddev jumlah kecelakaan).
+    """
+    from django.db.models import Avg, StdDev, Max, Min
     
-    for ruas_jalan in ruas_jalan_list:
-        segments_in_ruas = SegmenJalan.objects.filter(ruas_jalan=ruas_jalan)
-        
-        # Get all z-scores for this ruas jalan
-        analisis_list = AnalisisZScore.objects.filter(
-            tahun=tahun,
-            segmen_jalan__in=segments_in_ruas
+    ruas_jalan_list = RuasJalan.objects.annotate(total_segments=Count('segmen_jalan')).values_list(
+        'id', 'nama_ruas', 'total_segments'
+    )
+    
+    zscore_per_ruas = {
+        row['segmen_jalan__ruas_jalan_id']: row
+        for row in AnalisisZScore.objects.aktif().filter(tahun=tahun).order_by().values(
+            'segmen_jalan__ruas_jalan_id'
+        ).annotate(
+            z_max=Max('nilai_zscore'),
+            z_min=Min('nilai_zscore'),
+            **{kategori: Count('id', filter=Q(kategori=kategori)) for kategori in KATEGORI_KELAS},
+        )
+    }
+    
+    rekap_per_ruas = {
+        row['segmen_jalan__ruas_jalan_id']: row
+        for row in RekapSegmen.objects.filter(periode_tahun=tahun).order_by().values(
+            'segmen_jalan__ruas_jalan_id'
+        ).annotate(
+            mean=Avg('jumlah_kecelakaan'),
+            stddev=StdDev('jumlah_kecelakaan')
         )
+    }
+    
+    threshold_data = {}
+    for ruas_id, nama_ruas, total_segments in ruas_jalan_list:
+        zscore = zscore_per_ruas.get(ruas_id)
         
-        if analisis_list.exists():
-            zscore_values = [float(a.nilai_zscore) for a in analisis_list]
-            z_max = max(zscore_values)
-            z_min = min(zscore_values)
+        if zscore:
+            z_max = float(zscore['z_max'])
+            z_min = float(zscore['z_min'])
             
             # Calculate interval
             if z_max != z_min:
@@ -1224,28 +1380,13 @@ def api_threshold_data(request):
             t3 = z_min + (3 * interval)
             t4 = z_min + (4 * interval)
             
-            # Calculate mean and stddev
-            stats = RekapSegmen.objects.filter(
-                periode_tahun=tahun,
-                segmen_jalan__in=segments_in_ruas
-            ).aggregate(
-                mean=Avg('jumlah_kecelakaan'),
-                stddev=StdDev('jumlah_kecelakaan')
-            )
-            mean = float(stats['mean'] or 0.0)
-            stddev = float(stats['stddev'] or 0.0)
-
-            # Count segments per kategori
-            kategori_counts = {
-                'sangat_tinggi': analisis_list.filter(kategori='sangat_tinggi').count(),
-                'tinggi': analisis_list.filter(kategori='tinggi').count(),
-                'sedang': analisis_list.filter(kategori='sedang').count(),
-                'rendah': analisis_list.filter(kategori='rendah').count(),
-                'sangat_rendah': analisis_list.filter(kategori='sangat_rendah').count(),
-            }
+            # Mean and stddev dari rekap
+            stats = rekap_per_ruas.get(ruas_id, {})
+            mean = float(stats.get('mean') or 0.0)
+            stddev = float(stats.get('stddev') or 0.0)
             
-            threshold_data[ruas_jalan.id] = {
-                'nama': ruas_jalan.nama_ruas,
+            threshold_data[ruas_id] = {
+                'nama': nama_ruas,
                 'has_data': True,
                 'z_max': round(z_max, 3),
                 'z_min': round(z_min, 3),
@@ -1256,12 +1397,12 @@ def api_threshold_data(request):
                 't3': round(t3, 3),  # tinggi threshold
                 't2': round(t2, 3),  # sedang threshold
                 't1': round(t1, 3),  # rendah threshold
-                'kategori_counts': kategori_counts,
-                'total_segments': segments_in_ruas.count(),
+                'kategori_counts': {kategori: zscore[kategori] for kategori in reversed(KATEGORI_KELAS)},
+                'total_segments': total_segments,
             }
         else:
-            threshold_data[ruas_jalan.id] = {
-                'nama': ruas_jalan.nama_ruas,
+            threshold_data[ruas_id] = {
+                'nama': nama_ruas,
                 'has_data': False,
                 'z_max': 0.0,
                 'z_min': 0.0,
@@ -1272,20 +1413,15 @@ def api_threshold_data(request):
                 't3': 0.0,
                 't2': 0.0,
                 't1': 0.0,
-                'kategori_counts': {
-                    'sangat_tinggi': 0,
-                    'tinggi': 0,
-                    'sedang': 0,
-                    'rendah': 0,
-                    'sangat_rendah': 0,
-                },
-                'total_segments': segments_in_ruas.count(),
+                'kategori_counts': {kategori: 0 for kategori in reversed(KATEGORI_KELAS)},
+                'total_segments': total_segments,
             }
     
-    return Response({
+    return {
         'tahun': tahun,
+        'status_data': AntrianZScore.status_data(tahun),
         'ruas_data': threshold_data
-    })
+    }
 
 
 @api_view(['GET'])
@@ -1332,6 +1468,213 @@ def api_kecelakaan_geojson(request):
     return Response(geojson)
 
 
+@api_view(['GET'])
+def api_kecelakaan_cluster(request):
+    """
+    API klaster titik kecelakaan per zoom: ?tahun=&zoom=&bbox=minLon,minLat,maxLon,maxLat
+    Mengembalikan feature klaster (point_count, jumlah korban) dari indeks
+    piramida grid di memori; di atas MAKS_ZOOM_KLASTER titik dikirim satu per satu.
+    tahun=0 berarti semua tahun.
+    """
+    try:
+        tahun = int(request.GET.get('tahun', timezone.now().year))
+        zoom = int(float(request.GET.get('zoom', 0)))
+        bbox = None
+        if request.GET.get('bbox'):
+            bbox = [float(v) for v in request.GET['bbox'].split(',')]
+            if len(bbox) != 4:
+                raise ValueError('bbox harus berisi 4 nilai')
+    except (ValueError, TypeError) as e:
+        return Response({'error': f'Parameter tidak valid: {e}'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    def bangun():
+        features = get_indeks_klaster(tahun).cari(bbox, zoom)
+        return {
+            'type': 'FeatureCollection',
+            'features': features,
+            'tahun': tahun,
+            'zoom': zoom,
+        }
+    
+    varian = f"{','.join(f'{v:.5f}' for v in bbox) if bbox else '-'}|{zoom}"
+    return respons_json_cache(
+        request, 'kecelakaan_cluster', tahun, bangun,
+        varian=varian, sumber=(VERSI_KECELAKAAN,), simpan_cache=False,
+    )
+
+
+# Jumlah baris kecelakaan per query saat streaming GeoJSON
+CHUNK_STREAM_KECELAKAAN = 2000
+
+
+@api_view(['GET'])
+def api_kecelakaan_geojson_stream(request):
+    """
+    Versi streaming api_kecelakaan_geojson: FeatureCollection ditulis bertahap
+    per chunk lewat StreamingHttpResponse, sehingga memori tetap datar dan byte
+    pertama langsung terkirim berapa pun jumlah kecelakaannya.
+    """
+    tahun = request.GET.get('tahun', timezone.now().year)
+    try:
+        tahun = int(tahun)
+    except (ValueError, TypeError):
+        return Response({'error': 'Parameter tahun tidak valid'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    response = StreamingHttpResponse(_stream_kecelakaan_geojson(tahun), content_type='application/json')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _stream_kecelakaan_geojson(tahun, chunk_size=CHUNK_STREAM_KECELAKAAN):
+    """
+    Generator potongan JSON FeatureCollection kecelakaan. Baris dibaca dengan
+    keyset pagination (id > id_terakhir) karena driver MySQL tetap memuat
+    seluruh hasil .iterator() ke memori klien.
+    """
+    kecelakaan = KecelakaanPreprosesing.objects.filter(
+        tanggal__year=tahun,
+        latitude__isnull=False,
+        longitude__isnull=False
+    ).order_by('id')
+    kolom = (
+        'id', 'tanggal', 'waktu', 'desa', 'kecamatan', 'korban_meninggal',
+        'korban_luka_berat', 'korban_luka_ringan', 'kerugian_materi', 'latitude', 'longitude',
+    )
+    
+    yield '{"type":"FeatureCollection","features":['
+    id_terakhir = 0
+    pertama = True
+    while True:
+        baris = list(kecelakaan.filter(id__gt=id_terakhir).values_list(*kolom)[:chunk_size])
+        if not baris:
+            break
+        potongan = []
+        for kid, tanggal, waktu, desa, kecamatan, meninggal, luka_berat, luka_ringan, kerugian, lat, lon in baris:
+            potongan.append(json.dumps({
+                'type': 'Feature',
+                'id': kid,
+                'properties': {
+                    'kecelakaan_id': kid,
+                    'tanggal': tanggal.isoformat(),
+                    'waktu': waktu.isoformat(),
+                    'lokasi': f"{desa}, {kecamatan}",
+                    'korban_meninggal': meninggal,
+                    'korban_luka_berat': luka_berat,
+                    'korban_luka_ringan': luka_ringan,
+                    'total_korban': meninggal + luka_berat + luka_ringan,
+                    'kerugian': float(kerugian),
+                    'url': f'/kecelakaan/{kid}/'
+                },
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': [float(lon), float(lat)]
+                }
+            }, separators=(',', ':'), ensure_ascii=False))
+        yield ('' if pertama else ',') + ','.join(potongan)
+        pertama = False
+        id_terakhir = baris[-1][0]
+    yield ']}'
+
+
+# Layer vector tile -> kunci VersiData sumber datanya
+LAYER_TILE = {
+    'segmen': (VERSI_SEGMEN, VERSI_RUAS),
+    'kecelakaan': (VERSI_KECELAKAAN,),
+}
+
+
+@api_view(['GET'])
+def api_tiles(request, layer, z, x, y):
+    """
+    API Mapbox Vector Tile /api/tiles/<layer>/<z>/<x>/<y>.mvt
+    Layer 'segmen' berisi garis segmen (kategori, zscore, accident_count),
+    layer 'kecelakaan' berisi titik KecelakaanPreprosesing. Tile di-cache di
+    disk per versi data.
+    """
+    if layer not in LAYER_TILE or not tile_valid(z, x, y):
+        raise Http404("Tile tidak ditemukan")
+    
+    tahun_raw = request.GET.get('tahun')
+    try:
+        tahun = int(tahun_raw) if tahun_raw and tahun_raw != 'None' else 0
+    except (ValueError, TypeError):
+        tahun = 0
+    
+    if layer == 'segmen':
+        try:
+            AnalisisZScore.pastikan_zscore(tahun)
+        except Exception as e:
+            print(f"⚠ Could not auto-calculate Z-Score: {e}")
+    
+    return respons_cache(
+        request, f'tile_{layer}', tahun,
+        lambda: encode_tile({layer: _bangun_tile(layer, tahun, z, x, y)}),
+        'application/vnd.mapbox-vector-tile',
+        varian=f"{z}/{x}/{y}", sumber=LAYER_TILE[layer], alias_cache=CACHE_TILE,
+    )
+
+
+def _bangun_tile(layer, tahun, z, x, y):
+    """Feature (id, tipe, titik_tile, properties) satu layer untuk tile (z, x, y)"""
+    min_lon, min_lat, max_lon, max_lat = bounds_tile(z, x, y)
+    features = []
+    
+    if layer == 'kecelakaan':
+        kecelakaan = KecelakaanPreprosesing.objects.filter(
+            latitude__gte=min_lat, latitude__lte=max_lat,
+            longitude__gte=min_lon, longitude__lte=max_lon,
+        )
+        if tahun:
+            kecelakaan = kecelakaan.filter(tanggal__year=tahun)
+        for k in kecelakaan.values_list(
+            'id', 'latitude', 'longitude', 'tanggal', 'segmen_jalan_id',
+            'korban_meninggal', 'korban_luka_berat', 'korban_luka_ringan',
+        ):
+            kid, lat, lon, tanggal, segmen_id, meninggal, luka_berat, luka_ringan = k
+            features.append((kid, GEOM_POINT, [proyeksi_tile(float(lon), float(lat), z, x, y)], {
+                'kecelakaan_id': kid,
+                'tanggal': tanggal.isoformat(),
+                'segmen_id': segmen_id,
+                'korban_meninggal': meninggal,
+                'korban_luka_berat': luka_berat,
+                'korban_luka_ringan': luka_ringan,
+            }))
+        return features
+    
+    band = band_zoom(z)
+    segmen_list = list(SegmenJalan.untuk_peta(tahun).defer('geometry', 'geometry_peta', 'ruas_jalan__geometry').filter(
+        SegmenJalan.di_viewport(min_lon, min_lat, max_lon, max_lat)
+    ))
+    geometri = geometri_segmen(segmen_list)
+    
+    for segmen in segmen_list:
+        coords = _koordinat_segmen(segmen, geometri[segmen.id], band)
+        if not coords:
+            continue
+        
+        # Sama dengan api_segmen_geojson: tanpa kecelakaan selalu 'aman'
+        if segmen.accident_count == 0:
+            kategori, zscore, color = 'aman', -2.0, '#1976d2'
+        elif segmen.zscore_nilai is not None:
+            kategori = segmen.zscore_kategori
+            zscore = float(segmen.zscore_nilai)
+            color = AnalisisZScore.WARNA_KATEGORI.get(kategori, '#999999')
+        else:
+            kategori, zscore, color = 'unknown', 0.0, '#999999'
+        
+        features.append((segmen.id, GEOM_LINESTRING, [proyeksi_tile(lon, lat, z, x, y) for lon, lat in coords], {
+            'segmen_id': segmen.id,
+            'ruas_id': segmen.ruas_jalan_id,
+            'ruas_nama': segmen.ruas_jalan.nama_ruas,
+            'nama_segmen': segmen.nama_segmen or f"Segmen {segmen.km_awal}-{segmen.km_akhir}",
+            'kategori': kategori,
+            'zscore': zscore,
+            'color': color,
+            'accident_count': segmen.accident_count,
+        }))
+    return features
+
+
 @api_view(['GET'])
 @login_required(login_url='login')
 def api_geoapify_routing(request):
@@ -1469,13 +1812,14 @@ def api_data_update_check(request):
         latest_update = latest_kecelakaan['latest_update'] or latest_kecelakaan['latest_create']
         
         # Get latest AnalisisZScore calculation timestamp
-        latest_zscore = AnalisisZScore.objects.filter(tahun=tahun).values('id').last()
+        latest_zscore = AnalisisZScore.objects.aktif().filter(tahun=tahun).values('id').last()
         
         return JsonResponse({
             'status': 'success',
             'tahun': tahun,
             'last_data_update': latest_update.timestamp() if latest_update else None,
-            'has_zscore': latest_zscore is not None
+            'has_zscore': latest_zscore is not None,
+            'status_data': AntrianZScore.status_data(tahun)
         })
     except Exception as e:
         return JsonResponse({
@@ -1484,18 +1828,31 @@ def api_data_update_check(request):
         }, status=500)
 
 
+@superadmin_required
+def api_statistik_kunci(request):
+    """
+    API statistik tunggu single-flight lock (jumlah, menunggu, timeout,
+    total/maks tunggu) milik worker yang melayani request ini
+    """
+    from .utils_lock import get_statistik_kunci
+
+    return JsonResponse({
+        'status': 'success',
+        'pid': os.getpid(),
+        'kunci': get_statistik_kunci(),
+    })
+
+
 @api_view(['GET'])
 @login_required(login_url='login')
 def api_analisis_statistik(request):
     """API untuk mendapatkan statistik analisis"""
 
     tahun_param = request.GET.get('tahun')
-    analisis = AnalisisZScore.objects.all()
 
     if tahun_param and tahun_param != 'None' and tahun_param != '0':
         try:
             tahun = int(tahun_param)
-            analisis = analisis.filter(tahun=tahun)
         except ValueError:
             return Response(
                 {'error': 'Parameter tahun harus berupa angka'},
@@ -1503,21 +1860,17 @@ def api_analisis_statistik(request):
             )
     else:
         tahun = 0
-        analisis = analisis.filter(tahun=0)
-
-    statistik = {
-        'sangat_tinggi': analisis.filter(kategori='sangat_tinggi').count(),
-        'tinggi': analisis.filter(kategori='tinggi').count(),
-        'sedang': analisis.filter(kategori='sedang').count(),
-        'rendah': analisis.filter(kategori='rendah').count(),
-        'sangat_rendah': analisis.filter(kategori='sangat_rendah').count(),
-    }
 
-    return Response({
-        'tahun': tahun,
-        'total_segmen': analisis.count(),
-        'kategori': statistik
-    })
+    def bangun():
+        # Satu query conditional aggregate (di-cache per versi snapshot aktif)
+        statistik = AnalisisZScore.statistik_kategori(tahun)
+        return {
+            'tahun': tahun,
+            'total_segmen': statistik['total'],
+            'kategori': {kategori: statistik[kategori] for kategori in reversed(KATEGORI_KELAS)}
+        }
+
+    return respons_json_cache(request, 'analisis_statistik', tahun, bangun, sumber=(VERSI_SEGMEN,))
 # Analisis Views
 @login_required(login_url='login')
 def analisis_view(request):
@@ -1530,21 +1883,13 @@ def analisis_view(request):
         AnalisisZScore.calculate_zscore(tahun)
         messages.success(request, f'Analisis untuk tahun {tahun} berhasil dihitung.')
     
-    # Ambil analisis
-    analisis = AnalisisZScore.objects.filter(tahun=tahun).order_by('-nilai_zscore')
-    
-    # Statistik
-    statistik = {
-        'sangat_tinggi': analisis.filter(kategori='sangat_tinggi'),
-        'tinggi': analisis.filter(kategori='tinggi'),
-        'sedang': analisis.filter(kategori='sedang'),
-        'rendah': analisis.filter(kategori='rendah'),
-        'sangat_rendah': analisis.filter(kategori='sangat_rendah'),
-    }
+    # Ambil analisis: satu query (segmen + ruas + jumlah kecelakaan), dikelompokkan per kategori
+    statistik = AnalisisZScore.per_kategori(tahun)
     
     context = {
-        'analisis': analisis,
+        'analisis': sorted((item for items in statistik.values() for item in items), key=lambda a: a.nilai_zscore, reverse=True),
         'statistik': statistik,
+        'jumlah': AnalisisZScore.statistik_kategori(tahun),
         'tahun': tahun,
         'tahun_options': range(2020, timezone.now().year + 1),
         'is_admin': is_admin(request.user)
@@ -1591,7 +1936,7 @@ def segmen_kecelakaan_detail(request, segmen_id):
     total_luka = (rekap['total_luka_berat'] or 0) + (rekap['total_luka_ringan'] or 0)
     
     try:
-        analisis = AnalisisZScore.objects.get(segmen_jalan=segmen, tahun=tahun)
+        analisis = AnalisisZScore.objects.aktif().get(segmen_jalan=segmen, tahun=tahun)
     except AnalisisZScore.DoesNotExist:
         analisis = None
     